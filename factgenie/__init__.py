@@ -12,6 +12,8 @@ CROWDSOURCING_CONFIG_DIR = PACKAGE_DIR / "config" / "crowdsourcing"
 
 INPUT_DIR = PACKAGE_DIR / "data" / "inputs"
 OUTPUT_DIR = PACKAGE_DIR / "data" / "outputs"
+CACHE_DIR = PACKAGE_DIR / "data" / "cache"
+JOBS_DIR = PACKAGE_DIR / "data" / "jobs"
 
 DATASET_CONFIG_PATH = PACKAGE_DIR / "data" / "datasets.yml"
 RESOURCES_CONFIG_PATH = PACKAGE_DIR / "config" / "resources.yml"
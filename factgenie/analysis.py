@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 import os
+import multiprocessing
+import numpy as np
 import pandas as pd
+from scipy import stats
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import sys
 import logging
-import traceback
+import warnings
 import zipfile
+import factgenie.campaign_stats as campaign_stats
 import factgenie.workflows as workflows
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
@@ -14,105 +19,130 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 logger = logging.getLogger("factgenie")
 
 
-def generate_example_index(app, campaign):
-    logger.info(f"Preparing example index for campaign {campaign.campaign_id}")
+def is_category(annotation_type):
+    # numbers only (`True == 1` in Python)
+    return isinstance(annotation_type, (int, float)) and not isinstance(annotation_type, bool)
 
-    annotation_span_categories = campaign.metadata["config"]["annotation_span_categories"]
-    example_index = workflows.get_annotation_index(app, force_reload=True).copy()
 
-    # get the examples for a specific campaign
-    example_index = example_index[example_index["campaign_id"] == campaign.campaign_id]
+def get_span_table(example_index):
+    """
+    Flatten the annotations of the example index into a table with one row per span.
 
-    # Add category count columns to example index
-    for i in range(len(annotation_span_categories)):
-        col_name = f"cat_{i}"
-        example_index[col_name] = example_index["annotations"].apply(
-            lambda anns: sum(1 for a in anns if a["type"] == i)
-        )
+    Columns:
+        row: position of the example in `example_index`
+        annotation_type: category index (NaN if missing or not an integer)
+        annotation_start: start of the span (NaN if missing)
+        annotation_text: text of the span (None if missing)
+    """
+    annotations = example_index["annotations"].tolist()
+    lengths = np.fromiter((len(anns) for anns in annotations), dtype=np.int64, count=len(annotations))
+    spans = [a for anns in annotations for a in anns]
+
+    types = np.array([a.get("type") if is_category(a.get("type")) else np.nan for a in spans], dtype=float)
+    types[types != np.floor(types)] = np.nan
+    starts = np.array([a.get("start") if is_category(a.get("start")) else np.nan for a in spans], dtype=float)
+    texts = [a.get("text") if isinstance(a.get("text"), str) else None for a in spans]
+
+    return pd.DataFrame(
+        {
+            "row": np.repeat(np.arange(len(annotations)), lengths),
+            "annotation_type": types,
+            "annotation_start": starts,
+            "annotation_text": pd.Series(texts, dtype=object),
+        }
+    )
 
-    return example_index
 
+def get_campaign_tables(app, campaign, force_reload=True):
+    """
+    The example index of the campaign and the table of its spans (`get_span_table()`).
 
-def generate_span_index(app, campaign):
-    logger.info(f"Preparing span index for campaign {campaign.campaign_id}")
+    Both are built once for each version of the annotation index, the callers get copies.
+    """
+    annotation_index = workflows.get_keyed_annotation_index(app, force_reload=force_reload)
+    key = (campaign.campaign_id, annotation_index.version)
+    cached = app.db["span_tables"].get(campaign.campaign_id)
 
-    span_index = workflows.get_annotation_index(app).copy()
+    if cached is None or cached[0] != key:
+        example_index = annotation_index.get_campaign_frame(campaign.campaign_id)
+        cached = (key, example_index, get_span_table(example_index))
+        app.db["span_tables"][campaign.campaign_id] = cached
 
-    # get the examples for a specific campaign
-    span_index = span_index[span_index["campaign_id"] == campaign.campaign_id]
+    _, example_index, span_table = cached
+
+    return example_index.copy(), span_table.copy()
+
+
+def generate_example_index(app, campaign):
+    logger.info(f"Preparing example index for campaign {campaign.campaign_id}")
 
-    # Remove examples with no annotations
-    span_index = span_index[span_index["annotations"].apply(lambda x: len(x) > 0)]
+    annotation_span_categories = campaign.metadata["config"]["annotation_span_categories"]
+    example_index, span_table = get_campaign_tables(app, campaign, force_reload=True)
 
-    if not span_index.empty:
-        # Create a separate row for each annotation
-        span_index = span_index.explode("annotations").reset_index(drop=True)
+    # Add category count columns to example index
+    category_cnt = len(annotation_span_categories)
+    span_table = span_table[span_table["annotation_type"].isin(range(category_cnt))]
+    counts = np.zeros((len(example_index), category_cnt), dtype=np.int64)
+    np.add.at(counts, (span_table["row"].to_numpy(), span_table["annotation_type"].to_numpy(dtype=np.int64)), 1)
 
-        # Extract annotation fields into separate columns
-        span_index["annotation_type"] = span_index["annotations"].apply(lambda x: x["type"])
-        span_index["annotation_start"] = span_index["annotations"].apply(lambda x: x["start"])
-        span_index["annotation_text"] = span_index["annotations"].apply(lambda x: x["text"])
+    for i in range(category_cnt):
+        example_index[f"cat_{i}"] = counts[:, i]
 
-        # Drop the original annotations column
-        span_index = span_index.drop("annotations", axis=1)
+    return example_index
 
-        # Remove any annotations that have NaN start or type or empty text
-        span_index = span_index.dropna(subset=["annotation_start", "annotation_type", "annotation_text"])
-        span_index = span_index[span_index["annotation_text"].apply(lambda x: len(x) > 0)]
 
-    return span_index
+def generate_span_index(app, campaign):
+    logger.info(f"Preparing span index for campaign {campaign.campaign_id}")
 
+    example_index, span_table = get_campaign_tables(app, campaign, force_reload=True)
 
-def preprocess_annotations(df, campaign):
-    # remove lines with nans
-    df = df.dropna()
+    # Remove any annotations that have NaN start or type or empty text
+    span_table = span_table.dropna(subset=["annotation_start", "annotation_type", "annotation_text"])
+    span_table = span_table[span_table["annotation_text"].str.len() > 0]
 
-    # remove annotations with type that is not in the correct range (0 - len(annotation_span_categories))
-    annotation_span_categories = campaign.metadata["config"]["annotation_span_categories"]
+    # Create a separate row for each annotation
+    span_index = example_index.drop("annotations", axis=1).iloc[span_table["row"].to_numpy()].reset_index(drop=True)
 
-    category_cnt = len(annotation_span_categories)
-    df = df[df["annotation_type"].apply(lambda x: x in range(category_cnt))]
+    for col in ["annotation_type", "annotation_start"]:
+        span_index[col] = span_table[col].to_numpy(dtype=np.int64)
 
-    # make annotation_type an integer
-    df["annotation_type"] = df["annotation_type"].astype(int)
+    span_index["annotation_text"] = span_table["annotation_text"].to_numpy()
 
-    return df
+    return span_index
 
 
-def compute_ann_counts(df):
+def compute_ann_counts(span_counts):
     """
     Compute annotation counts for each annotation type (separately for each dataset, split, setup_id).
+
+    `span_counts` contains the non-zero counts (columns dataset, split, setup_id, annotation_type, ann_count).
     """
     logger.info("Computing annotation counts")
 
-    # Create multi-index groupby once
-    grouped = df.groupby(["dataset", "split", "setup_id", "annotation_type"]).size().reset_index(name="ann_count")
-
     # Create complete multi-index for all combinations
     idx = pd.MultiIndex.from_product(
-        [df["dataset"].unique(), df["split"].unique(), df["setup_id"].unique(), sorted(df["annotation_type"].unique())],
+        [
+            span_counts["dataset"].unique(),
+            span_counts["split"].unique(),
+            span_counts["setup_id"].unique(),
+            sorted(span_counts["annotation_type"].unique()),
+        ],
         names=["dataset", "split", "setup_id", "annotation_type"],
     )
 
     # Reindex to include all combinations with zeros
     results = (
-        grouped.set_index(["dataset", "split", "setup_id", "annotation_type"]).reindex(idx, fill_value=0).reset_index()
+        span_counts.set_index(["dataset", "split", "setup_id", "annotation_type"])
+        .reindex(idx, fill_value=0)
+        .reset_index()
     )
 
     return results
 
 
-def compute_avg_ann_counts(ann_counts, example_index):
+def compute_avg_ann_counts(ann_counts, example_counts):
     logger.info("Computing average annotation counts")
 
-    # Get example counts through groupby operation
-    example_counts = (
-        example_index.groupby(["dataset", "split", "setup_id"])
-        .agg(example_count=("example_idx", "nunique"))
-        .reset_index()
-        .astype({"example_count": int})
-    )
-
     # Merge counts with original dataframe
     ann_counts = ann_counts.merge(example_counts, on=["dataset", "split", "setup_id"], how="left")
 
@@ -122,26 +152,19 @@ def compute_avg_ann_counts(ann_counts, example_index):
     return ann_counts
 
 
-def compute_prevalence(ann_counts, example_index):
+def compute_prevalence(ann_counts, affected_counts):
     logger.info("Computing annotation prevalence")
 
-    # Compute affected counts for all rows at once
-    ann_counts["prevalence"] = ann_counts.apply(
-        lambda row: (
-            (
-                (example_index["dataset"] == row["dataset"])
-                & (example_index["split"] == row["split"])
-                & (example_index["setup_id"] == row["setup_id"])
-                & (example_index[f"cat_{row['annotation_type']}"] > 0)
-            ).sum()
-            / row["example_count"]
-            if row["example_count"] > 0
-            else 0
-        ),
-        axis=1,
-    ).round(3)
+    # `affected_counts`: number of examples with at least one annotation of each category
+    ann_counts = ann_counts.merge(affected_counts, on=["dataset", "split", "setup_id", "annotation_type"], how="left")
 
-    return ann_counts
+    ann_counts["prevalence"] = (
+        (ann_counts["affected_count"].fillna(0) / ann_counts["example_count"])
+        .where(ann_counts["example_count"] > 0, 0)
+        .round(3)
+    )
+
+    return ann_counts.drop(columns="affected_count")
 
 
 def aggregate_ann_counts(ann_counts, groupby):
@@ -179,50 +202,30 @@ def aggregate_ann_counts(ann_counts, groupby):
     return aggregated
 
 
-def compute_extra_fields_stats(example_index):
-    # compute aggregate statistics for flags, options and text_fields (aggregates of value counts for each label)
-    extra_fields_stats = {}
-
-    try:
-        for field in ["flags", "options", "text_fields"]:
-            # each of `example_index[field]` is a list of dicts
-            # each dict contains `label` and `value` keys
-            # we want to count the number of occurrences of each `value` for each unique `label`
-            # and then assign the dictionary with these counts to extra_fields_stats[label]
-
-            # find unique labels
-            labels = set()
-            for example in example_index[field]:
-                for d in example:
-                    labels.add(d["label"])
-
-            # create a dictionary for each label
-            for label in labels:
-                extra_fields_stats[label] = defaultdict(int)
-
-            # count the occurrences of each value for each label
-            for example in example_index[field]:
-                for d in example:
-                    extra_fields_stats[d["label"]][d["value"]] += 1
-    except Exception as e:
-        logger.error(f"Error while computing extra fields statistics: {e}")
-        traceback.print_exc()
-
-    return extra_fields_stats
+def get_count_frame(counts, columns):
+    """DataFrame from the counts keyed by tuples, the rows sorted by the keys."""
+    return pd.DataFrame([[*key, count] for key, count in sorted(counts.items())], columns=columns)
 
 
 def compute_statistics(app, campaign):
     statistics = {}
 
-    span_index = generate_span_index(app, campaign)
-    example_index = generate_example_index(app, campaign)
+    # the counts are updated with the records added since the last call
+    totals = campaign_stats.get_campaign_stats(app, campaign).get_totals()
+    keys = ["dataset", "split", "setup_id"]
 
-    if not span_index.empty:
-        span_index = preprocess_annotations(span_index, campaign)
+    if totals.ann_counts:
+        example_counts = {group: len(example_idxs) for group, example_idxs in totals.examples.items()}
 
-        annotation_counts = compute_ann_counts(span_index)
-        annotation_counts = compute_avg_ann_counts(annotation_counts, example_index)
-        annotation_counts = compute_prevalence(annotation_counts, example_index)
+        annotation_counts = compute_ann_counts(
+            get_count_frame(totals.ann_counts, keys + ["annotation_type", "ann_count"])
+        )
+        annotation_counts = compute_avg_ann_counts(
+            annotation_counts, get_count_frame(example_counts, keys + ["example_count"])
+        )
+        annotation_counts = compute_prevalence(
+            annotation_counts, get_count_frame(totals.affected_counts, keys + ["annotation_type", "affected_count"])
+        )
 
         # replace NaNs with 0
         annotation_counts = annotation_counts.fillna(0.0)
@@ -234,73 +237,85 @@ def compute_statistics(app, campaign):
             "dataset": aggregate_ann_counts(annotation_counts, "dataset"),
         }
 
-    if not example_index.empty:
-        extra_fields_stats = compute_extra_fields_stats(example_index)
-        statistics["extra_fields"] = extra_fields_stats
+    if totals.examples:
+        # aggregate value counts for each label of flags, options and text_fields
+        extra_fields_stats = defaultdict(dict)
+
+        for (label, value), count in totals.extra_fields.items():
+            extra_fields_stats[label][value] = count
+
+        statistics["extra_fields"] = dict(extra_fields_stats)
 
     return statistics
 
 
-def compute_span_counts(example_index, annotator_count, combinations, cat_columns):
-    # create a list for span counts from each annotator (do this separately for each error category)
-    dataset_level_counts = []
-    example_level_counts = []
+def average_span_counts(keys, counts):
+    """
+    Average the span counts for each (dataset, split, setup_id).
 
-    annotator_group_ids = example_index.iloc[0].annotator_group_id
+    Returns the (dataset, split, setup_id) combinations and the array of the averages with the shape
+    (combinations, annotator groups, categories).
+    """
+    combination_codes = keys.groupby(["dataset", "split", "setup_id"], sort=True).ngroup().to_numpy()
+    averages = pd.DataFrame(counts.reshape(len(counts), -1)).groupby(combination_codes).mean()
+    combinations = keys.groupby(combination_codes)[["dataset", "split", "setup_id"]].first()
 
-    for dataset, split, setup_id in combinations:
-        example_index_subset = example_index[
-            (example_index["dataset"] == dataset)
-            & (example_index["split"] == split)
-            & (example_index["setup_id"] == setup_id)
-        ]
+    return combinations.loc[averages.index].reset_index(drop=True), averages.to_numpy().reshape(-1, *counts.shape[1:])
+
+
+def get_count_rows(keys, counts, annotator_group_ids):
+    """One row for each (key, annotator group, category) of the counts array."""
+    row_count, annotator_count, category_cnt = counts.shape
 
-        error_counts = [{"cat_" + str(i): [] for i in range(len(cat_columns))} for _ in range(annotator_count)]
+    rows = keys.loc[keys.index.repeat(annotator_count * category_cnt)].reset_index(drop=True)
+    rows["annotator_group_id"] = np.tile(np.repeat(annotator_group_ids, category_cnt), row_count)
+    rows["annotation_type"] = np.tile(np.arange(category_cnt).astype(str), row_count * annotator_count)
+    rows["count"] = counts.reshape(-1)
 
-        for i, row in example_index_subset.iterrows():
-            for a in range(annotator_count):
-                for j, c in enumerate(cat_columns):
-                    error_counts[a]["cat_" + str(j)].append(row[c][a])
+    return rows
 
-                    example_level_counts.append(
-                        {
-                            "dataset": dataset,
-                            "split": split,
-                            "setup_id": setup_id,
-                            "example_idx": row["example_idx"],
-                            "annotator_group_id": annotator_group_ids[a],
-                            "annotation_type": c.split("_")[1],
-                            "count": row[c][a],
-                        }
-                    )
 
-    example_level_counts = pd.DataFrame(example_level_counts)
+def compute_span_counts(keys, counts, annotator_group_ids):
+    """
+    Span counts of each annotator group on the examples (`example_level_counts`) and their averages for each
+    (dataset, split, setup_id) (`dataset_level_counts`).
+
+    Args:
+        keys: (dataset, split, setup_id, example_idx) of the examples
+        counts: array of the span counts with the shape (examples, annotator groups, categories)
+        annotator_group_ids: the annotator groups in the order of `counts`
+    """
+    example_level_counts = get_count_rows(keys, counts, annotator_group_ids)
 
     # average counts for each (dataset, split, setup_id)
+    columns = ["dataset", "split", "setup_id", "annotation_type", "annotator_group_id"]
     dataset_level_counts = (
-        example_level_counts.groupby(["dataset", "split", "setup_id", "annotation_type", "annotator_group_id"])
-        .agg({"count": "mean"})
-        .reset_index()
+        get_count_rows(*average_span_counts(keys, counts), annotator_group_ids)[columns + ["count"]]
+        .sort_values(columns)
+        .reset_index(drop=True)
     )
 
     return dataset_level_counts, example_level_counts
 
 
 def prepare_example_index(app, combinations, selected_campaigns, campaigns):
-    # gather a list of all examples with some annotations
-    example_index = pd.DataFrame()
-
-    for campaign_id in selected_campaigns:
-        campaign = campaigns[campaign_id]
+    """
+    Span counts of the examples annotated by all the annotator groups of the selected campaigns.
 
-        ei = generate_example_index(app, campaign)
-        example_index = pd.concat([example_index, ei], ignore_index=True)
+    Returns:
+        keys: (dataset, split, setup_id, example_idx) of the examples
+        counts: array of the span counts with the shape (examples, annotator groups, categories)
+        annotator_group_ids: the annotator groups in the order of `counts`
+    """
+    # gather a list of all examples with some annotations
+    example_index = pd.concat(
+        [generate_example_index(app, campaigns[campaign_id]) for campaign_id in selected_campaigns], ignore_index=True
+    )
+    keys = ["dataset", "split", "setup_id"]
 
     # a combination is a tuple (dataset, split, setup_id)
     # leave only examples in example_index that are in the combinations selected by the user
-    example_index = example_index[
-        example_index.apply(lambda x: (x["dataset"], x["split"], x["setup_id"]) in combinations, axis=1)
-    ]
+    example_index = example_index.merge(pd.DataFrame(list(combinations), columns=keys).drop_duplicates(), on=keys)
 
     # add a column "annotator_group_id" to example_index, concatenating the campaign_id with str(annotator_group)
     example_index["annotator_group_id"] = (
@@ -309,23 +324,135 @@ def prepare_example_index(app, combinations, selected_campaigns, campaigns):
 
     # get the number of annotators we are considering
     annotator_group_ids = list(example_index["annotator_group_id"].unique())
-    annotator_count = len(annotator_group_ids)
-
-    # group examples by dataset, split, setup_id, example_idx
-    # aggregate annotations, annotator_ids, and counts for each category into a list
-    aggregations = {"annotations": list, "annotator_group_id": list}
     cat_columns = [x for x in example_index.columns if x.startswith("cat_")]
 
-    for c in cat_columns:
-        aggregations[c] = list
+    # the campaigns with fewer categories have no spans of the other categories
+    example_index[cat_columns] = example_index[cat_columns].fillna(0)
 
-    example_index = (
-        example_index.groupby(["dataset", "split", "setup_id", "example_idx"]).agg(aggregations).reset_index()
+    # one row for each example, one column for each (annotator group, category)
+    counts = (
+        example_index.groupby(keys + ["example_idx", "annotator_group_id"])[cat_columns]
+        .mean()
+        .unstack("annotator_group_id")
+        .reindex(columns=pd.MultiIndex.from_product([cat_columns, annotator_group_ids]))
     )
     # remove all examples that do not have annotations from all annotators
-    example_index = example_index[example_index["annotator_group_id"].apply(lambda x: len(x) == annotator_count)]
+    counts = counts.dropna()
+
+    counts_array = counts.to_numpy().reshape(len(counts), len(cat_columns), len(annotator_group_ids)).swapaxes(1, 2)
+
+    return counts.index.to_frame(index=False), counts_array, annotator_group_ids
+
+
+def kendall_tau(table):
+    """
+    Kendall tau-b from the contingency table of the values of two vectors.
 
-    return example_index, annotator_count, annotator_group_ids, cat_columns
+    For vectors with a few distinct values (such as span counts), counting the concordant and discordant pairs from
+    the table is much faster than `scipy.stats.kendalltau()`. Returns NaN if any of the vectors is constant.
+    """
+    # the number of pairs with both values higher (lower-left: x higher, y lower)
+    higher = np.zeros_like(table)
+    higher[:-1, :-1] = table[::-1, ::-1].cumsum(0).cumsum(1)[::-1, ::-1][1:, 1:]
+    lower_left = np.zeros_like(table)
+    lower_left[:-1, 1:] = table[::-1].cumsum(0).cumsum(1)[::-1][1:, :-1]
+
+    concordant = (table * higher).sum()
+    discordant = (table * lower_left).sum()
+
+    n = table.sum()
+    pairs = n * (n - 1) / 2
+    x_ties = (table.sum(1) * (table.sum(1) - 1) / 2).sum()
+    y_ties = (table.sum(0) * (table.sum(0) - 1) / 2).sum()
+    denominator = np.sqrt((pairs - x_ties) * (pairs - y_ties))
+
+    return (concordant - discordant) / denominator if denominator > 0 else np.nan
+
+
+def compute_kendall(v, pair_idx):
+    """Kendall tau-b between the rows of `v` for each pair of the rows."""
+    values = [np.unique(row, return_inverse=True) for row in v]
+    results = {}
+
+    for i, j in pair_idx:
+        (x_values, x_codes), (y_values, y_codes) = values[i], values[j]
+
+        if len(x_values) * len(y_values) > 10**6:
+            results[(i, j)] = stats.kendalltau(v[i], v[j]).statistic
+            continue
+
+        table = np.bincount(x_codes * len(y_values) + y_codes, minlength=len(x_values) * len(y_values))
+        results[(i, j)] = kendall_tau(table.reshape(len(x_values), len(y_values)).astype(float))
+
+    return results
+
+
+def compute_correlations(counts, annotator_group_ids, level):
+    """
+    Pearson, Spearman and Kendall correlations of the span counts between each pair of annotator groups.
+
+    The correlations are computed for each category, over all the categories (`micro`) and averaged over the
+    categories (`macro`, the categories with undefined correlation are left out).
+
+    Args:
+        counts: array of the span counts with the shape (examples, annotator groups, categories)
+        annotator_group_ids: the annotator groups in the order of `counts`
+        level: `example` or `dataset` (the counts averaged for each dataset, split and setup_id)
+    """
+    columns = [
+        "level",
+        "annotator_group_id_1",
+        "annotator_group_id_2",
+        "annotation_type",
+        "pearson",
+        "spearman",
+        "kendall",
+    ]
+    example_count, annotator_count, category_cnt = counts.shape
+    pair_idx = [(i, j) for i in range(annotator_count) for j in range(i + 1, annotator_count)]
+    results = []
+
+    if not pair_idx or example_count == 0:
+        return pd.DataFrame(results, columns=columns)
+
+    # the vectors of each annotator group for each category, the last one for all the categories
+    vectors = [counts[:, :, i].T for i in range(category_cnt)] + [
+        counts.transpose(1, 0, 2).reshape(annotator_count, -1)
+    ]
+
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        # constant vectors (e.g. a category nobody used) have undefined correlation
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+
+        correlations = []
+
+        for v in vectors:
+            pearson = np.corrcoef(v)
+            spearman = np.corrcoef(stats.rankdata(v, axis=1))
+            kendall = compute_kendall(v, pair_idx)
+
+            correlations.append((pearson, spearman, kendall))
+
+        for i, j in pair_idx:
+            pair = [(c[0][i, j], c[1][i, j], c[2][(i, j)]) for c in correlations]
+            rows = [(str(t), *pair[t]) for t in range(category_cnt)]
+            rows.append(("micro", *pair[-1]))
+            rows.append(("macro", *np.nanmean(np.array(pair[:-1], dtype=float), axis=0)))
+
+            for annotation_type, pearson, spearman, kendall in rows:
+                results.append(
+                    {
+                        "level": level,
+                        "annotator_group_id_1": annotator_group_ids[i],
+                        "annotator_group_id_2": annotator_group_ids[j],
+                        "annotation_type": annotation_type,
+                        "pearson": pearson,
+                        "spearman": spearman,
+                        "kendall": kendall,
+                    }
+                )
+
+    return pd.DataFrame(results, columns=columns).round(3)
 
 
 def compute_gamma_spans(app, selected_campaigns, campaigns):
@@ -357,23 +484,259 @@ def compute_gamma_spans(app, selected_campaigns, campaigns):
     return span_index
 
 
+PAIR_SPAN_COUNTS = [
+    "spans_1",
+    "spans_2",
+    "hard_matches",
+    "soft_matches_1",
+    "soft_matches_2",
+    "chars_1",
+    "chars_2",
+    "chars_both",
+]
+
+
+def merge_intervals(starts, ends):
+    """Merge the intervals [start, end) sorted by their starts into disjoint intervals."""
+    if len(starts) == 0:
+        return starts, ends
+
+    # a new interval begins where the start is past all the previous ends
+    max_ends = np.maximum.accumulate(ends)
+    begins = np.r_[True, starts[1:] > max_ends[:-1]]
+    last = np.r_[np.flatnonzero(begins)[1:] - 1, len(starts) - 1]
+
+    return starts[begins], max_ends[last]
+
+
+def prepare_group_spans(spans, stride, category_cnt):
+    """
+    Lay out the spans of an annotator group on a single axis, so that all the examples and categories are handled in one
+    sweep.
+
+    The spans are given as an array (block, start, end) with block = example * category_cnt + category, each block
+    takes `stride` positions on the axis.
+    """
+    starts = spans[:, 0] * stride + spans[:, 1]
+    ends = spans[:, 0] * stride + spans[:, 2]
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    categories = spans[order, 0] % category_cnt
+
+    merged_starts, merged_ends = merge_intervals(starts, ends)
+    # the distinct spans (the spans are sorted by their boundaries) with the number of their occurrences
+    distinct = np.ones(len(starts), dtype=bool)
+    distinct[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1])
+    firsts = np.flatnonzero(distinct)
+
+    return {
+        "starts": starts,
+        "ends": ends,
+        "categories": categories,
+        "merged_starts": merged_starts,
+        "merged_ends": merged_ends,
+        "distinct_starts": starts[firsts],
+        "distinct_ends": ends[firsts],
+        "distinct_counts": np.diff(np.r_[firsts, len(starts)]),
+        "spans": np.bincount(categories, minlength=category_cnt),
+        "chars": np.bincount(
+            (merged_starts // stride) % category_cnt, merged_ends - merged_starts, minlength=category_cnt
+        ),
+    }
+
+
+def compute_pair_span_agreement(group_1, group_2, stride, category_cnt):
+    """
+    Span agreement between two annotator groups (`prepare_group_spans()`) on the same examples.
+
+    Returns the arrays (for each category) of the span counts, the exactly matching spans, the spans overlapping a span
+    of the other group, the annotated characters and the characters annotated by both groups.
+    """
+    results = {
+        "spans_1": group_1["spans"],
+        "spans_2": group_2["spans"],
+        "chars_1": group_1["chars"],
+        "chars_2": group_2["chars"],
+    }
+
+    # spans with the same boundaries and category in the same example (each span matches at most one other span): the
+    # distinct spans of both groups sorted together, the equal neighbours come from different groups
+    starts, ends, counts = (
+        np.concatenate([group_1[f"distinct_{key}"], group_2[f"distinct_{key}"]]) for key in ["starts", "ends", "counts"]
+    )
+    order = np.lexsort((ends, starts))
+    starts, ends, counts = starts[order], ends[order], counts[order]
+    same = (starts[1:] == starts[:-1]) & (ends[1:] == ends[:-1])
+    results["hard_matches"] = np.bincount(
+        (starts[1:][same] // stride) % category_cnt,
+        np.minimum(counts[1:], counts[:-1])[same],
+        minlength=category_cnt,
+    )
+
+    # spans overlapping any span of the other group: the last merged interval of the other group starting before the
+    # end of the span has to end after its start
+    for g, (group, other) in enumerate([(group_1, group_2), (group_2, group_1)], start=1):
+        idx = np.searchsorted(other["merged_starts"], group["ends"], side="left") - 1
+        overlaps = (idx >= 0) & (other["merged_ends"][np.maximum(idx, 0)] > group["starts"])
+        results[f"soft_matches_{g}"] = np.bincount(group["categories"][overlaps], minlength=category_cnt)
+
+    # sweep over the boundaries of the merged intervals of both groups, the characters of both are covered twice
+    boundaries = [group_1["merged_starts"], group_2["merged_starts"], group_1["merged_ends"], group_2["merged_ends"]]
+    positions = np.concatenate(boundaries)
+    changes = np.repeat([1, 1, -1, -1], [len(b) for b in boundaries])
+    order = np.argsort(positions, kind="stable")
+    positions, coverage = positions[order], np.cumsum(changes[order])
+    both_covered = coverage[:-1] == 2
+    results["chars_both"] = np.bincount(
+        (positions[:-1][both_covered] // stride) % category_cnt,
+        np.diff(positions)[both_covered],
+        minlength=category_cnt,
+    )
+
+    return results
+
+
+def compute_combination_span_agreement(combination, spans, annotator_group_ids, category_cnt):
+    """Span agreement for each pair of annotator groups on the examples of a (dataset, split, setup_id)."""
+    rows = []
+
+    # blocks of (example, category)
+    example_codes = pd.factorize(spans["example_idx"])[0]
+    spans = spans.assign(block=example_codes * category_cnt + spans["annotation_type"].to_numpy())
+    stride = int(spans["annotation_end"].max()) + 1 if len(spans) else 1
+    groups = {
+        group: prepare_group_spans(
+            group_spans[["block", "annotation_start", "annotation_end"]].to_numpy(dtype=np.int64), stride, category_cnt
+        )
+        for group, group_spans in spans.groupby("annotator_group_id")
+    }
+    empty = prepare_group_spans(np.zeros((0, 3), dtype=np.int64), stride, category_cnt)
+
+    for i, group_1 in enumerate(annotator_group_ids):
+        for group_2 in annotator_group_ids[i + 1 :]:
+            results = compute_pair_span_agreement(
+                groups.get(group_1, empty), groups.get(group_2, empty), stride, category_cnt
+            )
+
+            for annotation_type in range(category_cnt):
+                rows.append(
+                    {
+                        "dataset": combination[0],
+                        "split": combination[1],
+                        "setup_id": combination[2],
+                        "annotator_group_id_1": group_1,
+                        "annotator_group_id_2": group_2,
+                        "annotation_type": annotation_type,
+                        **{key: int(value[annotation_type]) for key, value in results.items()},
+                    }
+                )
+
+    return rows
+
+
+def compute_span_agreement(span_index, keys, annotator_group_ids, category_cnt, workers=0):
+    """
+    Span-level agreement between each pair of annotator groups on the examples from `keys`.
+
+    For each (dataset, split, setup_id) and category (and over all of them):
+        hard_f1: F1 of the spans with exactly the same boundaries and category
+        soft_f1: F1 of the spans overlapping a span of the same category from the other group
+        char_overlap: Dice coefficient of the characters annotated with the category by each group
+
+    The (dataset, split, setup_id) combinations are processed sequentially by default, or in a pool of `workers` worker
+    processes (`workers=None` for one per CPU).
+    """
+    spans = span_index.merge(keys, on=["dataset", "split", "setup_id", "example_idx"])
+    spans = spans[
+        spans["annotation_type"].isin(range(category_cnt)) & (spans["annotation_end"] > spans["annotation_start"])
+    ]
+    span_columns = ["example_idx", "annotator_group_id", "annotation_type", "annotation_start", "annotation_end"]
+    groups = [
+        (combination, combination_spans[span_columns])
+        for combination, combination_spans in spans.groupby(["dataset", "split", "setup_id"])
+    ]
+    rows = []
+
+    if workers == 0 or len(groups) <= 1:
+        for combination, combination_spans in groups:
+            rows += compute_combination_span_agreement(
+                combination, combination_spans, annotator_group_ids, category_cnt
+            )
+    else:
+        # spawned: the web server process already runs other threads
+        with ProcessPoolExecutor(
+            max_workers=min(workers or os.cpu_count(), len(groups)), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    compute_combination_span_agreement,
+                    combination,
+                    combination_spans,
+                    annotator_group_ids,
+                    category_cnt,
+                )
+                for combination, combination_spans in groups
+            ]
+
+            for future in futures:
+                rows += future.result()
+
+    columns = ["dataset", "split", "setup_id", "annotator_group_id_1", "annotator_group_id_2", "annotation_type"]
+    counts = pd.DataFrame(rows, columns=columns + PAIR_SPAN_COUNTS)
+
+    # all the categories together, then all the combinations together
+    counts = counts.astype({"annotation_type": str})
+    totals = counts.assign(annotation_type="all").groupby(columns, sort=False)[PAIR_SPAN_COUNTS].sum().reset_index()
+    counts = pd.concat([counts, totals], ignore_index=True)
+    overall = (
+        counts.assign(dataset="all", split="all", setup_id="all")
+        .groupby(columns, sort=False)[PAIR_SPAN_COUNTS]
+        .sum()
+        .reset_index()
+    )
+    counts = pd.concat([counts, overall], ignore_index=True)
+
+    counts["hard_f1"] = 2 * counts["hard_matches"] / (counts["spans_1"] + counts["spans_2"])
+    precision = counts["soft_matches_1"] / counts["spans_1"]
+    recall = counts["soft_matches_2"] / counts["spans_2"]
+    counts["soft_f1"] = 2 * precision * recall / (precision + recall)
+    counts["char_overlap"] = 2 * counts["chars_both"] / (counts["chars_1"] + counts["chars_2"])
+
+    return counts.round(3)
+
+
 def generate_iaa_files(app, selected_campaigns, combinations, campaigns, temp_dir):
     combinations = [(c["dataset"], c["split"], c["setup_id"]) for c in combinations]
 
-    example_index, annotator_count, annotator_group_ids, cat_columns = prepare_example_index(
+    keys, counts, annotator_group_ids = prepare_example_index(
         app, combinations=combinations, selected_campaigns=selected_campaigns, campaigns=campaigns
     )
 
-    dataset_level_counts, example_level_counts = compute_span_counts(
-        example_index=example_index, annotator_count=annotator_count, combinations=combinations, cat_columns=cat_columns
+    dataset_level_counts, example_level_counts = compute_span_counts(keys, counts, annotator_group_ids)
+
+    correlations = pd.concat(
+        [
+            compute_correlations(counts, annotator_group_ids, level="example"),
+            compute_correlations(average_span_counts(keys, counts)[1], annotator_group_ids, level="dataset"),
+        ],
+        ignore_index=True,
     )
 
     gamma_spans = compute_gamma_spans(app, selected_campaigns, campaigns)
+    span_agreement = compute_span_agreement(
+        gamma_spans,
+        keys,
+        annotator_group_ids,
+        category_cnt=counts.shape[2],
+        workers=app.config.get("agreement_workers"),
+    )
 
     results = {
         "dataset_level_counts": dataset_level_counts,
         "example_level_counts": example_level_counts,
+        "correlations": correlations,
         "gamma_spans": gamma_spans,
+        "span_agreement": span_agreement,
     }
 
     # Save each dataframe as CSV
@@ -25,9 +25,11 @@ from flask import (
 from slugify import slugify
 
 import factgenie.crowdsourcing as crowdsourcing
+import factgenie.jobs as jobs
 import factgenie.llm_campaign as llm_campaign
 import factgenie.workflows as workflows
 import factgenie.analysis as analysis
+import factgenie.render_cache as render_cache
 import factgenie.utils as utils
 
 from factgenie import CAMPAIGN_DIR, TEMPLATES_DIR, STATIC_DIR, INPUT_DIR, PACKAGE_DIR
@@ -38,13 +40,21 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask("factgenie", template_folder=TEMPLATES_DIR, static_folder=STATIC_DIR)
 app.db = {}
+app.db["datasets_obj"] = {}
+app.db["datasets_loading"] = {}
 app.db["annotation_index"] = None
 app.db["annotation_index_cache"] = {}
+app.db["annotation_index_snapshot"] = None
 app.db["output_index"] = None
 app.db["output_index_cache"] = {}
+app.db["output_index_snapshot"] = None
+app.db["index_watcher"] = None
+app.db["span_tables"] = {}
+app.db["campaign_stats"] = {}
 app.db["lock"] = threading.Lock()
 app.db["running_campaigns"] = set()
 app.db["announcers"] = {}
+app.db["relays"] = {}
 app.wsgi_app = ProxyFix(app.wsgi_app, x_host=1)
 
 logger = logging.getLogger("factgenie")
@@ -218,6 +228,17 @@ def app_config():
     )
 
 
+@app.route("/render_cache_stats", methods=["GET"])
+@login_required
+def render_cache_stats():
+    cache = render_cache.get_cache()
+
+    if cache is None:
+        return jsonify(enabled=False)
+
+    return jsonify(enabled=True, **cache.get_stats())
+
+
 @app.route("/browse", methods=["GET", "POST"])
 @login_required
 def browse():
@@ -234,7 +255,7 @@ def browse():
 
     workflows.refresh_indexes(app)
     datasets = workflows.get_local_dataset_overview(app)
-    datasets = {k: v for k, v in datasets.items() if v["enabled"]}
+    datasets = {k: v for k, v in datasets.items() if v["enabled"] and not v["loading"]}
 
     if not datasets:
         return render_template(
@@ -389,6 +410,7 @@ def delete_campaign():
     campaign_id = data.get("campaignId")
 
     shutil.rmtree(os.path.join(CAMPAIGN_DIR, campaign_id))
+    workflows.mark_changed(os.path.join(CAMPAIGN_DIR, campaign_id), is_directory=True)
     symlink_dir = os.path.join(TEMPLATES_DIR, "campaigns", campaign_id)
 
     if os.path.exists(symlink_dir):
@@ -417,7 +439,7 @@ def delete_model_outputs():
     split = data.get("split")
     setup_id = data.get("setup_id")
 
-    dataset = app.db["datasets_obj"][dataset_id]
+    dataset = workflows.get_dataset(app, dataset_id, wait_loading=True)
     workflows.delete_model_outputs(dataset, split, setup_id)
 
     return utils.success()
@@ -480,10 +502,15 @@ def render_example():
     split = request.args.get("split")
     example_idx = max(int(request.args.get("example_idx")), 0)
     setup_id = request.args.get("setup_id", None)
+    # number of the following examples to render in the background
+    prefetch = int(request.args.get("prefetch", 0))
 
     try:
         example_data = workflows.get_example_data(app, dataset_id, split, example_idx, setup_id)
 
+        if prefetch > 0:
+            workflows.prefetch_examples(app, dataset_id, split, example_idx, prefetch)
+
         return jsonify(example_data)
     except Exception as e:
         traceback.print_exc()
@@ -576,7 +603,7 @@ def llm_campaign_create():
     elif mode == CampaignMode.LLM_GEN:
         config = llm_campaign.parse_llm_gen_config(config)
 
-    datasets = app.db["datasets_obj"]
+    datasets = workflows.get_datasets(app)
 
     try:
         llm_campaign.create_llm_campaign(app, mode, campaign_id, config, campaign_data, datasets)
@@ -597,7 +624,10 @@ def llm_campaign_detail(campaign_id):
     mode = utils.get_mode_from_path(request.path)
     campaign = workflows.load_campaign(app, campaign_id=campaign_id)
 
-    if campaign.metadata["status"] == CampaignStatus.RUNNING and not app.db["announcers"].get(campaign_id):
+    if jobs.is_campaign_active(campaign_id):
+        # running in a worker process: make sure the progress gets relayed to the page
+        get_job_announcer(campaign_id)
+    elif campaign.metadata["status"] == CampaignStatus.RUNNING and not app.db["announcers"].get(campaign_id):
         campaign.metadata["status"] = CampaignStatus.IDLE
         campaign.update_metadata()
 
@@ -612,6 +642,7 @@ def llm_campaign_detail(campaign_id):
         overview=overview,
         finished_examples=finished_examples,
         metadata=campaign.metadata,
+        call_stats=campaign.get_call_stats(),
         host_prefix=app.config["host_prefix"],
     )
 
@@ -658,12 +689,19 @@ def llm_campaign_run():
     data = request.get_json()
     campaign_id = data.get("campaignId")
 
+    if app.config.get("campaign_runner") == "queue":
+        # executed by the `factgenie worker` processes
+        job = jobs.enqueue_campaign(campaign_id, mode)
+        get_job_announcer(campaign_id, from_start=True)
+
+        return jsonify(success=True, status=CampaignStatus.RUNNING, job_id=job["id"])
+
     app.db["announcers"][campaign_id] = announcer = utils.MessageAnnouncer()
     app.db["running_campaigns"].add(campaign_id)
 
     try:
         campaign = workflows.load_campaign(app, campaign_id=campaign_id)
-        datasets = app.db["datasets_obj"]
+        datasets = workflows.get_datasets(app)
 
         config = campaign.metadata["config"]
         model = ModelFactory.from_config(config, mode=mode)
@@ -700,9 +738,26 @@ def llm_campaign_update_config():
     return utils.success()
 
 
+def get_job_announcer(campaign_id, from_start=False):
+    """Announcer for a campaign running in a worker, fed from the progress channel of the campaign by a relay thread."""
+    with app.db["lock"]:
+        relay = app.db["relays"].get(campaign_id)
+
+        if relay is None or not relay.is_alive():
+            app.db["announcers"][campaign_id] = announcer = (
+                app.db["announcers"].get(campaign_id) or utils.MessageAnnouncer()
+            )
+            app.db["relays"][campaign_id] = jobs.start_relay(campaign_id, announcer, from_start=from_start)
+
+        return app.db["announcers"][campaign_id]
+
+
 @app.route("/llm_campaign/progress/<campaign_id>", methods=["GET", "POST"])
 @login_required
 def listen(campaign_id):
+    if jobs.is_campaign_active(campaign_id):
+        get_job_announcer(campaign_id)
+
     if not app.db["announcers"].get(campaign_id):
         return Response(status=404)
 
@@ -854,10 +909,12 @@ def upload_model_outputs():
     setup_id = data["setup_id"]
     model_outputs = data["outputs"]
 
-    dataset = app.db["datasets_obj"][dataset_id]
+    dataset = workflows.get_dataset(app, dataset_id, wait_loading=True)
 
     try:
-        workflows.upload_model_outputs(dataset, split, setup_id, model_outputs)
+        workflows.upload_model_outputs(
+            dataset, split, setup_id, model_outputs, output_format=app.config.get("output_format", "jsonl")
+        )
     except Exception as e:
         traceback.print_exc()
         return utils.error(f"Error while adding model outputs: {e}")
@@ -91,8 +91,9 @@ def list_data(output: str):
 def show_dataset_info(app, dataset_id: str):
     """Show information about a dataset."""
 
-    from factgenie.workflows import get_local_dataset_overview
+    from factgenie.workflows import get_datasets, get_local_dataset_overview
 
+    get_datasets(app)
     dataset_overview = get_local_dataset_overview(app)
     dataset_info = dataset_overview.get(dataset_id)
 
@@ -189,7 +190,7 @@ def create_llm_campaign(
         raise ValueError(f"Campaign {campaign_id} already exists. Use --overwrite to overwrite.")
 
     campaign_id = slugify(campaign_id)
-    datasets = app.db["datasets_obj"]
+    datasets = workflows.get_datasets(app)
     dataset_ids = dataset_ids.split(",")
     splits = splits.split(",")
     setup_ids = setup_ids.split(",")
@@ -246,19 +247,22 @@ def create_llm_campaign(
 
 @app.cli.command("run_llm_campaign")
 @click.argument("campaign_id", type=str)
-def run_llm_campaign(campaign_id: str):
+@click.option(
+    "--enqueue", is_flag=True, default=False, help="Add the campaign to the job queue instead of running it here."
+)
+def run_llm_campaign(campaign_id: str, enqueue: bool):
     """
     Run a LLM campaign by id.
     """
     from factgenie.models import ModelFactory
-    from factgenie import llm_campaign
+    from factgenie import jobs, llm_campaign, workflows
     from factgenie.campaign import CampaignStatus
     from factgenie.workflows import load_campaign
 
     # mockup object
     announcer = None
 
-    datasets = app.db["datasets_obj"]
+    datasets = workflows.get_datasets(app)
     campaign = load_campaign(app, campaign_id)
 
     if campaign is None:
@@ -267,11 +271,16 @@ def run_llm_campaign(campaign_id: str):
     if campaign.metadata["status"] == CampaignStatus.FINISHED:
         raise ValueError(f"Campaign {campaign_id} is already finished.")
 
-    if campaign.metadata["status"] == CampaignStatus.RUNNING:
+    if campaign.metadata["status"] == CampaignStatus.RUNNING or jobs.is_campaign_active(campaign_id):
         raise ValueError(f"Campaign {campaign_id} is already running.")
 
     config = campaign.metadata["config"]
     mode = campaign.metadata["mode"]
+
+    if enqueue:
+        job = jobs.enqueue_campaign(campaign_id, mode)
+        print(f"Campaign {campaign_id} queued as job {job['id']}.")
+        return
     model = ModelFactory.from_config(config, mode=mode)
     running_campaigns = app.db["running_campaigns"]
 
@@ -282,6 +291,78 @@ def run_llm_campaign(campaign_id: str):
     )
 
 
+@app.cli.command("worker")
+@click.option("--poll-interval", type=float, default=1.0, help="Seconds between checks of the job queue.")
+@click.option("--once", is_flag=True, default=False, help="Exit once the job queue is empty.")
+def worker(poll_interval: float, once: bool):
+    """
+    Run LLM campaigns from the job queue.
+
+    Start any number of workers (also on other machines sharing the factgenie data directories) and set
+    `campaign_runner: queue` in the config so that the web interface adds the campaigns to the queue.
+    """
+    from factgenie import llm_campaign
+
+    llm_campaign.run_worker(app, poll_interval=poll_interval, once=once)
+
+
+@app.cli.command("migrate_campaign_db")
+@click.argument("campaign_ids", type=str, nargs=-1)
+@click.option("-a", "--all", "all_campaigns", is_flag=True, default=False, help="Migrate all campaigns.")
+def migrate_campaign_db(campaign_ids, all_campaigns: bool):
+    """
+    Convert campaign databases from db.csv to SQLite (db.sqlite).
+    """
+    from factgenie.workflows import generate_campaign_index
+
+    campaign_index = generate_campaign_index(app, force_reload=False)
+
+    if all_campaigns:
+        campaign_ids = list(campaign_index.keys())
+
+    if not campaign_ids:
+        click.echo(migrate_campaign_db.get_help(click.Context(migrate_campaign_db)))
+        return
+
+    for campaign_id in campaign_ids:
+        campaign = campaign_index.get(campaign_id)
+
+        if campaign is None:
+            raise ValueError(f"Campaign {campaign_id} not found.")
+
+        if campaign.metadata["mode"] == CampaignMode.EXTERNAL:
+            print(f"Skipping {campaign_id}: external campaigns do not have a db")
+            continue
+
+        if campaign.migrate_db_to_sqlite():
+            print(f"Migrated {campaign_id} ({len(campaign.db)} rows)")
+        else:
+            print(f"Skipping {campaign_id}: already using SQLite")
+
+
+@app.cli.command("convert_outputs")
+@click.argument("output_format", type=click.Choice(["jsonl", "parquet"]))
+@click.argument("paths", type=str, nargs=-1)
+def convert_outputs(output_format: str, paths):
+    """
+    Convert the model output files to JSONL or Parquet (all the files in the output directory if no paths are given).
+    """
+    from pathlib import Path
+    from factgenie import OUTPUT_DIR
+    from factgenie.output_store import OUTPUT_FORMATS, convert_outputs as convert_output_file
+
+    if paths:
+        files = [Path(path) for path in paths]
+    else:
+        files = [path for suffix in OUTPUT_FORMATS.values() for path in Path(OUTPUT_DIR).rglob(f"*{suffix}")]
+
+    for file in files:
+        new_file = convert_output_file(file, output_format)
+
+        if new_file is not None:
+            print(f"Converted {file} -> {new_file}")
+
+
 def setup_logging(config):
     import logging
     import coloredlogs
@@ -347,6 +428,9 @@ def create_app(**kwargs):
     import shutil
     import logging
     import factgenie.workflows as workflows
+    import factgenie.llm_cache as llm_cache
+    import factgenie.render_cache as render_cache
+    from factgenie.watcher import IndexWatcher
     from apscheduler.schedulers.background import BackgroundScheduler
     from datetime import datetime
     from factgenie.utils import check_login
@@ -380,18 +464,27 @@ def create_app(**kwargs):
     app.config["root_dir"] = ROOT_DIR
     app.config.update(config)
 
+    llm_cache.configure(config.get("llm_cache"))
+    render_cache.configure(config.get("render_cache"))
+
     assert check_login(
         app, config["login"]["username"], config["login"]["password"]
     ), "Login should pass for valid user"
     assert not check_login(app, "dummy_non_user_name", "dummy_bad_password"), "Login should fail for dummy user"
 
-    app.db["datasets_obj"] = workflows.instantiate_datasets()
+    workflows.load_datasets(app, workers=config.get("dataset_workers"))
     app.db["scheduler"] = BackgroundScheduler()
 
     logging.getLogger("apscheduler.scheduler").setLevel(logging.WARNING)
     logging.getLogger("apscheduler.executors.default").setLevel(logging.WARNING)
     app.db["scheduler"].start()
 
+    index_watcher = config.get("index_watcher", "native")
+
+    if index_watcher != "off":
+        app.db["index_watcher"] = IndexWatcher()
+        app.db["index_watcher"].start(mode=index_watcher)
+
     workflows.generate_campaign_index(app)
 
     if config.get("logging", {}).get("flask_debug", False) is False:
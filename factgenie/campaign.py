@@ -3,8 +3,13 @@ import os
 import json
 import glob
 import logging
+import numpy as np
 import pandas as pd
 import ast
+import math
+import random
+import sqlite3
+import time
 
 from datetime import datetime
 from factgenie import CAMPAIGN_DIR
@@ -32,7 +37,216 @@ class ExampleStatus:
     FINISHED = "finished"
 
 
+class CampaignDBBackend:
+    CSV = "csv"
+    SQLITE = "sqlite"
+
+
+class SQLiteCampaignDB:
+    """
+    Campaign db stored in an SQLite database (`db.sqlite` in the campaign directory).
+
+    Compared to `db.csv`, individual rows are updated in transactions without rewriting the whole db, and the crowdsourcing
+    batches can be assigned safely even if multiple app processes share the campaign directory.
+    """
+
+    TABLE = "db"
+    UPDATABLE_FIELDS = ["status", "annotator_id", "start", "end"]
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # autocommit mode, transactions are opened explicitly
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return conn
+
+    def create(self, db):
+        # including the write-ahead log of a previous db, which would be replayed into the new one
+        for path in [self.path, self.path + "-wal", self.path + "-shm"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+        conn = self.connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # the columns are empty for new campaigns, the types cannot be inferred
+            column_types = {"annotator_id": "TEXT", "status": "TEXT", "start": "REAL", "end": "REAL"}
+            db.to_sql(self.TABLE, conn, index=True, index_label="db_idx", dtype=column_types)
+
+            conn.execute(f"CREATE INDEX idx_status ON {self.TABLE} (status)")
+            conn.execute(f"CREATE INDEX idx_annotator_id ON {self.TABLE} (annotator_id)")
+
+            if "batch_idx" in db.columns:
+                conn.execute(f"CREATE INDEX idx_batch ON {self.TABLE} (batch_idx, annotator_group)")
+        finally:
+            conn.close()
+
+    def replace(self, db):
+        """Replace the contents of the db in a single transaction, the db stays in place for the other processes."""
+        columns = ["db_idx", *db.columns]
+        column_names = ", ".join(f'"{column}"' for column in columns)
+        placeholders = ", ".join("?" * len(columns))
+        values = [
+            [int(db_idx), *[to_python_value(value) for value in row]]
+            for db_idx, row in zip(db.index, db.itertuples(index=False))
+        ]
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"DELETE FROM {self.TABLE}")
+            conn.executemany(f"INSERT INTO {self.TABLE} ({column_names}) VALUES ({placeholders})", values)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def load(self):
+        conn = self.connect()
+        try:
+            db = pd.read_sql(f"SELECT * FROM {self.TABLE} ORDER BY db_idx", conn, index_col="db_idx")
+        finally:
+            conn.close()
+
+        db.index.name = None
+        db = db.astype({"annotator_id": str, "start": float, "end": float})
+        # keep the empty values consistent with the CSV backend
+        db.loc[db["annotator_id"].isin(["None", "nan"]), "annotator_id"] = pd.NA
+
+        return db
+
+    def load_rows(self, db_idxs):
+        conn = self.connect()
+        try:
+            placeholders = ",".join("?" * len(db_idxs))
+            rows = conn.execute(
+                f'SELECT db_idx, status, annotator_id, start, "end" FROM {self.TABLE} WHERE db_idx IN ({placeholders})',
+                [int(i) for i in db_idxs],
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return rows
+
+    def update_rows(self, db, db_idxs):
+        values = []
+
+        for db_idx in db_idxs:
+            row = [to_python_value(db.at[db_idx, field]) for field in self.UPDATABLE_FIELDS]
+            values.append(row + [int(db_idx)])
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                f'UPDATE {self.TABLE} SET status = ?, annotator_id = ?, start = ?, "end" = ? WHERE db_idx = ?', values
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def assign_batch(self, annotator_id, start):
+        """
+        Select a batch for the annotator and mark it as assigned in a single transaction.
+
+        Follows the same rules as `crowdsourcing.select_batch()`: reuse the batch already assigned to the annotator,
+        otherwise choose randomly from the batches with the most free annotator groups.
+
+        Returns a tuple (batch_idx, annotator_group) or None if there are no free batches.
+        """
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            selected = conn.execute(
+                f"SELECT batch_idx, annotator_group FROM {self.TABLE} WHERE annotator_id = ? AND status = ? LIMIT 1",
+                (annotator_id, ExampleStatus.ASSIGNED),
+            ).fetchone()
+
+            if selected is None:
+                free_batches = conn.execute(
+                    f"SELECT batch_idx, COUNT(DISTINCT annotator_group), COUNT(*) FROM {self.TABLE} "
+                    f"WHERE status = ? GROUP BY batch_idx",
+                    (ExampleStatus.FREE,),
+                ).fetchall()
+
+                if not free_batches:
+                    conn.execute("ROLLBACK")
+                    return None
+
+                max_groups = max(groups for _, groups, _ in free_batches)
+                eligible = [(batch_idx, cnt) for batch_idx, groups, cnt in free_batches if groups == max_groups]
+
+                # each free example has the same chance to be selected (as in `select_batch()`)
+                batch_idx = random.choices([b for b, _ in eligible], weights=[cnt for _, cnt in eligible])[0]
+                annotator_group = conn.execute(
+                    f"SELECT MIN(annotator_group) FROM {self.TABLE} WHERE batch_idx = ? AND status = ?",
+                    (batch_idx, ExampleStatus.FREE),
+                ).fetchone()[0]
+                selected = (batch_idx, annotator_group)
+
+            conn.execute(
+                f"UPDATE {self.TABLE} SET status = ?, start = ?, annotator_id = ? "
+                f"WHERE batch_idx = ? AND annotator_group = ?",
+                (ExampleStatus.ASSIGNED, start, annotator_id, *selected),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return int(selected[0]), int(selected[1])
+
+    def free_idle_rows(self, assigned_before):
+        """Free the examples assigned before the `assigned_before` timestamp, return their indices."""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            condition = "status = ? AND start < ?"
+            params = (ExampleStatus.ASSIGNED, assigned_before)
+
+            db_idxs = [row[0] for row in conn.execute(f"SELECT db_idx FROM {self.TABLE} WHERE {condition}", params)]
+            conn.execute(
+                f'UPDATE {self.TABLE} SET status = ?, annotator_id = ?, start = NULL, "end" = NULL WHERE {condition}',
+                (ExampleStatus.FREE, "", *params),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return db_idxs
+
+
+def to_python_value(value):
+    if pd.isna(value):
+        return None
+
+    return value.item() if hasattr(value, "item") else value
+
+
+def save_campaign_db(campaign_dir, db, backend=CampaignDBBackend.CSV):
+    """Save the db of a newly created campaign."""
+    if backend == CampaignDBBackend.SQLITE:
+        SQLiteCampaignDB(os.path.join(campaign_dir, "db.sqlite")).create(db)
+    else:
+        db.to_csv(os.path.join(campaign_dir, "db.csv"), index=False)
+
+
 class Campaign:
+    # the status changes are appended to the journal and the full db.csv is rewritten
+    # only after `DB_FLUSH_EVERY` journaled rows or `DB_FLUSH_INTERVAL` seconds
+    DB_FLUSH_EVERY = 500
+    DB_FLUSH_INTERVAL = 30
+    DB_JOURNAL_FIELDS = ["status", "annotator_id", "start", "end"]
+
     @classmethod
     def get_name(cls):
         return cls.__name__
@@ -41,7 +255,11 @@ class Campaign:
         self.campaign_id = campaign_id
         self.dir = os.path.join(CAMPAIGN_DIR, campaign_id)
         self.db_path = os.path.join(self.dir, "db.csv")
+        self.db_journal_path = os.path.join(self.dir, "db_journal.jsonl")
+        self.db_sqlite_path = os.path.join(self.dir, "db.sqlite")
         self.metadata_path = os.path.join(self.dir, "metadata.json")
+        # index of the shard processed by this process, see `set_shard()`
+        self.shard = None
 
         self.load_metadata()
         self.load_db()
@@ -58,20 +276,160 @@ class Campaign:
 
         return examples_finished
 
+    def set_shard(self, shard):
+        """
+        Use the campaign object in a process which handles a single shard of the campaign db.
+
+        Each shard journals its changes separately and never compacts db.csv, which is left to the main process.
+        """
+        self.shard = shard
+        self.db_journal_path = os.path.join(self.dir, f"db_journal-shard{shard}.jsonl")
+
+    def get_db_journal_paths(self):
+        return sorted(glob.glob(os.path.join(self.dir, "db_journal*.jsonl")))
+
+    def remove_db_journals(self):
+        for path in self.get_db_journal_paths():
+            os.remove(path)
+
+    def get_db_backend(self):
+        return CampaignDBBackend.SQLITE if self.sqlite_db is not None else CampaignDBBackend.CSV
+
     def update_db(self, db):
         self.db = db
-        db.to_csv(self.db_path, index=False)
+
+        if self.sqlite_db is not None:
+            self.sqlite_db.replace(db)
+            return
+
+        # write to a temporary file first so that a killed process never leaves a truncated db.csv behind
+        tmp_path = self.db_path + ".tmp"
+        db.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.db_path)
+
+        # db.csv now contains all the changes, the journals are not needed anymore
+        self.remove_db_journals()
+
+        self.journal_rows = 0
+        self.last_flush = time.time()
+
+    def update_db_rows(self, db_idxs, db=None):
+        """
+        Persist changes of the given db rows without rewriting the whole db.csv.
+
+        The changes are appended to an append-only journal, which is replayed in `load_db()` (so that a killed process
+        resumes correctly) and compacted into db.csv once in a while and in `flush_db()`.
+
+        With the SQLite backend, the rows are updated directly in a transaction.
+
+        The caller passes the `db` it changed: the campaign object is shared and `self.db` may have been reloaded
+        in the meantime (e.g. by `get_overview()` on the campaign detail page during a run).
+        """
+        if db is not None:
+            self.db = db
+
+        if self.sqlite_db is not None:
+            self.sqlite_db.update_rows(self.db, db_idxs)
+            return
+
+        with open(self.db_journal_path, "a+") as f:
+            # start on a new line if the previous process was killed in the middle of writing
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != "\n":
+                    f.write("\n")
+
+            for db_idx in db_idxs:
+                entry = {"idx": int(db_idx)}
+
+                for field in self.DB_JOURNAL_FIELDS:
+                    entry[field] = to_python_value(self.db.at[db_idx, field])
+
+                f.write(json.dumps(entry) + "\n")
+
+        self.journal_rows += len(db_idxs)
+
+        if self.journal_rows >= self.DB_FLUSH_EVERY or time.time() - self.last_flush > self.DB_FLUSH_INTERVAL:
+            self.flush_db()
+
+    def flush_db(self):
+        """Compact the journals into db.csv."""
+        if self.sqlite_db is not None or self.shard is not None:
+            return
+
+        if self.journal_rows > 0 or self.get_db_journal_paths():
+            self.update_db(self.db)
+
+    def reload_db_rows(self, db_idxs, db=None):
+        """Refresh the given rows from the SQLite db, which may have been updated by another process."""
+        if db is not None:
+            self.db = db
+
+        if self.sqlite_db is None:
+            return
+
+        for db_idx, *values in self.sqlite_db.load_rows(db_idxs):
+            for field, value in zip(SQLiteCampaignDB.UPDATABLE_FIELDS, values):
+                self.db.at[db_idx, field] = value
+
+    def migrate_db_to_sqlite(self):
+        """Convert the campaign db from `db.csv` (including the journal) to `db.sqlite`."""
+        if self.sqlite_db is not None:
+            return False
+
+        self.load_db()
+
+        # the db is created under a temporary name so that an interrupted migration leaves the CSV db in use
+        tmp_path = self.db_sqlite_path + ".tmp"
+        SQLiteCampaignDB(tmp_path).create(self.db)
+        os.replace(tmp_path, self.db_sqlite_path)
+
+        # the SQLite db contains all the changes now
+        os.remove(self.db_path)
+        self.remove_db_journals()
+
+        self.load_db()
+
+        return True
+
+    def replay_db_journal(self):
+        # the main journal and the journals of the shards (which never touch the same rows)
+        for journal_path in self.get_db_journal_paths():
+            with open(journal_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be incomplete if the process was killed while writing
+                        logger.warning(f"Skipping an incomplete line in {journal_path}")
+                        continue
+
+                    for field in self.DB_JOURNAL_FIELDS:
+                        self.db.at[entry["idx"], field] = entry[field]
 
     def load_db(self):
+        self.journal_rows = 0
+        self.last_flush = time.time()
+
         # no db for external campaigns
         if self.metadata.get("mode") == CampaignMode.EXTERNAL:
+            self.sqlite_db = None
             self.db = pd.DataFrame()
             return
 
+        if os.path.exists(self.db_sqlite_path):
+            self.sqlite_db = SQLiteCampaignDB(self.db_sqlite_path)
+            self.db = self.sqlite_db.load()
+            return
+
+        self.sqlite_db = None
+
         dtype_dict = {"annotator_id": str, "start": float, "end": float}
         with open(self.db_path) as f:
             self.db = pd.read_csv(f, dtype=dtype_dict)
 
+        self.replay_db_journal()
+
     def update_metadata(self):
         with open(self.metadata_path, "w") as f:
             json.dump(self.metadata, f, indent=4)
@@ -84,9 +442,13 @@ class Campaign:
         self.metadata["campaign_id"] = self.campaign_id
 
     def clear_all_outputs(self):
+        # imported here: the workflows depend on this module
+        import factgenie.workflows as workflows
+
         # remove files
         for jsonl_file in glob.glob(os.path.join(self.dir, "files/*.jsonl")):
             os.remove(jsonl_file)
+            workflows.mark_changed(jsonl_file)
 
         self.db["status"] = ExampleStatus.FREE
         self.db["annotator_id"] = ""
@@ -98,12 +460,15 @@ class Campaign:
         self.update_metadata()
 
     def clear_output_by_idx(self, db_idx):
+        # imported here: the workflows depend on this module
+        import factgenie.workflows as workflows
+
         self.db.loc[db_idx, "status"] = ExampleStatus.FREE
         self.db.loc[db_idx, "annotator_id"] = ""
         self.db.loc[db_idx, "start"] = None
         self.db.loc[db_idx, "end"] = None
 
-        self.update_db(self.db)
+        self.update_db_rows([db_idx])
 
         if self.metadata.get("status") == CampaignStatus.FINISHED:
             self.metadata["status"] = CampaignStatus.IDLE
@@ -131,6 +496,8 @@ class Campaign:
                     ):
                         f.write(line)
 
+            workflows.mark_changed(jsonl_file)
+
         logger.info(f"Cleared outputs and assignments for {db_idx}")
 
 
@@ -148,6 +515,15 @@ class HumanCampaign(Campaign):
         )
 
     def check_idle_time(self):
+        if self.sqlite_db is not None:
+            # the in-memory db may be outdated, the examples may have been submitted by another app process
+            for db_idx in self.sqlite_db.free_idle_rows(time.time() - self.metadata["config"]["idle_time"] * 60):
+                logger.info(
+                    f"Freeing example {self.db.loc[db_idx, 'example_idx']} for {self.campaign_id} due to idle time"
+                )
+                self.reload_db_rows([db_idx])
+            return
+
         current_time = datetime.now()
         for _, example in self.db.iterrows():
             if (
@@ -213,12 +589,165 @@ class HumanCampaign(Campaign):
         return overview_df.to_dict(orient="records")
 
 
+def to_number(value):
+    """The value as a float, None if it is missing or not a number."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return None if math.isnan(value) else value
+
+
+class CallStats:
+    """
+    Running aggregates of the metrics of the LLM calls, updated with each finished example.
+
+    The latency percentiles are computed from a random sample of at most `LATENCY_SAMPLE_SIZE` latencies.
+    """
+
+    LATENCY_SAMPLE_SIZE = 1000
+    SUM_FIELDS = ["prompt_tokens", "completion_tokens", "cost", "retries", "queue_wait", "parse_time"]
+
+    def __init__(self):
+        self.call_cnt = 0
+        # field -> [sum, number of calls with the value]
+        self.sums = {field: [0.0, 0] for field in self.SUM_FIELDS}
+        self.latencies = []
+        self.latency_cnt = 0
+        # (end timestamp, completion tokens) of the calls, to count the throughput of a new run
+        self.ends = []
+        # start of the run the run aggregates are counted for
+        self.run_start = None
+        self.run = None
+
+    def add_to_run(self, end, completion_tokens):
+        if end is None or end < self.run_start:
+            return
+
+        self.run["cnt"] += 1
+        self.run["end"] = max(self.run["end"], end)
+
+        if completion_tokens is not None:
+            self.run["completion_tokens"] = (self.run["completion_tokens"] or 0) + completion_tokens
+
+    def set_run_start(self, run_start):
+        if run_start == self.run_start:
+            return
+
+        self.run_start = run_start
+        self.run = {"cnt": 0, "end": -math.inf, "completion_tokens": None}
+
+        for end, completion_tokens in self.ends:
+            self.add_to_run(end, completion_tokens)
+
+    def add(self, metrics, end):
+        self.call_cnt += 1
+
+        for field in self.SUM_FIELDS:
+            value = to_number(metrics.get(field))
+
+            if value is not None:
+                self.sums[field][0] += value
+                self.sums[field][1] += 1
+
+        latency = to_number(metrics.get("latency"))
+
+        # cached responses do not count towards the latency
+        if latency is not None and not metrics.get("cached"):
+            self.latency_cnt += 1
+
+            if len(self.latencies) < self.LATENCY_SAMPLE_SIZE:
+                self.latencies.append(latency)
+            elif (j := random.randrange(self.latency_cnt)) < self.LATENCY_SAMPLE_SIZE:
+                self.latencies[j] = latency
+
+        end = to_number(end)
+        completion_tokens = to_number(metrics.get("completion_tokens"))
+        self.ends.append((end, completion_tokens))
+
+        if self.run_start is not None:
+            self.add_to_run(end, completion_tokens)
+
+    def get_sum(self, field):
+        total, cnt = self.sums[field]
+        return total if cnt else None
+
+    def get_mean(self, field):
+        total, cnt = self.sums[field]
+        return total / cnt if cnt else None
+
+    def get_latency_quantile(self, q):
+        return float(np.quantile(self.latencies, q)) if self.latencies else None
+
+
 class LLMCampaign(Campaign):
+    def __init__(self, campaign_id):
+        # aggregated token usage and timing of the LLM calls (`CallStats`), loaded lazily from the records
+        self.call_stats = None
+        super().__init__(campaign_id)
+
+    def load_call_metrics(self):
+        self.call_stats = CallStats()
+
+        for record in self.get_finished_examples():
+            self.add_call_metrics(record)
+
+    def add_call_metrics(self, record):
+        if self.call_stats is None:
+            # the record is already saved, so it gets loaded here
+            self.load_call_metrics()
+            return
+
+        metadata = record.get("metadata", {})
+
+        if metadata.get("metrics"):
+            self.call_stats.add(metadata["metrics"], metadata.get("end_timestamp"))
+
+    def get_call_stats(self):
+        """Aggregated token usage, latency, cost and throughput of the LLM calls."""
+        if self.call_stats is None:
+            self.load_call_metrics()
+
+        call_stats = self.call_stats
+
+        if not call_stats.call_cnt:
+            return {}
+
+        # throughput of the current (or the last) run
+        call_stats.set_run_start(self.metadata.get("last_run", 0))
+        run = call_stats.run
+        run_end = time.time() if self.metadata.get("status") == CampaignStatus.RUNNING else run["end"]
+        elapsed = run_end - call_stats.run_start if run["cnt"] else 0
+
+        stats = {
+            "prompt_tokens": call_stats.get_sum("prompt_tokens"),
+            "completion_tokens": call_stats.get_sum("completion_tokens"),
+            "cost": call_stats.get_sum("cost"),
+            "latency_p50": call_stats.get_latency_quantile(0.5),
+            "latency_p95": call_stats.get_latency_quantile(0.95),
+            "queue_wait_avg": call_stats.get_mean("queue_wait"),
+            "parse_time_avg": call_stats.get_mean("parse_time"),
+            "retries": call_stats.get_sum("retries") or 0,
+            "tokens_per_s": (
+                run["completion_tokens"] / elapsed if elapsed > 0 and run["completion_tokens"] is not None else None
+            ),
+            "examples_per_min": run["cnt"] / elapsed * 60 if elapsed > 0 else None,
+        }
+
+        # JSON-serializable values for the SSE payload
+        return {key: (None if value is None else round(float(value), 4)) for key, value in stats.items()}
+
     def get_stats(self):
+        cache_stats = self.metadata.get("cache_stats", {})
+
         return {
             "total": len(self.db),
             "finished": len(self.db[self.db["status"] == ExampleStatus.FINISHED]),
             "free": len(self.db[self.db["status"] == ExampleStatus.FREE]),
+            "cache_hits": cache_stats.get("hits", 0),
+            "cache_misses": cache_stats.get("misses", 0),
+            **self.get_call_stats(),
         }
 
     def clear_output(self, idx, annotator_group):
@@ -226,6 +755,9 @@ class LLMCampaign(Campaign):
         db_idx = example_row.name
         self.clear_output_by_idx(db_idx)
 
+        # the metrics of the removed record
+        self.call_stats = None
+
 
 class LLMCampaignEval(LLMCampaign):
     def get_overview(self):
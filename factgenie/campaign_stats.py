@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# Materialized statistics of the annotation campaigns.
+# The counts needed for the statistics on the analysis page are kept in `<campaign_dir>/stats.json` and updated with
+# the records appended to the annotation files since the last update (the same way as the indexes in `indexes.py`),
+# so that viewing the statistics of a running campaign does not go through all of its records again.
+# The counts are kept separately for each annotation file, a file which gets rewritten is counted again from scratch.
+# The counts are updated whenever a record is saved (`workflows.save_record()`); while the records keep coming, the file
+# is written at most once per STATS_SAVE_INTERVAL seconds.
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import factgenie.workflows as workflows
+from factgenie.indexes import refresh_index
+
+logger = logging.getLogger("factgenie")
+
+STATS_FILE = "stats.json"
+STATS_VERSION = 1
+STATS_SAVE_INTERVAL = 10
+
+EXTRA_FIELDS = ["flags", "options", "text_fields"]
+
+
+def get_span_category(annotation, category_cnt):
+    """The category of the span if it is an integer in the range of the campaign categories, otherwise None."""
+    annotation_type = annotation.get("type")
+
+    # numbers only (`True == 1` in Python)
+    if not isinstance(annotation_type, (int, float)) or isinstance(annotation_type, bool):
+        return None
+
+    if annotation_type != int(annotation_type) or not 0 <= annotation_type < category_cnt:
+        return None
+
+    return int(annotation_type)
+
+
+def is_counted_span(annotation):
+    """The spans with a start and a non-empty text are counted in the annotation counts."""
+    start = annotation.get("start")
+    text = annotation.get("text")
+
+    return isinstance(start, (int, float)) and not isinstance(start, bool) and isinstance(text, str) and len(text) > 0
+
+
+class FileStats:
+    def __init__(self):
+        # (dataset, split, setup_id) -> example indices
+        self.examples = defaultdict(set)
+        # (dataset, split, setup_id, annotation_type) -> number of spans
+        self.ann_counts = defaultdict(int)
+        # (dataset, split, setup_id, annotation_type) -> number of records with at least one span of the category
+        self.affected_counts = defaultdict(int)
+        # (label, value) -> number of occurrences in flags, options and text fields
+        self.extra_fields = defaultdict(int)
+
+    def add(self, record, category_cnt):
+        group = (record["dataset"], record["split"], record["setup_id"])
+        self.examples[group].add(record["example_idx"])
+
+        categories = set()
+
+        for annotation in record.get("annotations") or []:
+            category = get_span_category(annotation, category_cnt)
+
+            if category is None:
+                continue
+
+            categories.add(category)
+
+            if is_counted_span(annotation):
+                self.ann_counts[(*group, category)] += 1
+
+        for category in categories:
+            self.affected_counts[(*group, category)] += 1
+
+        for field in EXTRA_FIELDS:
+            for d in record.get(field) or []:
+                value = d["value"]
+
+                if isinstance(value, (list, dict)):
+                    value = json.dumps(value)
+
+                self.extra_fields[(d["label"], value)] += 1
+
+    def to_json(self):
+        return {
+            "examples": [[*group, sorted(example_idxs)] for group, example_idxs in self.examples.items()],
+            "ann_counts": [[*key, count] for key, count in self.ann_counts.items()],
+            "affected_counts": [[*key, count] for key, count in self.affected_counts.items()],
+            "extra_fields": [[*key, count] for key, count in self.extra_fields.items()],
+        }
+
+    @classmethod
+    def from_json(cls, j):
+        file_stats = cls()
+
+        for *group, example_idxs in j["examples"]:
+            file_stats.examples[tuple(group)] = set(example_idxs)
+
+        for field in ["ann_counts", "affected_counts", "extra_fields"]:
+            counts = getattr(file_stats, field)
+
+            for *key, count in j[field]:
+                counts[tuple(key)] = count
+
+        return file_stats
+
+
+class CampaignStats:
+    """
+    Counts of the campaign records, updated incrementally with `refresh_index()` (it is used as the index).
+
+    The statistics are computed from the counts in `analysis.compute_statistics()`.
+    """
+
+    def __init__(self, campaign_id, category_cnt):
+        self.campaign_id = campaign_id
+        self.category_cnt = category_cnt
+        self.files = {}
+        self.file_cache = {}
+        self.lock = threading.Lock()
+        # the counts not written to the stats file yet
+        self.unsaved = False
+        self.saved_time = 0
+
+    def add(self, record):
+        file_stats = self.files.get(record["jsonl_file"])
+
+        if file_stats is None:
+            file_stats = self.files[record["jsonl_file"]] = FileStats()
+
+        file_stats.add(record, self.category_cnt)
+
+    def remove_file(self, file_path):
+        self.files.pop(file_path, None)
+
+    def get_totals(self):
+        """Counts summed over all the files."""
+        totals = FileStats()
+
+        for file_stats in self.files.values():
+            for group, example_idxs in file_stats.examples.items():
+                totals.examples[group] |= example_idxs
+
+            for field in ["ann_counts", "affected_counts", "extra_fields"]:
+                counts = getattr(totals, field)
+
+                for key, count in getattr(file_stats, field).items():
+                    counts[key] += count
+
+        return totals
+
+    def refresh(self, campaign_dir):
+        """Count the records appended since the last refresh, return True if anything changed."""
+        file_cache = refresh_index(
+            self,
+            workflows.get_annotation_files(campaign_dirs=[Path(campaign_dir)]),
+            self.file_cache,
+            parse_lines=workflows.load_annotations_from_lines,
+        )
+        changed = file_cache != self.file_cache
+        self.file_cache = file_cache
+
+        return changed
+
+    def update(self, campaign_dir, force=False):
+        """Refresh the counts and write them to the stats file, at most once per STATS_SAVE_INTERVAL unless forced."""
+        if self.refresh(campaign_dir):
+            self.unsaved = True
+
+        if self.unsaved and (force or time.time() - self.saved_time >= STATS_SAVE_INTERVAL):
+            self.save(os.path.join(campaign_dir, STATS_FILE))
+
+    def save(self, path):
+        j = {
+            "version": STATS_VERSION,
+            "campaign_id": self.campaign_id,
+            "category_cnt": self.category_cnt,
+            "file_cache": {
+                file_path: {**state, "fingerprint": state["fingerprint"].hex()}
+                for file_path, state in self.file_cache.items()
+            },
+            "files": {file_path: file_stats.to_json() for file_path, file_stats in self.files.items()},
+        }
+
+        # the readers never see an incomplete file, the processes saving the records of the campaign write their own
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+        with open(tmp_path, "w") as f:
+            json.dump(j, f)
+
+        os.replace(tmp_path, path)
+
+        self.unsaved = False
+        self.saved_time = time.time()
+
+    @classmethod
+    def load(cls, path, campaign_id, category_cnt):
+        """Load the counts from the file, start from scratch if it is missing, outdated or broken."""
+        stats = cls(campaign_id, category_cnt)
+
+        if not os.path.exists(path):
+            return stats
+
+        try:
+            with open(path) as f:
+                j = json.load(f)
+
+            if j["version"] != STATS_VERSION or j["campaign_id"] != campaign_id or j["category_cnt"] != category_cnt:
+                return stats
+
+            stats.file_cache = {
+                file_path: {**state, "fingerprint": bytes.fromhex(state["fingerprint"])}
+                for file_path, state in j["file_cache"].items()
+            }
+            stats.files = {file_path: FileStats.from_json(file_stats) for file_path, file_stats in j["files"].items()}
+        except Exception as e:
+            logger.warning(f"Could not load the statistics of campaign {campaign_id}, counting from scratch: {e}")
+            stats = cls(campaign_id, category_cnt)
+
+        return stats
+
+
+def load_campaign_stats(app, campaign):
+    """The counts of the campaign kept in the app, loaded from the stats file on the first use."""
+    category_cnt = len(campaign.metadata["config"]["annotation_span_categories"])
+
+    with app.db["lock"]:
+        stats = app.db["campaign_stats"].get(campaign.campaign_id)
+
+        if stats is None or stats.category_cnt != category_cnt:
+            stats = CampaignStats.load(os.path.join(campaign.dir, STATS_FILE), campaign.campaign_id, category_cnt)
+            app.db["campaign_stats"][campaign.campaign_id] = stats
+
+    return stats
+
+
+def get_campaign_stats(app, campaign):
+    """Counts of the campaign records, updated with the records added since the last call."""
+    stats = load_campaign_stats(app, campaign)
+
+    with stats.lock:
+        stats.update(campaign.dir, force=True)
+
+    return stats
+
+
+def update_campaign_stats(app, campaign):
+    """Count the records which have just been appended to the annotation files of the campaign."""
+    stats = load_campaign_stats(app, campaign)
+
+    with stats.lock:
+        stats.update(campaign.dir)
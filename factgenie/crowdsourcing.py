@@ -15,7 +15,7 @@ from jinja2 import Template
 import factgenie.utils as utils
 import factgenie.workflows as workflows
 from factgenie import CAMPAIGN_DIR, PREVIEW_STUDY_ID, TEMPLATES_DIR
-from factgenie.campaign import CampaignMode, ExampleStatus
+from factgenie.campaign import CampaignDBBackend, CampaignMode, ExampleStatus, save_campaign_db
 
 logger = logging.getLogger("factgenie")
 
@@ -30,7 +30,9 @@ def create_crowdsourcing_campaign(app, campaign_id, config, campaign_data):
 
         # create the annotation CSV
         db = generate_crowdsourcing_campaign_db(app, campaign_data, config=config)
-        db.to_csv(os.path.join(CAMPAIGN_DIR, campaign_id, "db.csv"), index=False)
+        save_campaign_db(
+            os.path.join(CAMPAIGN_DIR, campaign_id), db, backend=app.config.get("campaign_db", CampaignDBBackend.CSV)
+        )
 
         # save metadata
         with open(os.path.join(CAMPAIGN_DIR, campaign_id, "metadata.json"), "w") as f:
@@ -48,6 +50,7 @@ def create_crowdsourcing_campaign(app, campaign_id, config, campaign_data):
         # prepare the crowdsourcing HTML page
         create_crowdsourcing_page(campaign_id, config)
 
+        workflows.mark_changed(os.path.join(CAMPAIGN_DIR, campaign_id), is_directory=True)
         workflows.load_campaign(app, campaign_id)
     except Exception as e:
         # cleanup
@@ -337,28 +340,42 @@ def get_annotator_batch(app, campaign, service_ids, batch_idx=None):
         start = int(time.time())
         seed = random.seed(str(start) + str(service_ids.values()))
 
-        if not batch_idx:
-            # usual case: an annotator opened the annotation page, we need to select the batch
-            try:
-                batch_idx, annotator_group = select_batch(db, seed, annotator_id)
-            except ValueError as e:
-                logging.info(str(e))
-                # no available batches
-                return []
-        else:
-            # preview mode with the specific batch
-            batch_idx = int(batch_idx)
-            annotator_group = 0
+        if not batch_idx and annotator_id != PREVIEW_STUDY_ID and campaign.sqlite_db is not None:
+            # select and assign the batch in a single transaction (safe even with multiple app processes)
+            selected = campaign.sqlite_db.assign_batch(annotator_id, start)
 
-        mask = (db["batch_idx"] == batch_idx) & (db["annotator_group"] == annotator_group)
+            if selected is None:
+                logging.info("No available batches")
+                return []
 
-        # we do not block the example if we are in preview mode
-        if annotator_id != PREVIEW_STUDY_ID:
-            db.loc[mask, "status"] = ExampleStatus.ASSIGNED
-            db.loc[mask, "start"] = start
-            db.loc[mask, "annotator_id"] = annotator_id
+            batch_idx, annotator_group = selected
+            logging.info(f"Selected batch {batch_idx} (annotator group {annotator_group})")
+            mask = (db["batch_idx"] == batch_idx) & (db["annotator_group"] == annotator_group)
 
-            campaign.update_db(db)
+            campaign.reload_db_rows(db.index[mask], db=db)
+        else:
+            if not batch_idx:
+                # usual case: an annotator opened the annotation page, we need to select the batch
+                try:
+                    batch_idx, annotator_group = select_batch(db, seed, annotator_id)
+                except ValueError as e:
+                    logging.info(str(e))
+                    # no available batches
+                    return []
+            else:
+                # preview mode with the specific batch
+                batch_idx = int(batch_idx)
+                annotator_group = 0
+
+            mask = (db["batch_idx"] == batch_idx) & (db["annotator_group"] == annotator_group)
+
+            # we do not block the example if we are in preview mode
+            if annotator_id != PREVIEW_STUDY_ID:
+                db.loc[mask, "status"] = ExampleStatus.ASSIGNED
+                db.loc[mask, "start"] = start
+                db.loc[mask, "annotator_id"] = annotator_id
+
+                campaign.update_db_rows(db.index[mask], db=db)
 
         annotator_batch = get_examples_for_batch(db, batch_idx, annotator_group)
         logging.info(f"Releasing lock for {annotator_id}")
@@ -381,6 +398,9 @@ def save_annotations(app, campaign_id, annotation_set, annotator_id):
         # select the examples for this batch and annotator group
         mask = (db["batch_idx"] == batch_idx) & (db["annotator_group"] == annotator_group)
 
+        # the batch may have been assigned by another process sharing the SQLite db
+        campaign.reload_db_rows(db.index[mask], db=db)
+
         # if the batch is not assigned to this annotator, return an error
         batch_annotator_id = db.loc[mask].iloc[0]["annotator_id"]
 
@@ -393,7 +413,7 @@ def save_annotations(app, campaign_id, annotation_set, annotator_id):
         # update the db
         db.loc[mask, "status"] = ExampleStatus.FINISHED
         db.loc[mask, "end"] = now
-        campaign.update_db(db)
+        campaign.update_db_rows(db.index[mask], db=db)
 
         # save the annotations
         for i, ann in enumerate(annotation_set):
@@ -428,6 +448,7 @@ def save_annotations(app, campaign_id, annotation_set, annotator_id):
                 campaign=campaign,
                 row=row,
                 result=res,
+                app=app,
             )
         logger.info(
             f"Annotations for {campaign_id} (batch {batch_idx}, annotator group {annotator_group}, annotator {annotator_id}) saved."
@@ -3,19 +3,154 @@ import logging
 
 logger = logging.getLogger("factgenie")
 
-from factgenie.datasets.dataset import Dataset
+from factgenie.datasets.dataset import INDEX_CHUNK_SIZE, Dataset, LazyExamples, get_line_offsets
 from pathlib import Path
 from natsort import natsorted
 import requests
 import zipfile
 import os
+import io
 import re
 import json
 import json2table
+import numpy as np
 import pandas as pd
 
 from factgenie.utils import resumable_download
 
+# +1 for opening and -1 for closing brackets in a JSON document
+JSON_BRACKETS = np.zeros(256, dtype=np.int64)
+JSON_BRACKETS[[ord("["), ord("{")]] = 1
+JSON_BRACKETS[[ord("]"), ord("}")]] = -1
+
+# number of rows read at once when inferring the types of the CSV columns for the lazy mode
+CSV_DTYPE_CHUNK_ROWS = 100000
+
+
+def parse_text_line(data):
+    return data.decode("utf-8").strip()
+
+
+def parse_json(data):
+    return json.loads(data)
+
+
+def get_json_array_offsets(path):
+    """
+    Byte offsets of the starts and ends of the elements of the top-level JSON array.
+
+    The file is scanned in chunks with numpy: brackets and commas inside strings are skipped by counting the (unescaped)
+    quotes before them. Only arrays of objects or arrays are supported.
+    """
+    starts, ends = [], []
+    separator_cnt = 0
+    depth = 0
+    in_string = 0
+    # number of backslashes at the end of the previous chunk
+    backslash_run = 0
+    pos = 0
+
+    with open(path, "rb") as f:
+        while chunk := f.read(INDEX_CHUNK_SIZE):
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            quotes = np.flatnonzero(data == ord('"'))
+
+            # a quote preceded by an odd number of backslashes is escaped
+            escaped = np.zeros(len(quotes), dtype=bool)
+            if len(quotes) and quotes[0] == 0:
+                escaped[0] = backslash_run % 2 == 1
+            for i in np.flatnonzero((data[np.maximum(quotes - 1, 0)] == ord("\\")) & (quotes > 0)):
+                j = quotes[i] - 1
+                while j >= 0 and data[j] == ord("\\"):
+                    j -= 1
+                run = quotes[i] - 1 - j + (backslash_run if j < 0 else 0)
+                escaped[i] = run % 2 == 1
+            quotes = quotes[~escaped]
+
+            tokens = np.flatnonzero((JSON_BRACKETS[data] != 0) | (data == ord(",")))
+            tokens = tokens[(np.searchsorted(quotes, tokens) + in_string) % 2 == 0]
+
+            deltas = JSON_BRACKETS[data[tokens]]
+            depth_after = depth + np.cumsum(deltas)
+            depth_before = depth_after - deltas
+
+            starts.append(tokens[(deltas == 1) & (depth_before == 1)] + pos)
+            ends.append(tokens[(deltas == -1) & (depth_after == 1)] + pos + 1)
+            separator_cnt += int(np.count_nonzero((deltas == 0) & (depth_before == 1)))
+
+            if len(tokens):
+                depth = int(depth_after[-1])
+            in_string = (in_string + len(quotes)) % 2
+
+            trailing = len(chunk) - len(chunk.rstrip(b"\\"))
+            backslash_run = trailing + backslash_run if trailing == len(chunk) else trailing
+            pos += len(chunk)
+
+    starts, ends = np.concatenate(starts or [[]]).astype(np.int64), np.concatenate(ends or [[]]).astype(np.int64)
+
+    with open(path, "rb") as f:
+        head = f.read(INDEX_CHUNK_SIZE).lstrip()
+
+    # the elements are found only at the depth 1, which has to be the top-level array, and an array without any
+    # elements found has to be empty (an array of strings or numbers has no elements to find)
+    if (
+        not head.startswith(b"[")
+        or (not len(starts) and not head[1:].lstrip().startswith(b"]"))
+        or len(starts) != len(ends)
+        or (len(starts) and separator_cnt != len(starts) - 1)
+    ):
+        raise ValueError(f"Lazy loading of {path} failed: the file has to contain a JSON array of objects or arrays.")
+
+    return starts, ends
+
+
+def merge_csv_dtypes(dtype, other):
+    # a column with a string anywhere is a string column (including the numbers)
+    if "str" in [dtype, other]:
+        return "str"
+
+    # mixed types (`np.dtype(None)` is float64, so None has to be checked before comparing)
+    if dtype is None or other is None:
+        return None
+
+    if dtype == other:
+        return dtype
+
+    # an integer column with a missing value or a float in another chunk is a float column
+    if dtype.kind in "iuf" and other.kind in "iuf":
+        return np.result_type(dtype, other)
+
+    return None
+
+
+def get_csv_dtypes(path):
+    """
+    Types of the CSV columns inferred from the whole file, as `pd.read_csv` infers them.
+
+    The file is read in chunks of CSV_DTYPE_CHUNK_ROWS rows. The values are `"str"` for string columns and None for the
+    columns with mixed types, whose types are inferred for each row separately.
+    """
+    dtypes = {}
+
+    for chunk in pd.read_csv(path, chunksize=CSV_DTYPE_CHUNK_ROWS):
+        for col in chunk.columns:
+            dtype = "str" if pd.api.types.is_string_dtype(chunk[col]) else chunk[col].dtype
+            dtypes[col] = merge_csv_dtypes(dtypes[col], dtype) if col in dtypes else dtype
+
+    return {col: dtype for col, dtype in dtypes.items() if dtype is not None}
+
+
+class CSVRowParser:
+    """Parses a single row of a CSV file with the given header line and column types (`get_csv_dtypes()`)."""
+
+    def __init__(self, header, dtypes):
+        self.header = header
+        self.dtypes = dtypes
+
+    def __call__(self, data):
+        row = pd.read_csv(io.BytesIO(self.header + data), dtype=self.dtypes).astype(object).iloc[0]
+        return dict(row)
+
 
 class BasicDataset(Dataset):
     @classmethod
@@ -85,6 +220,11 @@ class PlainTextDataset(BasicDataset):
 
         return examples
 
+    def load_lazy_examples(self, split, data_path):
+        path = f"{data_path}/{split}.txt"
+
+        return LazyExamples.from_line_offsets(path, get_line_offsets(path), parse_text_line)
+
     def render(self, example):
         html = "<div>"
         html += "<p>"
@@ -107,6 +247,21 @@ class JSONDataset(BasicDataset):
                 examples = json.load(f)
         return examples
 
+    def load_lazy_examples(self, split, data_path):
+        examples_path = data_path / f"{split}.json"
+
+        if not examples_path.exists() or examples_path.stat().st_size == 0:
+            logger.warning("No examples found for the dataset.")
+            return []
+
+        try:
+            starts, ends = get_json_array_offsets(examples_path)
+        except ValueError as e:
+            logger.warning(f"{e} Loading the examples eagerly.")
+            return self.load_examples(split, data_path)
+
+        return LazyExamples(examples_path, starts, ends, parse_json)
+
     def render(self, example):
         # default method, can be overwritten by dataset classes
         html = json2table.convert(
@@ -129,6 +284,11 @@ class JSONLDataset(BasicDataset):
 
         return examples
 
+    def load_lazy_examples(self, split, data_path):
+        path = f"{data_path}/{split}.jsonl"
+
+        return LazyExamples.from_line_offsets(path, get_line_offsets(path), parse_json)
+
     def render(self, example):
         # default method, can be overwritten by dataset classes
         html = json2table.convert(
@@ -155,6 +315,22 @@ class CSVDataset(BasicDataset):
 
         return examples
 
+    def load_lazy_examples(self, split, data_path):
+        path = f"{data_path}/{split}.csv"
+        offsets = get_line_offsets(path, quote_aware=True)
+        starts, ends = offsets[1:-1], offsets[2:]
+
+        with open(path, "rb") as f:
+            header = f.read(offsets[1])
+
+            # skip blank lines as `pd.read_csv` does
+            keep = np.ones(len(starts), dtype=bool)
+            for i in np.flatnonzero(ends - starts <= 2):
+                f.seek(starts[i])
+                keep[i] = bool(f.read(ends[i] - starts[i]).strip())
+
+        return LazyExamples(path, starts[keep], ends[keep], CSVRowParser(header, get_csv_dtypes(path)))
+
     def render(self, example):
         html = (
             "<table class='table table-sm caption-top meta-table table-responsive font-mono rounded-3 table-bordered'>"
@@ -2,14 +2,18 @@
 import logging
 import requests
 import json
+import hashlib
 import os
 import zipfile
 import importlib
 import inspect
+import mmap
 
+import numpy as np
 
 from pathlib import Path
 from collections import defaultdict
+from collections.abc import Sequence
 from slugify import slugify
 from abc import ABC, abstractmethod
 
@@ -17,6 +21,9 @@ from factgenie import INPUT_DIR, OUTPUT_DIR
 
 logger = logging.getLogger("factgenie")
 
+# size of the chunks in which the data files are scanned when building the index of the examples
+INDEX_CHUNK_SIZE = 64 * 1024 * 1024
+
 
 def get_dataset_classes():
     module_name = "factgenie.datasets"
@@ -36,6 +43,100 @@ def get_dataset_classes():
     return classes
 
 
+def get_line_offsets(path, quote_aware=False):
+    """
+    Byte offsets of the lines in the file: line `i` spans the bytes `offsets[i]:offsets[i + 1]`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    quote_aware : bool
+        Ignore the newlines inside double quotes (for multi-line CSV fields).
+
+    Returns
+    -------
+    offsets : numpy.ndarray
+        Array of line count + 1 offsets.
+    """
+    offsets = [np.zeros(1, dtype=np.int64)]
+    quote_cnt = 0
+    pos = 0
+
+    with open(path, "rb") as f:
+        while chunk := f.read(INDEX_CHUNK_SIZE):
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            newlines = np.flatnonzero(data == ord("\n"))
+
+            if quote_aware:
+                quote_cnts = np.cumsum(data == ord('"')) + quote_cnt
+                newlines = newlines[quote_cnts[newlines] % 2 == 0]
+                quote_cnt = int(quote_cnts[-1])
+
+            offsets.append(newlines.astype(np.int64) + pos + 1)
+            pos += len(chunk)
+
+    # the last line does not have to end with a newline
+    if pos > 0 and offsets[-1][-1:].tolist() != [pos]:
+        offsets.append(np.array([pos], dtype=np.int64))
+
+    return np.concatenate(offsets)
+
+
+class LazyExamples(Sequence):
+    """
+    Examples of a split which are read from the (memory-mapped) data file only when they are accessed.
+
+    Parameters
+    ----------
+    path : str
+        Path to the data file.
+    starts : numpy.ndarray
+        Byte offsets of the starts of the examples in the file.
+    ends : numpy.ndarray
+        Byte offsets of the ends of the examples in the file (exclusive).
+    parse : callable
+        Function converting the bytes of an example to the example.
+    """
+
+    def __init__(self, path, starts, ends, parse):
+        self.path = str(path)
+        self.starts = starts
+        self.ends = ends
+        self.parse = parse
+        self._mmap = None
+
+    @classmethod
+    def from_line_offsets(cls, path, offsets, parse):
+        return cls(path, offsets[:-1], offsets[1:], parse)
+
+    def __getstate__(self):
+        # the memory map is opened again after unpickling
+        return {**self.__dict__, "_mmap": None}
+
+    def get_mmap(self):
+        if self._mmap is None:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._mmap
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Example index {idx} out of range")
+
+        return self.parse(self.get_mmap()[self.starts[idx] : self.ends[idx]])
+
+
 class Dataset(ABC):
     """
     Abstract class for datasets.
@@ -47,16 +148,32 @@ class Dataset(ABC):
 
         self.splits = kwargs.get("splits", ["train", "dev", "test"])
         self.description = kwargs.get("description", "")
+        # read the examples from the disk only when they are needed
+        self.lazy = kwargs.get("lazy", False)
+
+        if self.lazy and not self.supports_lazy_loading():
+            logger.warning(f"Dataset {self.id} does not support lazy loading, loading all the examples.")
+            self.lazy = False
 
         # load data
         self.examples = {}
 
         for split in self.splits:
+            if self.lazy:
+                examples = self.load_lazy_examples(split=split, data_path=self.data_path)
+
+                if examples is not None:
+                    self.examples[split] = examples
+                    continue
+
             examples = self.load_examples(split=split, data_path=self.data_path)
             examples = self.postprocess_data(examples=examples)
 
             self.examples[split] = examples
 
+        # key of the cached rendered examples
+        self.version = self.get_version()
+
     # --------------------------------
     # TODO: implement in subclasses
     # --------------------------------
@@ -138,6 +255,41 @@ class Dataset(ABC):
     # end TODO
     # --------------------------------
 
+    def load_lazy_examples(self, split, data_path):
+        """
+        Load the index of the examples for the lazy mode (`lazy: true` in the dataset config).
+
+        Optional, implemented for the basic file formats in `basic.py`. Without it, the examples are loaded eagerly.
+
+        Parameters
+        ----------
+        split : str
+            Split to load the data for.
+        data_path : str
+            Path to the data directory.
+
+        Returns
+        -------
+        examples : LazyExamples or None
+            Sequence of examples for the given split read on demand, None to load the examples eagerly.
+        """
+        return None
+
+    def supports_lazy_loading(self):
+        """
+        The lazy examples have to come from the same class as the eagerly loaded ones and they cannot be postprocessed
+        (`postprocess_data()` works with all the examples at once).
+        """
+
+        def get_owner(method_name):
+            return next(cls for cls in type(self).__mro__ if method_name in cls.__dict__)
+
+        return (
+            get_owner("load_lazy_examples") is not Dataset
+            and get_owner("load_lazy_examples") is get_owner("load_examples")
+            and get_owner("postprocess_data") is Dataset
+        )
+
     def postprocess_data(self, examples):
         """
         Postprocess the data after loading.
@@ -149,6 +301,29 @@ class Dataset(ABC):
         """
         return examples
 
+    def get_version(self):
+        """
+        Identifier of the dataset contents and of the renderer, used as a part of the key of the rendered examples.
+
+        Changes with the files in the data directory (the top level) and with the source file of the dataset class.
+        Override it if the rendered examples depend on anything else.
+        """
+        state = [type(self).__module__, type(self).__qualname__]
+        paths = [inspect.getfile(type(self))]
+
+        if os.path.isdir(self.data_path):
+            paths += sorted(str(path) for path in Path(self.data_path).iterdir())
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            state.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+
+        return hashlib.sha1("\n".join(state).encode()).hexdigest()[:16]
+
     def get_example(self, split, example_idx):
         """
         Get the example at the given index for the given split.
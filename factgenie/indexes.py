@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+# In-memory indexes of the model outputs and annotations on disk.
+#
+# The records are kept in dictionaries keyed by the example coordinates, so that looking up the outputs for an example
+# does not scan the records of all the other examples. Modules that need the whole index as a DataFrame (analysis,
+# exports, overviews) get it with `to_frame()`, which is rebuilt only after the index changes.
+#
+# The JSONL files are mostly appended to (`save_record`), so the index remembers how far each file was parsed and reads
+# only the new lines on refresh. The file is parsed again from the start only if it was replaced, truncated or
+# rewritten (e.g. by `clear_output_by_idx`).
+#
+# To make the startup fast, the indexes are also saved to a Parquet snapshot in CACHE_DIR together with the manifest of
+# the indexed files. A new process loads the snapshot and parses only the files which changed since it was saved.
+import json
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+from factgenie import CACHE_DIR
+
+logger = logging.getLogger("factgenie")
+
+# number of bytes before the parsed offset used to detect a rewritten file
+FINGERPRINT_SIZE = 64
+
+SNAPSHOT_DIR = CACHE_DIR / "indexes"
+SNAPSHOT_VERSION = 1
+# while the index keeps changing, the snapshot is saved at most once per this many seconds
+SNAPSHOT_INTERVAL = 60
+
+
+class OutputIndex:
+    """
+    Model outputs keyed by (dataset, split, setup_id, example_idx).
+
+    If more files hold a record with the same key, the record added last is used. The records from the other files are
+    kept, so that the key falls back to them when the file with the used record is removed.
+
+    Secondary indexes:
+        - by example: (dataset, split, example_idx) -> {setup_id: record}
+        - by setup: (dataset, split, setup_id) -> {example_idx: record}
+        - by file: jsonl_file -> set of primary keys
+        - held: primary key -> {jsonl_file: record}, in the order in which the records were added
+    """
+
+    def __init__(self, cols):
+        self.cols = cols
+        self.record_cols = cols + ["jsonl_file"]
+        self.records = {}
+        self.by_example = defaultdict(dict)
+        self.by_setup = defaultdict(dict)
+        self.by_file = defaultdict(set)
+        self.held = defaultdict(dict)
+        self._frame = None
+        # incremented on every change
+        self.version = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def get_key(record):
+        return (record["dataset"], record["split"], record["setup_id"], record["example_idx"])
+
+    def add(self, record):
+        record = {col: record.get(col) for col in self.record_cols}
+        key = self.get_key(record)
+
+        # a later record for the same example replaces the previous one
+        held = self.held[key]
+        held.pop(record["jsonl_file"], None)
+        held[record["jsonl_file"]] = record
+        self.by_file[record["jsonl_file"]].add(key)
+
+        self.set_record(key, record)
+
+    def set_record(self, key, record):
+        dataset, split, setup_id, example_idx = key
+        self.records[key] = record
+        self.by_example[(dataset, split, example_idx)][setup_id] = record
+        self.by_setup[(dataset, split, setup_id)][example_idx] = record
+        self._frame = None
+        self.version += 1
+
+    def remove_key(self, key):
+        record = self.records.pop(key, None)
+
+        if record is None:
+            return
+
+        dataset, split, setup_id, example_idx = key
+
+        for index, index_key, record_key in [
+            (self.by_example, (dataset, split, example_idx), setup_id),
+            (self.by_setup, (dataset, split, setup_id), example_idx),
+        ]:
+            index[index_key].pop(record_key, None)
+
+            if not index[index_key]:
+                del index[index_key]
+
+        self._frame = None
+        self.version += 1
+
+    def remove_file(self, file_path):
+        for key in self.by_file.pop(file_path, set()):
+            held = self.held[key]
+            record = held.pop(file_path, None)
+
+            if not held:
+                del self.held[key]
+                self.remove_key(key)
+            elif record is self.records.get(key):
+                # the record from the file added last before this one
+                self.set_record(key, next(reversed(held.values())))
+
+    def get(self, dataset, split, setup_id, example_idx):
+        record = self.records.get((dataset, split, setup_id, example_idx))
+
+        # copies, so that the callers can add fields to the records
+        return dict(record) if record is not None else None
+
+    def get_for_example(self, dataset, split, example_idx):
+        return [dict(record) for record in self.by_example.get((dataset, split, example_idx), {}).values()]
+
+    def get_example_ids(self, dataset, split, setup_id):
+        return list(self.by_setup.get((dataset, split, setup_id), {}).keys())
+
+    def iter_records(self):
+        """All the records held by the files, including the ones replaced by a record from another file."""
+        return (record for held in self.held.values() for record in held.values())
+
+    def to_frame(self):
+        if self._frame is None:
+            self._frame = pd.DataFrame.from_records(list(self.records.values()), columns=self.record_cols)
+
+        return self._frame
+
+
+class AnnotationIndex:
+    """
+    Annotation records (one per annotated example) keyed by (dataset, split, example_idx, setup_id).
+
+    Secondary indexes:
+        - by campaign: campaign_id -> list of records
+        - by file: jsonl_file -> list of records
+    """
+
+    def __init__(self, cols):
+        self.cols = cols
+        self.by_example = defaultdict(list)
+        self.by_campaign = defaultdict(list)
+        self.by_file = defaultdict(list)
+        self._frame = None
+        # incremented on every change
+        self.version = 0
+
+    def __len__(self):
+        return sum(len(records) for records in self.by_file.values())
+
+    @staticmethod
+    def get_key(record):
+        return (record["dataset"], record["split"], record["example_idx"], record["setup_id"])
+
+    @staticmethod
+    def get_campaign_key(record):
+        return record["campaign_id"]
+
+    def add(self, record):
+        self.by_example[self.get_key(record)].append(record)
+        self.by_campaign[self.get_campaign_key(record)].append(record)
+        self.by_file[record["jsonl_file"]].append(record)
+        self._frame = None
+        self.version += 1
+
+    def remove_file(self, file_path):
+        records = self.by_file.pop(file_path, [])
+
+        for index, get_key in [(self.by_example, self.get_key), (self.by_campaign, self.get_campaign_key)]:
+            for key in {get_key(record) for record in records}:
+                index[key] = [record for record in index[key] if record["jsonl_file"] != file_path]
+
+                if not index[key]:
+                    del index[key]
+
+        if records:
+            self._frame = None
+            self.version += 1
+
+    def get(self, dataset, split, example_idx, setup_id):
+        return [dict(record) for record in self.by_example.get((dataset, split, example_idx, setup_id), [])]
+
+    def get_campaign_frame(self, campaign_id):
+        return pd.DataFrame.from_records(self.by_campaign.get(campaign_id, []), columns=self.cols)
+
+    def iter_records(self):
+        return (record for records in self.by_file.values() for record in records)
+
+    def to_frame(self):
+        if self._frame is None:
+            self._frame = pd.DataFrame.from_records(list(self.iter_records()), columns=self.cols)
+
+        return self._frame
+
+
+def get_file_state(file_path):
+    stat = os.stat(file_path)
+
+    return {"mtime": stat.st_mtime, "size": stat.st_size, "inode": stat.st_ino}
+
+
+def get_fingerprint(f, offset):
+    start = max(0, offset - FINGERPRINT_SIZE)
+    f.seek(start)
+
+    return f.read(offset - start)
+
+
+def get_parse_offset(file_path, state, cached):
+    """Offset from which the file has to be parsed: the end of the previously parsed part, or 0 to parse it again."""
+    if cached is None or cached["inode"] != state["inode"] or state["size"] < cached["offset"]:
+        return 0
+
+    with open(file_path, "rb") as f:
+        if get_fingerprint(f, cached["offset"]) != cached["fingerprint"]:
+            return 0
+
+    return cached["offset"]
+
+
+def read_lines(file_path, offset):
+    """Read the complete lines from `offset`, return the lines and the parse state of the file."""
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+        # the last line may still be being written, it is left for the next refresh
+        end = offset + data.rfind(b"\n") + 1
+        fingerprint = get_fingerprint(f, end)
+
+    lines = data[: end - offset].decode("utf-8").splitlines()
+
+    return lines, {"offset": end, "fingerprint": fingerprint}
+
+
+def refresh_index(index, current_files, cached_files, parse_lines, load_file=None):
+    """
+    Update the index with the changes in the JSONL files.
+
+    Args:
+        index: OutputIndex or AnnotationIndex
+        current_files: dictionary of the current files and their states (`get_file_state()`)
+        cached_files: the file cache returned from the previous call
+        parse_lines: function parsing the lines of a file into the index records, called as
+            `parse_lines(file_path, lines, first_line_num)`
+        load_file: function loading the records from the files which are not JSONL (e.g. Parquet), called as
+            `load_file(file_path)`; these files are always loaded as a whole
+
+    Returns:
+        the new file cache
+    """
+    new_cache = {}
+
+    for file_path, state in current_files.items():
+        cached = cached_files.get(file_path)
+
+        if cached is not None and all(cached[key] == state[key] for key in ["mtime", "size", "inode"]):
+            new_cache[file_path] = cached
+            continue
+
+        if load_file is not None and not file_path.endswith(".jsonl"):
+            index.remove_file(file_path)
+            records = load_file(file_path)
+
+            for record in records:
+                index.add(record)
+
+            new_cache[file_path] = {**state, "offset": state["size"], "fingerprint": b"", "line_num": len(records)}
+            continue
+
+        offset = get_parse_offset(file_path, state, cached)
+
+        if offset == 0:
+            index.remove_file(file_path)
+            line_num = 0
+        else:
+            line_num = cached["line_num"]
+
+        lines, parse_state = read_lines(file_path, offset)
+
+        for record in parse_lines(file_path, lines, line_num):
+            index.add(record)
+
+        new_cache[file_path] = {**state, **parse_state, "line_num": line_num + len(lines)}
+
+    for file_path in set(cached_files.keys()) - set(current_files.keys()):
+        index.remove_file(file_path)
+
+    return new_cache
+
+
+class IndexSnapshot:
+    """Parquet snapshot of an index and the manifest of the indexed files (the file cache from `refresh_index()`)."""
+
+    def __init__(self, name, snapshot_dir=None):
+        self.name = name
+        self.dir = Path(snapshot_dir or SNAPSHOT_DIR)
+        self.manifest_path = self.dir / f"{name}.json"
+        self.saved_version = None
+        self.saved_time = 0
+
+    def get_columns(self, index):
+        return list(dict.fromkeys(index.cols + ["jsonl_file"]))
+
+    def load(self, index):
+        """Fill the empty index from the snapshot, return the file cache (empty if there is no usable snapshot)."""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+
+            if manifest["version"] != SNAPSHOT_VERSION or manifest["columns"] != self.get_columns(index):
+                return {}
+
+            records = pd.read_parquet(self.dir / manifest["records"])
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Cannot load the snapshot of the {self.name}: {e.__class__.__name__}: {e}")
+            return {}
+
+        columns = list(records.columns)
+        values = [
+            [json.loads(v) for v in records[col]] if col in manifest["json_columns"] else records[col].tolist()
+            for col in columns
+        ]
+
+        for record_values in zip(*values):
+            index.add(dict(zip(columns, record_values)))
+
+        # the changes found by the first refresh after the load get saved right away
+        self.saved_version = index.version
+
+        logger.debug(f"Loaded {len(records)} records of the {self.name} from the snapshot")
+
+        return {
+            file_path: {**state, "fingerprint": bytes.fromhex(state["fingerprint"])}
+            for file_path, state in manifest["files"].items()
+        }
+
+    def save(self, index, file_cache, force=False):
+        if index.version == self.saved_version:
+            return
+
+        if not force and time.time() - self.saved_time < SNAPSHOT_INTERVAL:
+            return
+
+        columns = self.get_columns(index)
+        records = pd.DataFrame.from_records(list(index.iter_records()), columns=columns)
+        json_columns = []
+
+        # plain string and integer columns are stored as they are, the rest (nested or mixed values) as JSON
+        for col in columns:
+            values = records[col].tolist()
+
+            if all(isinstance(v, str) for v in values) or all(type(v) is int for v in values):
+                continue
+
+            records[col] = [json.dumps(v) for v in values]
+            json_columns.append(col)
+
+        os.makedirs(self.dir, exist_ok=True)
+        records_name = f"{self.name}-{uuid.uuid4().hex}.parquet"
+        records.to_parquet(self.dir / records_name, index=False)
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "columns": columns,
+            "json_columns": json_columns,
+            "records": records_name,
+            "files": {
+                file_path: {**state, "fingerprint": state["fingerprint"].hex()}
+                for file_path, state in file_cache.items()
+            },
+        }
+
+        tmp_path = self.dir / f".{records_name}.json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+        self.remove_old_records(records_name)
+
+        self.saved_version = index.version
+        self.saved_time = time.time()
+
+    def remove_old_records(self, records_name):
+        """
+        Remove the records of the snapshots saved before this one.
+
+        The snapshot directory is shared by all the factgenie processes, so the records written after this snapshot
+        (the manifest can already point to them) and the records in the current manifest are kept.
+        """
+        try:
+            saved_mtime = (self.dir / records_name).stat().st_mtime
+
+            with open(self.manifest_path) as f:
+                current_records = json.load(f)["records"]
+        except Exception as e:
+            logger.warning(f"Cannot remove the old snapshots of the {self.name}: {e.__class__.__name__}: {e}")
+            return
+
+        for path in self.dir.glob(f"{self.name}-*.parquet"):
+            if path.name in (records_name, current_records):
+                continue
+
+            try:
+                if path.stat().st_mtime < saved_mtime:
+                    path.unlink()
+            except FileNotFoundError:
+                # removed by another process
+                pass
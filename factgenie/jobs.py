@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# File-based job queue for running LLM campaigns in worker processes (`factgenie worker`).
+#
+# The queue lives in JOBS_DIR, which only has to be shared between the web process and the workers together with
+# CAMPAIGN_DIR (e.g. on a network filesystem):
+#   - queued/<job_id>.json   jobs waiting for a worker, claimed by an atomic rename to running/
+#   - running/<job_id>.json  jobs being executed, touched regularly by the worker as a heartbeat
+# Progress events are appended by the worker to `progress.jsonl` in the campaign directory and relayed to the SSE
+# announcer by the web process. The campaign is paused by creating a `pause` flag file in the campaign directory.
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from factgenie import CAMPAIGN_DIR, JOBS_DIR
+
+logger = logging.getLogger("factgenie")
+
+QUEUED_DIR = JOBS_DIR / "queued"
+RUNNING_DIR = JOBS_DIR / "running"
+
+# a running job without a heartbeat for this long is considered abandoned and put back into the queue
+HEARTBEAT_INTERVAL = 10
+STALE_JOB_TIMEOUT = 120
+
+
+def get_progress_path(campaign_id):
+    return CAMPAIGN_DIR / campaign_id / "progress.jsonl"
+
+
+def get_pause_path(campaign_id):
+    return CAMPAIGN_DIR / campaign_id / "pause"
+
+
+def list_jobs(job_dir):
+    if not job_dir.exists():
+        return []
+
+    jobs = []
+    for path in job_dir.glob("*.json"):
+        try:
+            with open(path) as f:
+                jobs.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            # claimed or finished in the meantime
+            continue
+
+    return sorted(jobs, key=lambda job: job["created"])
+
+
+def get_campaign_job(campaign_id):
+    for job_dir in [RUNNING_DIR, QUEUED_DIR]:
+        for job in list_jobs(job_dir):
+            if job["campaign_id"] == campaign_id:
+                return job
+
+    return None
+
+
+def is_campaign_active(campaign_id):
+    """Whether the campaign is queued or being executed by a worker."""
+    return get_campaign_job(campaign_id) is not None
+
+
+def enqueue_campaign(campaign_id, mode):
+    job = get_campaign_job(campaign_id)
+
+    if job is not None:
+        # the campaign was paused but the worker has not stopped yet: let it continue instead of stopping
+        get_pause_path(campaign_id).unlink(missing_ok=True)
+        return job
+
+    os.makedirs(QUEUED_DIR, exist_ok=True)
+
+    job = {"id": uuid.uuid4().hex, "campaign_id": campaign_id, "mode": mode, "created": time.time()}
+
+    get_pause_path(campaign_id).unlink(missing_ok=True)
+
+    # start with a fresh progress channel for the new run
+    with open(get_progress_path(campaign_id), "w"):
+        pass
+
+    # write under a temporary name so that the workers never see an incomplete file
+    tmp_path = QUEUED_DIR / f".{job['id']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, QUEUED_DIR / f"{job['id']}.json")
+
+    logger.info(f"Campaign {campaign_id} queued as job {job['id']}")
+
+    return job
+
+
+def pause_campaign(campaign_id):
+    # remove the job if no worker claimed it yet, otherwise let the worker stop at the next example
+    for job in list_jobs(QUEUED_DIR):
+        if job["campaign_id"] == campaign_id:
+            (QUEUED_DIR / f"{job['id']}.json").unlink(missing_ok=True)
+
+    if (CAMPAIGN_DIR / campaign_id).exists():
+        get_pause_path(campaign_id).touch()
+
+
+def claim_job(worker_id):
+    """Move the oldest queued job to running/, return None if the queue is empty."""
+    os.makedirs(RUNNING_DIR, exist_ok=True)
+
+    for job in list_jobs(QUEUED_DIR):
+        running_path = RUNNING_DIR / f"{job['id']}.json"
+        try:
+            # only one of the workers succeeds in renaming the file
+            os.rename(QUEUED_DIR / f"{job['id']}.json", running_path)
+        except FileNotFoundError:
+            continue
+
+        job["worker"] = worker_id
+        job["started"] = time.time()
+
+        with open(running_path, "w") as f:
+            json.dump(job, f)
+
+        return job
+
+    return None
+
+
+def finish_job(job):
+    (RUNNING_DIR / f"{job['id']}.json").unlink(missing_ok=True)
+
+
+def requeue_stale_jobs(timeout=STALE_JOB_TIMEOUT):
+    if not RUNNING_DIR.exists():
+        return
+
+    os.makedirs(QUEUED_DIR, exist_ok=True)
+
+    for path in RUNNING_DIR.glob("*.json"):
+        try:
+            if time.time() - path.stat().st_mtime > timeout:
+                os.rename(path, QUEUED_DIR / path.name)
+                logger.warning(f"Job {path.stem} has no heartbeat, putting it back into the queue.")
+        except FileNotFoundError:
+            continue
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Heartbeat:
+    """Touches the job file in a background thread while the job is being executed."""
+
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        self.path = RUNNING_DIR / f"{job['id']}.json"
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+
+
+class FileAnnouncer:
+    """Announcer used by the workers: the SSE messages are appended to the progress channel of the campaign."""
+
+    def __init__(self, campaign_id):
+        self.path = get_progress_path(campaign_id)
+
+    def announce(self, msg):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(msg) + "\n")
+
+
+class RunningCampaigns:
+    """
+    Replacement for `app.db["running_campaigns"]` in the workers.
+
+    A campaign is running until the `pause` flag file appears in its directory, so that the campaign can be paused
+    from the web process.
+    """
+
+    def __init__(self):
+        self.campaigns = set()
+
+    def add(self, campaign_id):
+        self.campaigns.add(campaign_id)
+
+    def remove(self, campaign_id):
+        self.campaigns.discard(campaign_id)
+
+    def __contains__(self, campaign_id):
+        return campaign_id in self.campaigns and not get_pause_path(campaign_id).exists()
+
+
+def relay_progress(campaign_id, announcer, offset=0, poll_interval=0.5):
+    """Forward the messages from the progress channel of the campaign to the SSE announcer until the job ends."""
+    path = get_progress_path(campaign_id)
+
+    while True:
+        # check before reading so that the messages written just before the job ended are not lost
+        active = is_campaign_active(campaign_id)
+
+        if path.exists():
+            with open(path) as f:
+                f.seek(offset)
+                while (line := f.readline()).endswith("\n"):
+                    announcer.announce(msg=json.loads(line))
+                    offset = f.tell()
+
+        if not active:
+            return
+
+        time.sleep(poll_interval)
+
+
+def start_relay(campaign_id, announcer, from_start=True):
+    path = get_progress_path(campaign_id)
+    offset = 0 if from_start or not path.exists() else path.stat().st_size
+
+    thread = threading.Thread(target=relay_progress, args=(campaign_id, announcer, offset), daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# Batch mode for LLM campaigns: the prompts for all the free examples are submitted at once to the provider's batch API
+# (https://platform.openai.com/docs/guides/batch), the results are collected once the batch job is completed.
+# Enabled with `batch_mode: True` in the `extra_args` of the campaign config.
+import json
+import logging
+import os
+import time
+import traceback
+
+import litellm
+from flask import jsonify
+from litellm.utils import type_to_response_format_param
+
+import factgenie.llm_campaign as llm_campaign
+import factgenie.utils as utils
+import factgenie.workflows as workflows
+from factgenie.campaign import CampaignMode, CampaignStatus, ExampleStatus
+
+logger = logging.getLogger("factgenie")
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# model types from the campaign config and the corresponding LiteLLM providers with a batch API
+BATCH_PROVIDERS = {
+    "openai": "openai",
+    "vllm": "hosted_vllm",
+}
+
+BATCH_FINISHED_STATES = {"completed"}
+BATCH_FAILED_STATES = {"failed", "expired", "cancelled"}
+
+# request arguments which are not a part of the request body
+NON_BODY_ARGS = {"api_base", "vertex_credentials"}
+
+
+def get_batch_provider(config):
+    model_type = config["type"].removesuffix("_metric").removesuffix("_gen")
+
+    if model_type not in BATCH_PROVIDERS:
+        raise ValueError(
+            f"Batch mode is not supported for the model type `{model_type}`. Supported: {list(BATCH_PROVIDERS)}"
+        )
+
+    return BATCH_PROVIDERS[model_type]
+
+
+def get_batch_api_args(model):
+    # `batch_api_url` in `extra_args` overrides the model API URL (e.g. for an OpenAI-compatible proxy)
+    return {
+        "custom_llm_provider": get_batch_provider(model.config),
+        "api_base": utils.get_run_option(model.config, "batch_api_url") or model._api_url(),
+    }
+
+
+def get_request_body(mode, model, example, generated_output):
+    """Render the prompt for the example and return the request body in the OpenAI chat completion format."""
+    if mode == CampaignMode.LLM_EVAL:
+        model_service, prompt = model.prepare_request(example, generated_output["output"])
+        completion_args = model.get_completion_args(prompt, model_service)
+    else:
+        model_service, prompt, messages = model.prepare_request(example)
+        completion_args = model.get_completion_args(messages, model_service)
+
+    body = {key: value for key, value in completion_args.items() if key not in NON_BODY_ARGS and value is not None}
+    # the batch API expects the model name without the LiteLLM provider prefix
+    body["model"] = model.config["model"]
+
+    if "response_format" in body:
+        body["response_format"] = type_to_response_format_param(body["response_format"])
+
+    return prompt, body
+
+
+def write_batch_input(app, mode, campaign, datasets, model, path):
+    """Write a batch request for each free example to a JSONL file, return the number of requests."""
+    db = campaign.db
+    free_idxs = db[db.status == ExampleStatus.FREE].index.tolist()
+
+    with open(path, "w") as f:
+        for i in free_idxs:
+            example, generated_output = llm_campaign.get_example_inputs(app, mode, datasets, db.loc[i])
+            _, body = get_request_body(mode, model, example, generated_output)
+
+            f.write(json.dumps({"custom_id": str(i), "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n")
+
+    return len(free_idxs)
+
+
+def submit_batch(app, mode, campaign, datasets, model):
+    input_path = os.path.join(campaign.dir, "batch_input.jsonl")
+    request_cnt = write_batch_input(app, mode, campaign, datasets, model, input_path)
+
+    if request_cnt == 0:
+        return None
+
+    api_args = get_batch_api_args(model)
+
+    with open(input_path, "rb") as f:
+        input_file = litellm.create_file(file=f, purpose="batch", **api_args)
+
+    batch = litellm.create_batch(
+        completion_window="24h", endpoint=BATCH_ENDPOINT, input_file_id=input_file.id, **api_args
+    )
+    logger.info(f"Submitted batch {batch.id} with {request_cnt} requests.")
+
+    return {"id": batch.id, "input_file_id": input_file.id, "requests": request_cnt, "submitted": int(time.time())}
+
+
+def get_batch_results(batch, api_args):
+    """The results of the batch requests: the successful ones are in the output file, the failed ones in the error file."""
+    results = []
+
+    # there is no output file if all the requests failed and no error file if none of them did
+    for file_id in [batch.output_file_id, batch.error_file_id]:
+        if file_id is None:
+            continue
+
+        content = litellm.file_content(file_id=file_id, **api_args)
+        results += [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    return results
+
+
+def ingest_batch_results(app, mode, campaign_id, announcer, campaign, datasets, model, batch):
+    api_args = get_batch_api_args(model)
+    db = campaign.db
+    failed = []
+
+    for result in get_batch_results(batch, api_args):
+        i = int(result["custom_id"])
+        dataset_id, split, example_idx = db.loc[i, "dataset"], db.loc[i, "split"], db.loc[i, "example_idx"]
+
+        if db.loc[i, "status"] == ExampleStatus.FINISHED:
+            # ingested by a previous run which failed partway through the batch
+            continue
+
+        try:
+            if result.get("error") or result["response"]["status_code"] != 200:
+                raise ValueError(result.get("error") or result["response"]["body"])
+
+            response = litellm.ModelResponse(**result["response"]["body"])
+            example, generated_output = llm_campaign.get_example_inputs(app, mode, datasets, db.loc[i])
+            prompt, _ = get_request_body(mode, model, example, generated_output)
+
+            start = time.time()
+
+            if mode == CampaignMode.LLM_EVAL:
+                res = model.process_response(generated_output["output"], prompt, response)
+                res["output"] = generated_output["output"]
+            else:
+                res = model.process_response(prompt, response)
+
+            # no per-request latency in the batch mode
+            res["metrics"] = model.get_call_metrics(response, parse_time=time.time() - start)
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Error processing example {dataset_id}-{split}-{example_idx}: {e.__class__.__name__}: {e}")
+            failed.append(i)
+            continue
+
+        record = workflows.save_record(mode=mode, campaign=campaign, row=db.loc[i], result=res, app=app)
+
+        # only after the record is saved: a row marked as finished is skipped if the batch is ingested again
+        db.loc[i, "end"] = float(time.time())
+        db.loc[i, "status"] = ExampleStatus.FINISHED
+        campaign.update_db_rows([i], db=db)
+
+        campaign.add_call_metrics(record)
+
+        stats = campaign.get_stats()
+        utils.announce(announcer, {"campaign_id": campaign_id, "stats": stats, "type": "result", "response": record})
+
+    if failed:
+        # the failed examples are free again and will be a part of the next batch
+        db.loc[failed, "annotator_id"] = ""
+        db.loc[failed, "start"] = None
+        campaign.update_db_rows(failed, db=db)
+
+        message = f"{len(failed)} requests from batch {batch.id} failed, run the campaign again to retry them."
+        logger.warning(message)
+        utils.announce(announcer, {"campaign_id": campaign_id, "type": "status", "message": message})
+
+
+def run_llm_batch_campaign(app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns):
+    """
+    Counterpart of `run_llm_campaign()` using the batch API of the provider.
+
+    The id of the submitted batch is kept in the campaign metadata: pausing the campaign only stops the polling and
+    running the campaign again resumes waiting for the same batch.
+    """
+    config = campaign.metadata["config"]
+    poll_interval = float(utils.get_run_option(config, "batch_poll_interval", 60))
+    api_args = get_batch_api_args(model)
+
+    campaign.metadata["status"] = CampaignStatus.RUNNING
+    campaign.metadata["last_run"] = int(time.time())
+    campaign.update_metadata()
+
+    if mode == CampaignMode.LLM_EVAL:
+        workflows.get_output_index(app, force_reload=True)
+
+    try:
+        if not campaign.metadata.get("batch"):
+            db = campaign.db
+            free_idxs = db[db.status == ExampleStatus.FREE].index
+            db.loc[free_idxs, "annotator_id"] = config["model"] + "-" + campaign_id
+            db.loc[free_idxs, "start"] = float(time.time())
+            campaign.update_db_rows(free_idxs.tolist(), db=db)
+
+            campaign.metadata["batch"] = submit_batch(app, mode, campaign, datasets, model)
+            campaign.update_metadata()
+
+        batch_info = campaign.metadata["batch"]
+
+        # `None` if there were no free examples to submit
+        while batch_info:
+            if campaign_id not in running_campaigns:
+                # paused while waiting for the batch
+                return jsonify(success=True, status=CampaignStatus.IDLE)
+
+            batch = litellm.retrieve_batch(batch_id=batch_info["id"], **api_args)
+            counts = batch.request_counts
+            message = f"Batch {batch.id}: {batch.status}" + (
+                f" ({counts.completed}/{counts.total} requests)" if counts else ""
+            )
+            logger.info(message)
+            utils.announce(announcer, {"campaign_id": campaign_id, "type": "status", "message": message})
+
+            if batch.status in BATCH_FINISHED_STATES:
+                ingest_batch_results(app, mode, campaign_id, announcer, campaign, datasets, model, batch)
+                break
+
+            if batch.status in BATCH_FAILED_STATES:
+                campaign.metadata.pop("batch")
+                campaign.update_metadata()
+                return utils.error(f"Batch {batch.id} ended with the status `{batch.status}`: {batch.errors}")
+
+            # in short steps, so that a pause is noticed right away
+            poll_end = time.time() + poll_interval
+            while campaign_id in running_campaigns and time.time() < poll_end:
+                time.sleep(min(max(poll_end - time.time(), 0), 1.0))
+
+        campaign.metadata.pop("batch", None)
+        campaign.update_metadata()
+    except Exception as e:
+        traceback.print_exc()
+        return utils.error(f"Error while running the batch: {e.__class__.__name__}: {str(e)}")
+    finally:
+        campaign.flush_db()
+
+    llm_campaign.finalize_llm_campaign(campaign, campaign_id, running_campaigns)
+
+    return jsonify(success=True, status=campaign.metadata["status"])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Persistent cache of LLM responses.
+# The responses are stored in an SQLite database keyed by a hash of the request (model, messages, model arguments,
+# response format), so that re-running or duplicating a campaign does not send the same prompts again.
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from factgenie import CACHE_DIR
+from factgenie.sqlite_lru import SQLiteLRU
+
+logger = logging.getLogger("factgenie")
+
+LLM_CACHE_PATH = CACHE_DIR / "llm_responses.sqlite"
+
+# request arguments which do not influence the response (or which should never be stored)
+IGNORED_ARGS = {"vertex_credentials", "api_key"}
+
+
+class LLMResponseCache:
+    def __init__(self, path, max_entries=100000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.store = SQLiteLRU(
+            path,
+            table="responses",
+            key_columns=[("key", "TEXT")],
+            value_columns=[("response", "TEXT"), ("created", "REAL")],
+            max_entries=max_entries,
+        )
+
+    @property
+    def entry_count(self):
+        return self.store.entry_count
+
+    @staticmethod
+    def make_key(completion_args):
+        """Hash of the request arguments: model service, messages (system message + prompt), model args, response format."""
+        key_args = {}
+
+        for arg, value in completion_args.items():
+            if arg in IGNORED_ARGS:
+                continue
+
+            # pydantic classes used as `response_format`
+            if hasattr(value, "model_json_schema"):
+                value = value.model_json_schema()
+
+            key_args[arg] = value
+
+        serialized = json.dumps(key_args, sort_keys=True, default=str)
+
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def get(self, key):
+        row = self.store.get((key,))
+
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key, response):
+        self.store.put((key,), (json.dumps(response, default=str), time.time()))
+
+    def clear(self):
+        self.store.clear()
+
+
+# the cache is shared by all the models in the process
+cache_config = {"enabled": True, "max_entries": 100000}
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def configure(config):
+    """Set up the cache from the `llm_cache` section of the app config."""
+    global _cache
+
+    cache_config.update(config or {})
+    _cache = None
+
+
+def get_cache():
+    global _cache
+
+    if not cache_config.get("enabled", True):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache(LLM_CACHE_PATH, max_entries=int(cache_config.get("max_entries", 100000)))
+
+    return _cache
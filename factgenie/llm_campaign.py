@@ -7,19 +7,30 @@ import time
 import json
 import os
 import ast
+import asyncio
+import heapq
 import logging
+import multiprocessing
+import queue
+import threading
 import traceback
 import requests
 import urllib3
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from slugify import slugify
 
-from factgenie.campaign import CampaignMode, CampaignStatus, ExampleStatus
+from factgenie.campaign import CampaignDBBackend, CampaignMode, CampaignStatus, ExampleStatus, save_campaign_db
 from flask import jsonify
+import litellm
+import factgenie.jobs as jobs
+import factgenie.output_store as output_store
+import factgenie.rate_limit as rate_limit
 import factgenie.utils as utils
 import factgenie.workflows as workflows
 
 from factgenie import CAMPAIGN_DIR, OUTPUT_DIR, TEMPLATES_DIR
+from factgenie.models import ModelFactory
 
 logger = logging.getLogger("factgenie")
 
@@ -39,9 +50,9 @@ def create_llm_campaign(app, mode, campaign_id, config, campaign_data, datasets,
 
         # create the annotation CSV
         db = generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data)
-        db_path = os.path.join(CAMPAIGN_DIR, campaign_id, "db.csv")
-        logger.info(f"DB with {len(db)} free examples created for {campaign_id} at {db_path}")
-        db.to_csv(db_path, index=False)
+        db_backend = app.config.get("campaign_db", CampaignDBBackend.CSV)
+        logger.info(f"DB with {len(db)} free examples created for {campaign_id} ({db_backend})")
+        save_campaign_db(os.path.join(CAMPAIGN_DIR, campaign_id), db, backend=db_backend)
 
         # save metadata
         metadata_path = os.path.join(CAMPAIGN_DIR, campaign_id, "metadata.json")
@@ -58,6 +69,8 @@ def create_llm_campaign(app, mode, campaign_id, config, campaign_data, datasets,
                 f,
                 indent=4,
             )
+
+        workflows.mark_changed(os.path.join(CAMPAIGN_DIR, campaign_id), is_directory=True)
     except Exception as e:
         # cleanup
         shutil.rmtree(os.path.join(CAMPAIGN_DIR, campaign_id))
@@ -74,11 +87,26 @@ def duplicate_llm_campaign(app, mode, campaign_id, new_campaign_id):
     if os.path.exists(new_campaign_dir):
         return utils.error("Campaign already exists")
 
-    shutil.copytree(old_campaign_dir, new_campaign_dir, ignore=shutil.ignore_patterns("files"))
+    shutil.copytree(
+        old_campaign_dir,
+        new_campaign_dir,
+        # the outputs and the state of the runs of the original campaign
+        ignore=shutil.ignore_patterns(
+            "files",
+            "db.csv",
+            "db.csv.bak",
+            "db_journal*.jsonl",
+            "db.sqlite*",
+            "batch_input.jsonl",
+            "stats.json",
+            "progress.jsonl",
+            "pause",
+        ),
+    )
 
     # copy the db
-    old_db = pd.read_csv(os.path.join(old_campaign_dir, "db.csv"))
-    new_db = old_db.copy()
+    old_campaign = workflows.load_campaign(app, campaign_id=campaign_id)
+    new_db = old_campaign.db.copy()
     new_db["status"] = ExampleStatus.FREE
 
     # clean the columns
@@ -86,7 +114,7 @@ def duplicate_llm_campaign(app, mode, campaign_id, new_campaign_id):
     new_db["start"] = None
     new_db["end"] = None
 
-    new_db.to_csv(os.path.join(new_campaign_dir, "db.csv"), index=False)
+    save_campaign_db(new_campaign_dir, new_db, backend=old_campaign.get_db_backend())
 
     # update the metadata
     metadata_path = os.path.join(new_campaign_dir, "metadata.json")
@@ -97,9 +125,15 @@ def duplicate_llm_campaign(app, mode, campaign_id, new_campaign_id):
     metadata["created"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     metadata["status"] = CampaignStatus.IDLE
 
+    # the state of the runs of the original campaign (including its provider batch, which must not be polled again)
+    for key in ["batch", "last_run", "cache_stats"]:
+        metadata.pop(key, None)
+
     with open(metadata_path, "w") as f:
         json.dump(metadata, f, indent=4)
 
+    workflows.mark_changed(new_campaign_dir, is_directory=True)
+
     return utils.success()
 
 
@@ -140,7 +174,114 @@ def generate_llm_campaign_db(app, mode, datasets, campaign_id, campaign_data):
     return df
 
 
+def get_example_inputs(app, mode, datasets, row):
+    dataset_id = row["dataset"]
+    split = row["split"]
+    example_idx = row["example_idx"]
+
+    example = datasets[dataset_id].get_example(split, example_idx)
+    generated_output = None
+
+    if mode == CampaignMode.LLM_EVAL:
+        generated_output = workflows.get_output_for_setup(
+            dataset_id, split, example_idx, row.get("setup_id"), app=app, force_reload=False
+        )
+
+    return example, generated_output
+
+
+def generate_result(mode, model, example, generated_output, submitted=None):
+    # runs in a worker thread: only the model call itself, everything touching the db stays in the main thread
+    started = time.time()
+
+    if mode == CampaignMode.LLM_EVAL:
+        res = model.annotate_example(data=example, text=generated_output["output"])
+        res["output"] = generated_output["output"]
+    elif mode == CampaignMode.LLM_GEN:
+        res = model.generate_output(data=example)
+
+    if submitted is not None:
+        # time spent waiting for a free worker thread
+        res.setdefault("metrics", {})["queue_wait"] = started - submitted
+
+    return res
+
+
+async def agenerate_result(mode, model, example, generated_output, submitted=None):
+    # asynchronous variant of `generate_result()`, runs on the event loop of `AsyncExecutor`
+    started = time.time()
+
+    if mode == CampaignMode.LLM_EVAL:
+        res = await model.aannotate_example(data=example, text=generated_output["output"])
+        res["output"] = generated_output["output"]
+    elif mode == CampaignMode.LLM_GEN:
+        res = await model.agenerate_output(data=example)
+
+    if submitted is not None:
+        res.setdefault("metrics", {})["queue_wait"] = started - submitted
+
+    return res
+
+
+# the event loop of the asynchronous requests, shared by all the runs in the process so that the async clients cached
+# by litellm stay bound to a running loop
+_async_loop = None
+_async_loop_lock = threading.Lock()
+
+
+def get_async_loop():
+    global _async_loop
+
+    with _async_loop_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, daemon=True).start()
+
+    return _async_loop
+
+
+class AsyncExecutor:
+    """Runs the coroutines on a single event loop, the returned futures are handled like the ones of a thread pool."""
+
+    def __init__(self):
+        self.loop = get_async_loop()
+        self.futures = set()
+
+    def submit(self, fn, *args):
+        future = asyncio.run_coroutine_threadsafe(fn(*args), self.loop)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+
+        return future
+
+    def shutdown(self, wait=False, cancel_futures=False):
+        # the loop keeps running for the other runs, the remaining coroutines are either cancelled or left to finish
+        if cancel_futures:
+            for future in list(self.futures):
+                future.cancel()
+
+
+def get_run_options(config):
+    return {
+        # number of requests kept in flight at the same time (in each shard)
+        "max_concurrency": max(int(utils.get_run_option(config, "max_concurrency", 1)), 1),
+        # number of processes the free examples are split between
+        "num_shards": max(int(utils.get_run_option(config, "num_shards", 1)), 1),
+        # examples failing with a transient error (429, 5xx, connection errors) are retried with exponential backoff
+        "max_retries": int(utils.get_run_option(config, "max_retries", 5)),
+        "retry_delay": float(utils.get_run_option(config, "retry_delay", 1.0)),
+        "max_retry_delay": float(utils.get_run_option(config, "max_retry_delay", 60.0)),
+        # the requests are sent with `litellm.acompletion` from a single event loop instead of a thread for each request
+        "async_requests": bool(utils.get_run_option(config, "async_requests", False)),
+    }
+
+
 def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns):
+    if utils.get_run_option(campaign.metadata["config"], "batch_mode", False):
+        from factgenie.llm_batch import run_llm_batch_campaign
+
+        return run_llm_batch_campaign(app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns)
+
     db = campaign.db
 
     # set campaign status to running
@@ -149,6 +290,7 @@ def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, mode
     campaign.update_metadata()
 
     provider = campaign.metadata["config"].get("type", None)
+    options = get_run_options(campaign.metadata["config"])
 
     logger.info(f"Starting LLM campaign \033[1m{campaign_id}\033[0m | {provider}")
 
@@ -157,6 +299,10 @@ def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, mode
     logger.info(f"\033[1mAPI URL\033[0m: {campaign.metadata['config'].get('api_url')}")
     logger.info(f"\033[1mModel args\033[0m: {campaign.metadata['config'].get('model_args')}")
     logger.info(f"\033[1mSystem message\033[0m: \"{campaign.metadata['config'].get('system_msg')}\"")
+    logger.info(f"\033[1mConcurrent requests\033[0m: {options['max_concurrency']}")
+    logger.info(f"\033[1mAsync requests\033[0m: {options['async_requests']}")
+    logger.info(f"\033[1mShards\033[0m: {options['num_shards']}")
+    logger.info(f"\033[1mMax retries\033[0m: {options['max_retries']}")
     logger.info(f"\033[1mAnnotation span categories\033[0m:")
 
     for cat in campaign.metadata["config"].get("annotation_span_categories", []):
@@ -167,66 +313,355 @@ def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, mode
     # regenerate output index
     workflows.get_output_index(app, force_reload=True)
 
-    # generate outputs / annotations for all free examples in the db
-    for i, row in db[db.status == ExampleStatus.FREE].iterrows():
-        # campaign was paused
-        if campaign_id not in running_campaigns:
-            break
+    # cache hits / misses are accumulated over all the runs of the campaign
+    cache_stats_start = dict(getattr(model, "cache_stats", {}))
+    shard_cache_stats = {}
 
-        dataset_id = row["dataset"]
-        split = row["split"]
-        example_idx = row["example_idx"]
-        example = datasets[dataset_id].get_example(split, example_idx)
-        # only for llm_eval
-        setup_id = row.get("setup_id")
+    free_idxs = db[db.status == ExampleStatus.FREE].index.tolist()
 
-        db.loc[i, "start"] = float(time.time())
-        db.loc[i, "annotator_id"] = campaign.metadata["config"]["model"] + "-" + campaign_id
+    try:
+        if options["num_shards"] > 1:
+            ret, shard_cache_stats = run_shards(
+                app, mode, campaign_id, announcer, campaign, running_campaigns, free_idxs, options["num_shards"]
+            )
+        else:
+            ret = process_examples(
+                app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns, free_idxs
+            )
+    finally:
+        # compact the status journal on pause, finish or error
+        campaign.flush_db()
 
-        # generate output or annotate example
-        try:
-            if mode == CampaignMode.LLM_EVAL:
-                generated_output = workflows.get_output_for_setup(
-                    dataset_id, split, example_idx, setup_id, app=app, force_reload=False
+        # the metadata may have been changed in the meantime (e.g. the campaign was paused)
+        campaign.load_metadata()
+        cache_stats = campaign.metadata.get("cache_stats", {})
+
+        for key, value in getattr(model, "cache_stats", {}).items():
+            cache_stats[key] = cache_stats.get(key, 0) + value - cache_stats_start.get(key, 0)
+
+        for key, value in shard_cache_stats.items():
+            cache_stats[key] = cache_stats.get(key, 0) + value
+
+        campaign.metadata["cache_stats"] = cache_stats
+        campaign.update_metadata()
+
+    # error response
+    if ret is not None:
+        return ret
+
+    finalize_llm_campaign(campaign, campaign_id, running_campaigns)
+
+    return jsonify(success=True, status=campaign.metadata["status"])
+
+
+def process_examples(app, mode, campaign_id, announcer, campaign, datasets, model, running_campaigns, db_idxs):
+    """Generate the outputs / annotations for the examples at `db_idxs`. Returns an error response or None."""
+    db = campaign.db
+    options = get_run_options(campaign.metadata["config"])
+    max_concurrency = options["max_concurrency"]
+    max_retries = options["max_retries"]
+
+    free_rows = iter(db_idxs)
+    in_flight = {}
+    # heap of (time when the example can be retried, db index)
+    retry_queue = []
+    attempts = {}
+
+    if options["async_requests"]:
+        executor, run_request = AsyncExecutor(), agenerate_result
+    else:
+        executor, run_request = ThreadPoolExecutor(max_workers=max_concurrency), generate_result
+
+    try:
+        while True:
+            # keep up to `max_concurrency` requests in flight, stop submitting new ones once the campaign is paused
+            while len(in_flight) < max_concurrency and campaign_id in running_campaigns:
+                if retry_queue and retry_queue[0][0] <= time.time():
+                    i = heapq.heappop(retry_queue)[1]
+                else:
+                    i = next(free_rows, None)
+
+                if i is None:
+                    break
+
+                row = db.loc[i]
+
+                db.loc[i, "start"] = float(time.time())
+                db.loc[i, "annotator_id"] = campaign.metadata["config"]["model"] + "-" + campaign_id
+
+                try:
+                    example, generated_output = get_example_inputs(app, mode, datasets, row)
+                except Exception as e:
+                    traceback.print_exc()
+                    return utils.error(
+                        f"Error processing example {row['dataset']}-{row['split']}-{row['example_idx']}: {e.__class__.__name__}: {str(e)}"
+                    )
+
+                future = executor.submit(run_request, mode, model, example, generated_output, time.time())
+                in_flight[future] = i
+
+            retry_timeout = max(retry_queue[0][0] - time.time(), 0) if retry_queue else None
+
+            if not in_flight:
+                if retry_timeout is None or campaign_id not in running_campaigns:
+                    break
+
+                # only examples waiting for a retry are left, check the pause flag from time to time
+                time.sleep(min(retry_timeout, 1.0))
+                continue
+
+            # results may arrive out of order, we process them as soon as they are ready
+            done, _ = wait(in_flight, timeout=retry_timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                i = in_flight.pop(future)
+                dataset_id, split, example_idx = db.loc[i, "dataset"], db.loc[i, "split"], db.loc[i, "example_idx"]
+
+                # generate output or annotate example
+                try:
+                    res = future.result()
+                except Exception as e:
+                    if not rate_limit.is_transient_error(e):
+                        traceback.print_exc()
+                        return utils.error(
+                            f"Error processing example {dataset_id}-{split}-{example_idx}: {e.__class__.__name__}: {str(e)}"
+                        )
+
+                    attempt = attempts.get(i, 0)
+
+                    if attempt >= max_retries:
+                        # keep the example free so that it is processed in the next run
+                        logger.error(
+                            f"Giving up on example {dataset_id}-{split}-{example_idx} after {attempt} retries: {e.__class__.__name__}: {str(e)}"
+                        )
+                        continue
+
+                    delay = rate_limit.get_retry_delay(
+                        attempt, base_delay=options["retry_delay"], max_delay=options["max_retry_delay"]
+                    )
+                    delay = max(delay, rate_limit.get_retry_after(e) or 0)
+                    attempts[i] = attempt + 1
+                    heapq.heappush(retry_queue, (time.time() + delay, i))
+
+                    message = f"Example {dataset_id}-{split}-{example_idx} failed with {e.__class__.__name__}, retry {attempt + 1}/{max_retries} in {delay:.1f} s."
+                    logger.warning(message)
+                    utils.announce(announcer, {"campaign_id": campaign_id, "type": "status", "message": message})
+                    continue
+
+                res.setdefault("metrics", {})["retries"] = attempts.get(i, 0)
+
+                # update the DB
+                db.loc[i, "end"] = float(time.time())
+                db.loc[i, "status"] = ExampleStatus.FINISHED
+
+                campaign.update_db_rows([i], db=db)
+
+                # save the record to a JSONL file
+                response = workflows.save_record(
+                    mode=mode,
+                    campaign=campaign,
+                    row=db.loc[i],
+                    result=res,
+                    app=app,
                 )
-                res = model.annotate_example(data=example, text=generated_output["output"])
-                res["output"] = generated_output["output"]
-            elif mode == CampaignMode.LLM_GEN:
-                res = model.generate_output(data=example)
-        except requests.exceptions.ConnectionError as e:
-            traceback.print_exc()
-            return utils.error(
-                f"Error processing example {dataset_id}-{split}-{example_idx}: {e.__class__.__name__}: {str(e)}\n"
-            )
 
-        except Exception as e:
-            traceback.print_exc()
-            return utils.error(
-                f"Error processing example {dataset_id}-{split}-{example_idx}: {e.__class__.__name__}: {str(e)}"
+                campaign.add_call_metrics(response)
+
+                # send a response to the frontend
+                stats = campaign.get_stats()
+                payload = {
+                    "campaign_id": campaign_id,
+                    "stats": stats,
+                    "type": "result",
+                    "response": response,
+                    "db_idx": int(i),
+                }
+
+                utils.announce(announcer, payload)
+                logger.info(f"-" * 50)
+                logger.info(f"{campaign_id}: {stats['finished']}/{stats['total']} examples")
+                logger.info(f"-" * 50)
+    finally:
+        # do not wait for the requests which will not be processed anyway (after an error)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return None
+
+
+class ShardAnnouncer:
+    """Passes the messages from a shard process to the main process, which aggregates the stats and announces them."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def announce(self, msg):
+        self.events.put({"type": "message", "msg": msg})
+
+
+class ShardRunningCampaigns:
+    """The campaign is running until the main process sets the `paused` event."""
+
+    def __init__(self, campaign_id, paused):
+        self.campaign_id = campaign_id
+        self.paused = paused
+
+    def remove(self, campaign_id):
+        pass
+
+    def __contains__(self, campaign_id):
+        return campaign_id == self.campaign_id and not self.paused.is_set()
+
+
+def load_shard_app(config, campaign_id, mode, db_idxs):
+    """
+    Set up the app in a (spawned) shard process: the config of the main process, the campaign and the datasets of the
+    examples at `db_idxs`.
+    """
+    import factgenie.llm_cache as llm_cache
+    from factgenie.app import app
+
+    app.config.update(config)
+    logger.setLevel(config.get("logging", {}).get("level", "INFO"))
+    llm_cache.configure(config.get("llm_cache"))
+
+    with app.app_context():
+        campaign = workflows.instantiate_campaign(app=app, campaign_id=campaign_id, mode=mode)
+
+    dataset_config = utils.load_dataset_config()
+
+    for dataset_id in campaign.db.loc[db_idxs, "dataset"].unique():
+        app.db["datasets_obj"][dataset_id] = workflows.instantiate_dataset(dataset_id, dataset_config[dataset_id])
+
+    return app, campaign
+
+
+def run_shard(config, mode, campaign_id, shard, num_shards, db_idxs, events, paused):
+    error, cache_stats = None, {}
+
+    try:
+        # a separate copy of the campaign and a separate model client for each shard
+        app, campaign = load_shard_app(config, campaign_id, mode, db_idxs)
+        campaign.set_shard(shard)
+
+        with app.app_context():
+            # the rate limits are split between the shards
+            campaign_config = campaign.metadata["config"]
+            extra_args = campaign_config["extra_args"] = campaign_config.get("extra_args") or {}
+            for key in ["rpm", "tpm"]:
+                if utils.get_run_option(campaign_config, key):
+                    extra_args[key] = float(utils.get_run_option(campaign_config, key)) / num_shards
+
+            model = ModelFactory.from_config(campaign.metadata["config"], mode=mode)
+
+            ret = process_examples(
+                app,
+                mode,
+                campaign_id,
+                ShardAnnouncer(events),
+                campaign,
+                app.db["datasets_obj"],
+                model,
+                ShardRunningCampaigns(campaign_id, paused),
+                db_idxs,
             )
+            error = ret.get_json()["error"] if ret is not None else None
+            cache_stats = getattr(model, "cache_stats", {})
+    except Exception as e:
+        traceback.print_exc()
+        error = f"{e.__class__.__name__}: {str(e)}"
+
+    events.put({"type": "shard_done", "shard": shard, "error": error, "cache_stats": cache_stats})
+
 
-        # update the DB
-        db.loc[i, "end"] = float(time.time())
-        db.loc[i, "status"] = ExampleStatus.FINISHED
+def run_shards(app, mode, campaign_id, announcer, campaign, running_campaigns, db_idxs, num_shards):
+    """
+    Split the examples at `db_idxs` between `num_shards` processes.
+
+    The shards journal the db changes and save the records to their own files. The main process relays the progress
+    messages (with the stats of the whole campaign), merges the records and compacts the db at the end.
+
+    Returns a tuple (error response or None, cache stats of the shards).
+    """
+    # the shard processes are spawned (forking a process with running threads is not safe), each of them loads the
+    # campaign and the datasets it needs
+    ctx = multiprocessing.get_context("spawn")
+    events = ctx.Queue()
+    paused = ctx.Event()
+    db = campaign.db
 
-        campaign.update_db(db)
+    # load the metrics of the previous runs before the shards start saving new records
+    if campaign.call_stats is None:
+        campaign.load_call_metrics()
 
-        # save the record to a JSONL file
-        response = workflows.save_record(
-            mode=mode,
-            campaign=campaign,
-            row=db.loc[i],
-            result=res,
+    processes = [
+        ctx.Process(
+            target=run_shard,
+            args=(dict(app.config), mode, campaign_id, shard, num_shards, db_idxs[shard::num_shards], events, paused),
         )
+        for shard in range(num_shards)
+    ]
+    for process in processes:
+        process.start()
+
+    running = num_shards
+    errors = []
+    cache_stats = {}
+
+    try:
+        while running:
+            if campaign_id not in running_campaigns:
+                paused.set()
+
+            try:
+                event = events.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    errors.append("A shard process ended unexpectedly.")
+                    break
+                continue
+
+            if event["type"] == "shard_done":
+                running -= 1
+
+                if event["error"]:
+                    errors.append(f"Shard {event['shard']}: {event['error']}")
+                    # stop the other shards as well
+                    paused.set()
+
+                for key, value in event["cache_stats"].items():
+                    cache_stats[key] = cache_stats.get(key, 0) + value
+                continue
+
+            msg = event["msg"]
+            payload = json.loads(msg.removeprefix("data: "))
+
+            if payload["type"] == "result":
+                # the stats from the shard only reflect the rows of the shard
+                db.loc[payload["db_idx"], "status"] = ExampleStatus.FINISHED
+                campaign.add_call_metrics(payload["response"])
+                payload["stats"] = campaign.get_stats()
+                msg = utils.format_sse(data=json.dumps(payload))
+
+            if announcer is not None:
+                announcer.announce(msg=msg)
+    finally:
+        paused.set()
+
+        for process in processes:
+            process.join()
+
+        # the shards wrote the changes to their own journals (or directly to the SQLite db)
+        campaign.load_db()
+        workflows.merge_shard_records(campaign)
 
-        # send a response to the frontend
-        stats = campaign.get_stats()
-        payload = {"campaign_id": campaign_id, "stats": stats, "type": "result", "response": response}
+    if errors:
+        return utils.error("\n".join(errors)), cache_stats
 
-        utils.announce(announcer, payload)
-        logger.info(f"-" * 50)
-        logger.info(f"{campaign_id}: {stats['finished']}/{stats['total']} examples")
-        logger.info(f"-" * 50)
+    return None, cache_stats
+
+
+def finalize_llm_campaign(campaign, campaign_id, running_campaigns):
+    db = campaign.db
 
     # if all examples are finished, set the campaign status to finished
     if len(db.status.unique()) == 1 and db.status.unique()[0] == ExampleStatus.FINISHED:
@@ -235,19 +670,90 @@ def run_llm_campaign(app, mode, campaign_id, announcer, campaign, datasets, mode
 
         if campaign_id in running_campaigns:
             running_campaigns.remove(campaign_id)
-
-    return jsonify(success=True, status=campaign.metadata["status"])
+    elif campaign_id in running_campaigns:
+        # the run ended without being paused, but some examples failed
+        campaign.metadata["status"] = CampaignStatus.IDLE
+        campaign.update_metadata()
+        running_campaigns.remove(campaign_id)
 
 
 def pause_llm_campaign(app, campaign_id):
     if campaign_id in app.db["running_campaigns"]:
         app.db["running_campaigns"].remove(campaign_id)
 
+    # the campaign may be queued or running in a worker process
+    jobs.pause_campaign(campaign_id)
+
     campaign = workflows.load_campaign(app, campaign_id=campaign_id)
     campaign.metadata["status"] = CampaignStatus.IDLE
     campaign.update_metadata()
 
 
+def run_job(app, job, running_campaigns):
+    campaign_id = job["campaign_id"]
+    mode = job["mode"]
+    announcer = jobs.FileAnnouncer(campaign_id)
+
+    campaign = workflows.load_campaign(app, campaign_id=campaign_id)
+
+    if campaign is None:
+        logger.error(f"Campaign {campaign_id} from job {job['id']} not found.")
+        return
+
+    try:
+        model = ModelFactory.from_config(campaign.metadata["config"], mode=mode)
+        running_campaigns.add(campaign_id)
+
+        ret = run_llm_campaign(
+            app, mode, campaign_id, announcer, campaign, workflows.get_datasets(app), model, running_campaigns
+        )
+        error = ret.get_json().get("error")
+    except Exception as e:
+        traceback.print_exc()
+        error = f"{e.__class__.__name__}: {str(e)}"
+
+    if error:
+        logger.error(f"Error while running campaign {campaign_id}: {error}")
+        utils.announce(announcer, {"campaign_id": campaign_id, "type": "status", "message": error})
+
+        campaign.load_metadata()
+        campaign.metadata["status"] = CampaignStatus.IDLE
+        campaign.update_metadata()
+
+    running_campaigns.remove(campaign_id)
+
+
+def run_worker(app, poll_interval=1.0, once=False):
+    """
+    Execute the LLM campaigns from the job queue, see `factgenie.jobs`.
+
+    Any number of workers can run at the same time, also on different machines sharing the campaign directory.
+    """
+    worker_id = jobs.get_worker_id()
+    running_campaigns = jobs.RunningCampaigns()
+
+    logger.info(f"Worker {worker_id} waiting for jobs in {jobs.JOBS_DIR}")
+
+    while True:
+        jobs.requeue_stale_jobs()
+        job = jobs.claim_job(worker_id)
+
+        if job is None:
+            if once:
+                return
+
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Worker {worker_id} running campaign {job['campaign_id']} (job {job['id']})")
+
+        try:
+            with jobs.Heartbeat(job):
+                run_job(app, job, running_campaigns)
+        finally:
+            jobs.finish_job(job)
+
+
 def parse_llm_gen_config(config):
     config = {
         "type": config.get("metricType"),
@@ -320,8 +826,9 @@ def save_generation_outputs(app, campaign_id, setup_id):
     path = OUTPUT_DIR / setup_id
     os.makedirs(path, exist_ok=True)
 
-    with open(path / f"{campaign_id}.jsonl", "w") as f:
-        for example in outputs:
-            f.write(json.dumps(example) + "\n")
+    output_store.save_outputs(path / campaign_id, outputs, output_format=app.config.get("output_format", "jsonl"))
+
+    for suffix in output_store.OUTPUT_FORMATS.values():
+        workflows.mark_changed(path / f"{campaign_id}{suffix}")
 
     return utils.success()
@@ -8,8 +8,12 @@ import logging
 from pydantic import BaseModel, Field, ValidationError
 import json
 import time
+import asyncio
+import threading
 from ast import literal_eval
 from factgenie.campaign import CampaignMode
+from factgenie import llm_cache, rate_limit
+import factgenie.utils as utils
 
 # LiteLLM seems to be triggering deprecation warnings in Pydantic, so we suppress them
 import warnings
@@ -93,6 +97,10 @@ class Model:
         self.config = config
         self.parse_model_args()
 
+        # responses served from / missing in the persistent response cache
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.cache_stats_lock = threading.Lock()
+
     def _api_url(self):
         # by default we ignore the API URL
         # override for local services that actually require the API URL (such as Ollama)
@@ -119,6 +127,152 @@ class Model:
             except:
                 pass
 
+    def is_deterministic(self):
+        """Whether the requests are sent with temperature 0, i.e. the same prompt is expected to get the same response."""
+        try:
+            return float((self.config.get("model_args") or {}).get("temperature")) == 0
+        except (TypeError, ValueError):
+            return False
+
+    def get_response_cache(self):
+        # the cache can be turned on or off per campaign with `use_cache` in `extra_args`; by default, it is used only
+        # with temperature 0, since a cached response would be replayed instead of sampling a new one
+        use_cache = utils.get_run_option(self.config, "use_cache")
+
+        if use_cache is None:
+            use_cache = self.is_deterministic()
+
+        if not use_cache:
+            return None
+
+        return llm_cache.get_cache()
+
+    def update_cache_stats(self, hit):
+        with self.cache_stats_lock:
+            self.cache_stats["hits" if hit else "misses"] += 1
+
+    def get_rate_limiter(self):
+        # requests / tokens per minute set with `rpm` and `tpm` in `extra_args`
+        return rate_limit.get_rate_limiter(
+            provider=self.config.get("type"),
+            model=self.config.get("model"),
+            rpm=utils.get_run_option(self.config, "rpm"),
+            tpm=utils.get_run_option(self.config, "tpm"),
+        )
+
+    def send_request(self, completion_args):
+        limiter = self.get_rate_limiter()
+
+        if limiter is None:
+            return litellm.completion(**completion_args)
+
+        tokens = rate_limit.estimate_tokens(completion_args)
+        limiter.acquire(tokens)
+
+        try:
+            response = litellm.completion(**completion_args)
+        except litellm.RateLimitError as e:
+            limiter.on_rate_limit(rate_limit.get_retry_after(e))
+            raise e
+
+        limiter.record_usage(tokens, getattr(response.get("usage"), "total_tokens", None))
+
+        return response
+
+    async def asend_request(self, completion_args):
+        limiter = self.get_rate_limiter()
+
+        if limiter is None:
+            return await litellm.acompletion(**completion_args)
+
+        tokens = rate_limit.estimate_tokens(completion_args)
+        await limiter.aacquire(tokens)
+
+        try:
+            response = await litellm.acompletion(**completion_args)
+        except litellm.RateLimitError as e:
+            limiter.on_rate_limit(rate_limit.get_retry_after(e))
+            raise e
+
+        limiter.record_usage(tokens, getattr(response.get("usage"), "total_tokens", None))
+
+        return response
+
+    def completion(self, completion_args):
+        """Call `litellm.completion`, serving the response from the persistent cache if possible."""
+        cache = self.get_response_cache()
+
+        if cache is None:
+            return self.send_request(completion_args)
+
+        key = cache.make_key(completion_args)
+        cached = cache.get(key)
+        self.update_cache_stats(hit=cached is not None)
+
+        if cached is not None:
+            logger.info("Using a cached response.")
+            response = litellm.ModelResponse(**cached)
+            response._hidden_params["cache_hit"] = True
+            return response
+
+        response = self.send_request(completion_args)
+        # the response is cached only once it is parsed successfully, see `cache_response()`
+        response._hidden_params["cache_key"] = key
+
+        return response
+
+    async def acompletion(self, completion_args):
+        """Asynchronous variant of `completion()` based on `litellm.acompletion`."""
+        cache = self.get_response_cache()
+
+        if cache is None:
+            return await self.asend_request(completion_args)
+
+        key = cache.make_key(completion_args)
+        cached = await asyncio.to_thread(cache.get, key)
+        self.update_cache_stats(hit=cached is not None)
+
+        if cached is not None:
+            logger.info("Using a cached response.")
+            response = litellm.ModelResponse(**cached)
+            response._hidden_params["cache_hit"] = True
+            return response
+
+        response = await self.asend_request(completion_args)
+        response._hidden_params["cache_key"] = key
+
+        return response
+
+    def cache_response(self, response):
+        """Save a response from `completion()` to the persistent cache (if it was not served from the cache)."""
+        key = response._hidden_params.get("cache_key")
+        cache = self.get_response_cache()
+
+        if key is None or cache is None:
+            return
+
+        cache.put(key, response.model_dump())
+
+    def get_call_metrics(self, response, latency=None, parse_time=None):
+        """Token usage, timing and estimated cost of a single LLM call, saved with the record."""
+        usage = response.get("usage")
+        cached = bool(response._hidden_params.get("cache_hit"))
+
+        try:
+            cost = 0.0 if cached else litellm.completion_cost(completion_response=response)
+        except Exception:
+            # unknown price for the model (e.g. local models)
+            cost = None
+
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "latency": latency,
+            "parse_time": parse_time,
+            "cost": cost,
+            "cached": cached,
+        }
+
     def validate_config(self, config):
         for field in self.get_required_fields():
             assert field in config, f"Field `{field}` is missing in the config. Keys: {config.keys()}"
@@ -246,17 +400,26 @@ class LLMMetric(Model):
 
         return prompt_template.replace("{data}", str(data_for_prompt)).replace("{text}", text)
 
-    def get_model_response(self, prompt, model_service):
-        response = litellm.completion(
-            model=model_service,
-            messages=[
+    def get_completion_args(self, prompt, model_service):
+        """Arguments for `litellm.completion` / `litellm.acompletion`. Override to pass provider-specific arguments."""
+        return {
+            "model": model_service,
+            "messages": [
                 {"role": "system", "content": self.config["system_msg"]},
                 {"role": "user", "content": prompt},
             ],
-            response_format=OutputAnnotations,
-            api_base=self._api_url(),
+            "response_format": OutputAnnotations,
+            "api_base": self._api_url(),
             **self.config.get("model_args", {}),
-        )
+        }
+
+    def get_model_response(self, prompt, model_service):
+        response = self.completion(self.get_completion_args(prompt, model_service))
+
+        return response
+
+    async def aget_model_response(self, prompt, model_service):
+        response = await self.acompletion(self.get_completion_args(prompt, model_service))
 
         return response
 
@@ -268,7 +431,7 @@ class LLMMetric(Model):
                 f"Required API variables not found for the model {model_service}. Please add the following keys to the system environment or factgenie config: {response['missing_keys']}"
             )
 
-    def annotate_example(self, data, text):
+    def prepare_request(self, data, text):
         model = self.config["model"]
         model_service = self._service_prefix() + model
 
@@ -280,28 +443,64 @@ class LLMMetric(Model):
         #     model_service
         # ), f"Model {model_service} does not support the JSON response schema."
 
-        try:
-            prompt = self.prompt(data, text)
+        prompt = self.prompt(data, text)
 
-            logger.debug(f"Prompt: {prompt}")
+        logger.debug(f"Prompt: {prompt}")
 
-            logger.info("Annotated text:")
-            logger.info(f"\033[34m{text}\033[0m")
+        logger.info("Annotated text:")
+        logger.info(f"\033[34m{text}\033[0m")
+
+        logger.info(f"Waiting for {model_service}.")
+
+        return model_service, prompt
+
+    def process_response(self, text, prompt, response):
+        logger.debug(f"Prompt tokens: {response.usage.prompt_tokens}")
+        logger.debug(f"Response tokens: {response.usage.completion_tokens}")
+
+        annotation_str = response.choices[0].message.content
+
+        return {
+            "prompt": prompt,
+            "annotations": self.parse_annotations(text=text, annotations_json=annotation_str),
+        }
+
+    def annotate_example(self, data, text):
+        try:
+            model_service, prompt = self.prepare_request(data, text)
 
-            logger.info(f"Waiting for {model_service}.")
             start = time.time()
             response = self.get_model_response(prompt, model_service)
-            logger.info(f"Received response in {time.time() - start:.2f} seconds.")
+            latency = time.time() - start
+            logger.info(f"Received response in {latency:.2f} seconds.")
 
-            logger.debug(f"Prompt tokens: {response.usage.prompt_tokens}")
-            logger.debug(f"Response tokens: {response.usage.completion_tokens}")
+            start = time.time()
+            result = self.process_response(text, prompt, response)
+            result["metrics"] = self.get_call_metrics(response, latency=latency, parse_time=time.time() - start)
+            self.cache_response(response)
 
-            annotation_str = response.choices[0].message.content
+            return result
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(e)
+            raise e
 
-            return {
-                "prompt": prompt,
-                "annotations": self.parse_annotations(text=text, annotations_json=annotation_str),
-            }
+    async def aannotate_example(self, data, text):
+        """Asynchronous variant of `annotate_example()` based on `litellm.acompletion`."""
+        try:
+            model_service, prompt = self.prepare_request(data, text)
+
+            start = time.time()
+            response = await self.aget_model_response(prompt, model_service)
+            latency = time.time() - start
+            logger.info(f"Received response in {latency:.2f} seconds.")
+
+            start = time.time()
+            result = self.process_response(text, prompt, response)
+            result["metrics"] = self.get_call_metrics(response, latency=latency, parse_time=time.time() - start)
+            await asyncio.to_thread(self.cache_response, response)
+
+            return result
         except Exception as e:
             traceback.print_exc()
             logger.error(e)
@@ -404,20 +603,11 @@ class VertexAIMetric(LLMMetric):
     def _service_prefix(self):
         return "vertex_ai/"
 
-    def get_model_response(self, prompt, model_service):
-        response = litellm.completion(
-            model=model_service,
-            messages=[
-                {"role": "system", "content": self.config["system_msg"]},
-                {"role": "user", "content": prompt},
-            ],
-            response_format=OutputAnnotations,
-            api_base=self._api_url(),
-            vertex_credentials=self.vertex_credentials_json,
-            **self.config.get("model_args", {}),
-        )
+    def get_completion_args(self, prompt, model_service):
+        args = super().get_completion_args(prompt, model_service)
+        args["vertex_credentials"] = self.vertex_credentials_json
 
-        return response
+        return args
 
 
 class LLMGen(Model):
@@ -477,15 +667,46 @@ class LLMGen(Model):
         """Override this method to change the format how the data is presented in the prompt. See self.prompt() method for usage."""
         return data
 
-    def get_model_response(self, messages, model_service):
-        response = litellm.completion(
-            model=model_service,
-            messages=messages,
-            api_base=self._api_url(),
+    def get_completion_args(self, messages, model_service):
+        """Arguments for `litellm.completion` / `litellm.acompletion`. Override to pass provider-specific arguments."""
+        return {
+            "model": model_service,
+            "messages": messages,
+            "api_base": self._api_url(),
             **self.config.get("model_args", {}),
-        )
+        }
+
+    def get_model_response(self, messages, model_service):
+        response = self.completion(self.get_completion_args(messages, model_service))
+        return response
+
+    async def aget_model_response(self, messages, model_service):
+        response = await self.acompletion(self.get_completion_args(messages, model_service))
         return response
 
+    def prepare_request(self, data):
+        model = self.config["model"]
+        model_service = self._service_prefix() + model
+
+        prompt = self.prompt(data)
+
+        messages = [
+            {"role": "system", "content": self.config["system_msg"]},
+            {"role": "user", "content": prompt},
+        ]
+
+        if self.config.get("start_with"):
+            messages.append({"role": "assistant", "content": self.config["start_with"]})
+
+        return model_service, prompt, messages
+
+    def process_response(self, prompt, response):
+        output = response.choices[0].message.content
+        output = self.postprocess_output(output)
+        logger.info(output)
+
+        return {"prompt": prompt, "output": output}
+
     def generate_output(self, data):
         """
         Generate the output with the model.
@@ -499,27 +720,42 @@ class LLMGen(Model):
                 "output": the generated output
             }
         """
-        model = self.config["model"]
-        model_service = self._service_prefix() + model
-
         try:
-            prompt = self.prompt(data)
+            model_service, prompt, messages = self.prepare_request(data)
 
-            messages = [
-                {"role": "system", "content": self.config["system_msg"]},
-                {"role": "user", "content": prompt},
-            ]
+            start = time.time()
+            response = self.get_model_response(messages, model_service)
+            latency = time.time() - start
+
+            start = time.time()
+            result = self.process_response(prompt, response)
+            result["metrics"] = self.get_call_metrics(response, latency=latency, parse_time=time.time() - start)
+            self.cache_response(response)
 
-            if self.config.get("start_with"):
-                messages.append({"role": "assistant", "content": self.config["start_with"]})
+            return result
 
-            response = self.get_model_response(messages, model_service)
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(e)
+            raise e
+
+    async def agenerate_output(self, data):
+        """
+        Asynchronous variant of `generate_output()` based on `litellm.acompletion`.
+        """
+        try:
+            model_service, prompt, messages = self.prepare_request(data)
 
-            output = response.choices[0].message.content
-            output = self.postprocess_output(output)
-            logger.info(output)
+            start = time.time()
+            response = await self.aget_model_response(messages, model_service)
+            latency = time.time() - start
+
+            start = time.time()
+            result = self.process_response(prompt, response)
+            result["metrics"] = self.get_call_metrics(response, latency=latency, parse_time=time.time() - start)
+            await asyncio.to_thread(self.cache_response, response)
 
-            return {"prompt": prompt, "output": output}
+            return result
 
         except Exception as e:
             traceback.print_exc()
@@ -613,15 +849,11 @@ class VertexAIGen(LLMGen):
             # Convert to JSON string
             self.vertex_credentials_json = json.dumps(vertex_credentials)
 
-    def get_model_response(self, messages, model_service):
-        response = litellm.completion(
-            model=model_service,
-            messages=messages,
-            api_base=self._api_url(),
-            vertex_credentials=self.vertex_credentials_json,
-            **self.config.get("model_args", {}),
-        )
-        return response
+    def get_completion_args(self, messages, model_service):
+        args = super().get_completion_args(messages, model_service)
+        args["vertex_credentials"] = self.vertex_credentials_json
+
+        return args
 
     def _service_prefix(self):
         return "vertex_ai/"
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Storage formats of the model outputs in OUTPUT_DIR.
+#
+# Besides the JSONL files (one record per line), the outputs can be stored in compressed Parquet files
+# (`output_format: parquet` in the main config):
+#   - `dataset`, `split` and `setup_id` are dictionary-encoded (the same value repeats in all the rows)
+#   - `metadata` (the model config, the prompt, ...) is kept as JSON in a column of its own, so that building the output
+#     index reads only the key columns and the outputs
+#   - any other fields of the records (and non-string outputs) are kept as JSON in the `extra` column
+# The files can be converted between the formats with `factgenie convert_outputs`.
+import json
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+OUTPUT_FORMATS = {"jsonl": ".jsonl", "parquet": ".parquet"}
+
+KEY_COLUMNS = ["dataset", "split", "setup_id"]
+JSON_COLUMNS = ["metadata", "extra"]
+
+SCHEMA = pa.schema(
+    [
+        ("dataset", pa.dictionary(pa.int32(), pa.string())),
+        ("split", pa.dictionary(pa.int32(), pa.string())),
+        ("setup_id", pa.dictionary(pa.int32(), pa.string())),
+        ("example_idx", pa.int64()),
+        ("output", pa.string()),
+        ("metadata", pa.string()),
+        ("extra", pa.string()),
+    ]
+)
+
+
+def write_parquet(path, records):
+    columns = {name: [] for name in SCHEMA.names}
+
+    for record in records:
+        extra = {key: value for key, value in record.items() if key not in SCHEMA.names}
+        output = record.get("output")
+
+        if output is not None and not isinstance(output, str):
+            extra["output"] = output
+            output = None
+
+        for key in KEY_COLUMNS + ["example_idx"]:
+            columns[key].append(record[key])
+
+        columns["output"].append(output)
+        columns["metadata"].append(json.dumps(record["metadata"]) if "metadata" in record else None)
+        columns["extra"].append(json.dumps(extra) if extra else None)
+
+    table = pa.table(columns, schema=SCHEMA)
+
+    # the indexes never see an incomplete file
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    pq.write_table(table, tmp_path, compression="zstd", use_dictionary=KEY_COLUMNS)
+    os.replace(tmp_path, path)
+
+
+def read_parquet(path, columns=None):
+    """Read the records from a Parquet file, only the fields from `columns` if set."""
+    file_columns = pq.read_schema(path).names
+
+    if columns is not None:
+        # the requested fields may also be stored in `extra`
+        file_columns = [col for col in file_columns if col in columns or col == "extra"]
+
+    table = pq.read_table(path, columns=file_columns)
+    values = {col: table.column(col).to_pylist() for col in table.column_names}
+    records = []
+
+    for i in range(table.num_rows):
+        record = {}
+
+        for col, col_values in values.items():
+            value = col_values[i]
+
+            if col == "extra":
+                if value is not None:
+                    extra = json.loads(value)
+                    record.update({k: v for k, v in extra.items() if columns is None or k in columns})
+            elif col in JSON_COLUMNS:
+                if value is not None:
+                    record[col] = json.loads(value)
+            elif value is not None or col in KEY_COLUMNS:
+                record[col] = value
+
+        records.append(record)
+
+    return records
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(path, records):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def save_outputs(path, records, output_format="jsonl"):
+    """
+    Save the records to `path` (without the suffix) in the given format, remove the file in the other format.
+
+    Returns the path of the saved file.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format `{output_format}`. Supported: {list(OUTPUT_FORMATS)}")
+
+    out_path = Path(f"{path}{OUTPUT_FORMATS[output_format]}")
+
+    if output_format == "parquet":
+        write_parquet(out_path, records)
+    else:
+        write_jsonl(out_path, records)
+
+    for suffix in OUTPUT_FORMATS.values():
+        if suffix != out_path.suffix:
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    return out_path
+
+
+def convert_outputs(path, output_format):
+    """Convert the output file to the other format, return the path of the new file (or None if nothing changed)."""
+    path = Path(path)
+
+    if path.suffix == OUTPUT_FORMATS[output_format]:
+        return None
+
+    records = read_parquet(path) if path.suffix == ".parquet" else read_jsonl(path)
+
+    return save_outputs(path.with_suffix(""), records, output_format=output_format)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Client-side rate limiting and retry scheduling for the LLM providers.
+# The limits (requests / tokens per minute) are set in the `extra_args` of the campaign config: `rpm`, `tpm`.
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import litellm
+import requests
+
+logger = logging.getLogger("factgenie")
+
+# errors after which the request can be sent again
+TRANSIENT_ERRORS = (
+    litellm.RateLimitError,
+    litellm.ServiceUnavailableError,
+    litellm.InternalServerError,
+    litellm.APIConnectionError,
+    litellm.Timeout,
+    requests.exceptions.ConnectionError,
+)
+
+# after a 429 response, the rate is multiplied by this factor...
+BACKOFF_FACTOR = 0.5
+# ...and it recovers by this fraction of the configured rate per minute without 429s
+RECOVERY_RATE = 0.1
+# never go below this fraction of the configured rate
+MIN_RATE_FRACTION = 0.05
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `capacity` per minute."""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # a request larger than the bucket can never fit, let it through once the bucket is full
+        amount = min(amount, self.capacity)
+
+        if self.tokens >= amount:
+            return 0.0
+
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits shared by all the campaigns using the same model.
+
+    The limiter is adaptive: a 429 response lowers the request rate (and pauses the requests for the time given in
+    the `Retry-After` header), the rate then slowly recovers towards the configured limit.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.lock = threading.Lock()
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        # fraction of the configured request rate currently in use, lowered after 429s
+        self.rate_fraction = 1.0
+        self.penalized_fraction = 1.0
+        self.last_rate_limit = 0.0
+        self.paused_until = 0.0
+
+    def configure(self, rpm=None, tpm=None):
+        with self.lock:
+            if rpm != self.rpm:
+                self.rpm = rpm
+                self.requests = TokenBucket(rpm) if rpm else None
+
+            if tpm != self.tpm:
+                self.tpm = tpm
+                self.tokens = TokenBucket(tpm) if tpm else None
+
+    def recover(self, now):
+        elapsed = now - self.last_rate_limit
+        self.rate_fraction = min(1.0, self.penalized_fraction + RECOVERY_RATE * elapsed / 60)
+
+        if self.requests:
+            self.requests.rate = self.requests.capacity * self.rate_fraction / 60
+
+    def try_acquire(self, tokens=0):
+        """Take the request from the buckets if it can be sent now, otherwise return the time to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.recover(now)
+
+            wait = self.paused_until - now
+
+            for bucket, amount in [(self.requests, 1), (self.tokens, tokens)]:
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(amount))
+
+            if wait <= 0:
+                if self.requests:
+                    self.requests.consume(1)
+                if self.tokens:
+                    self.tokens.consume(tokens)
+                return 0.0
+
+            return wait
+
+    def acquire(self, tokens=0):
+        """Block until a request with (approximately) `tokens` tokens can be sent."""
+        while (wait := self.try_acquire(tokens)) > 0:
+            time.sleep(min(wait, 1.0))
+
+    async def aacquire(self, tokens=0):
+        """Counterpart of `acquire()` for the event loop, waiting does not block a thread."""
+        while (wait := self.try_acquire(tokens)) > 0:
+            await asyncio.sleep(min(wait, 1.0))
+
+    def record_usage(self, estimated_tokens, used_tokens):
+        """Correct the token bucket with the actual number of tokens reported by the API."""
+        with self.lock:
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.consume(used_tokens - estimated_tokens)
+
+    def on_rate_limit(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self.recover(now)
+            self.last_rate_limit = now
+            self.rate_fraction = self.penalized_fraction = max(MIN_RATE_FRACTION, self.rate_fraction * BACKOFF_FACTOR)
+
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+            logger.warning(
+                f"Rate limit reached, reducing the request rate to {self.rate_fraction * 100:.0f}% of the limit."
+            )
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider, model, rpm=None, tpm=None):
+    """Return the limiter shared by all the requests to `model` from `provider`, or None if no limits are set."""
+    if not rpm and not tpm:
+        return None
+
+    with _limiters_lock:
+        key = (provider, model)
+
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(rpm=rpm, tpm=tpm)
+        else:
+            _limiters[key].configure(rpm=rpm, tpm=tpm)
+
+        return _limiters[key]
+
+
+def estimate_tokens(completion_args):
+    # rough estimate (~4 characters per token), corrected with the actual usage once the response arrives
+    text = "".join(str(message.get("content", "")) for message in completion_args.get("messages", []))
+    return len(text) // 4 + int(completion_args.get("max_tokens") or 0)
+
+
+def get_retry_after(exception):
+    response = getattr(exception, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient_error(exception):
+    return isinstance(exception, TRANSIENT_ERRORS)
+
+
+def get_retry_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Cache of the examples rendered to HTML by `Dataset.render()`.
+# The rendered examples are kept in a bounded LRU keyed by (dataset_id, split, example_idx, dataset version), so that
+# browsing the same examples again does not run the renderer (markdown conversion, json2table, ...) on every request.
+# With `disk: true`, the evicted examples are also kept in an SQLite database in CACHE_DIR, which survives restarts.
+import logging
+import threading
+from collections import OrderedDict
+
+from factgenie import CACHE_DIR
+from factgenie.sqlite_lru import SQLiteLRU
+
+logger = logging.getLogger("factgenie")
+
+RENDER_CACHE_PATH = CACHE_DIR / "rendered_examples.sqlite"
+
+
+class RenderCache:
+    def __init__(self, max_entries=1000, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.path = str(path) if path else None
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+        self.disk = None
+
+        if self.path:
+            self.disk = SQLiteLRU(
+                path,
+                table="examples",
+                key_columns=[
+                    ("dataset_id", "TEXT"),
+                    ("split", "TEXT"),
+                    ("example_idx", "INTEGER"),
+                    ("version", "TEXT"),
+                ],
+                value_columns=[("html", "TEXT")],
+                max_entries=max_disk_entries,
+            )
+
+    def get_or_render(self, key, render, prefetch=False):
+        """
+        Return the HTML for the key (dataset_id, split, example_idx, version), call `render()` if it is not cached.
+
+        `render()` is called without holding the lock, so the same example may be rendered twice by concurrent requests.
+        The examples rendered ahead with `prefetch=True` are not counted in the hits and misses.
+        """
+        with self.lock:
+            if key in self.entries:
+                if not prefetch:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+
+                return self.entries[key]
+
+        found, html = self.get_from_disk(key)
+
+        if not found:
+            html = render()
+            self.put_to_disk(key, html)
+
+        with self.lock:
+            if prefetch:
+                self.prefetched += 1
+            elif found:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return html
+
+    def get_from_disk(self, key):
+        if self.disk is None:
+            return False, None
+
+        row = self.disk.get(key)
+
+        return (True, row[0]) if row is not None else (False, None)
+
+    def put_to_disk(self, key, html):
+        if self.disk is not None:
+            self.disk.put(key, (html,))
+
+    def invalidate(self, dataset_id):
+        """Remove all the rendered examples of the dataset (e.g. after it was deleted)."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == dataset_id]:
+                del self.entries[key]
+
+        if self.disk is not None:
+            self.disk.delete("dataset_id = ?", (dataset_id,))
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.disk_hits + self.misses
+
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "prefetched": self.prefetched,
+                "hit_rate": round((self.hits + self.disk_hits) / requests, 4) if requests else None,
+            }
+
+
+# the cache is shared by all the requests in the process
+cache_config = {"enabled": True, "max_entries": 1000, "disk": False, "max_disk_entries": 100000}
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def configure(config):
+    """Set up the cache from the `render_cache` section of the app config."""
+    global _cache
+
+    cache_config.update(config or {})
+    _cache = None
+
+
+def get_cache():
+    global _cache
+
+    if not cache_config.get("enabled", True):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache(
+                max_entries=int(cache_config.get("max_entries", 1000)),
+                path=RENDER_CACHE_PATH if cache_config.get("disk", False) else None,
+                max_disk_entries=int(cache_config.get("max_disk_entries", 100000)),
+            )
+
+    return _cache
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Bounded key-value table in an SQLite database, used by the persistent caches (`llm_cache.py`, `render_cache.py`).
+# The least recently used entries are evicted once the table has more than `max_entries` entries. The number of entries
+# is kept in the database and updated in the same transaction as the entries, so that the bound holds for all the
+# processes sharing the file.
+import os
+import sqlite3
+import time
+
+
+class SQLiteLRU:
+    def __init__(self, path, table, key_columns, value_columns, max_entries):
+        """
+        Args:
+            path: path of the database file
+            table: name of the table with the entries
+            key_columns: (name, type) pairs of the columns forming the key
+            value_columns: (name, type) pairs of the columns with the cached values
+            max_entries: maximum number of entries in the table
+        """
+        self.path = str(path)
+        self.table = table
+        self.key_names = [name for name, _ in key_columns]
+        self.value_names = [name for name, _ in value_columns]
+        self.max_entries = max_entries
+        self.key_condition = " AND ".join(f"{name} = ?" for name in self.key_names)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        columns = ", ".join(f"{name} {column_type}" for name, column_type in [*key_columns, *value_columns])
+
+        conn = self.connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({columns}, last_access REAL, "
+                f"PRIMARY KEY ({', '.join(self.key_names)}))"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_last_access ON {table} (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute(
+                f"INSERT OR IGNORE INTO meta (key, value) VALUES (?, (SELECT COUNT(*) FROM {table}))", (table,)
+            )
+        finally:
+            conn.close()
+
+    def connect(self):
+        # autocommit mode, transactions are opened explicitly
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @property
+    def entry_count(self):
+        conn = self.connect()
+        try:
+            return self.read_count(conn)
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """The values stored for the key (a tuple), None if there are none."""
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                f"SELECT {', '.join(self.value_names)} FROM {self.table} WHERE {self.key_condition}", key
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE {self.key_condition}", (time.time(), *key))
+        finally:
+            conn.close()
+
+        return row
+
+    def put(self, key, values):
+        columns = [*self.key_names, *self.value_names, "last_access"]
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            if conn.execute(f"SELECT 1 FROM {self.table} WHERE {self.key_condition}", key).fetchone() is None:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = ?", (self.table,))
+
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                (*key, *values, time.time()),
+            )
+
+            overflow = self.read_count(conn) - self.max_entries
+
+            if overflow > 0:
+                # evict the least recently used entries
+                self.delete_in_transaction(
+                    conn, f"rowid IN (SELECT rowid FROM {self.table} ORDER BY last_access LIMIT ?)", (overflow,)
+                )
+
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def delete(self, condition, params=()):
+        """Remove the entries matching the SQL condition."""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self.delete_in_transaction(conn, condition, params)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def clear(self):
+        self.delete("1")
+
+    def read_count(self, conn):
+        return conn.execute("SELECT value FROM meta WHERE key = ?", (self.table,)).fetchone()[0]
+
+    def delete_in_transaction(self, conn, condition, params):
+        deleted = conn.execute(f"DELETE FROM {self.table} WHERE {condition}", params).rowcount
+        conn.execute("UPDATE meta SET value = value - ? WHERE key = ?", (deleted, self.table))
@@ -1,6 +1,13 @@
 var current_example_idx = 0;
 var selected_campaigns = [];
 var collapsed_boxes = [];
+// responses for the examples following the current one are fetched ahead, the server renders even further ahead
+const PREFETCH_COUNT = 3;
+const SERVER_PREFETCH_COUNT = 10;
+// outputs and annotations may change, so the fetched examples are used only for a while
+const EXAMPLE_CACHE_TTL = 30000;
+const EXAMPLE_CACHE_SIZE = 50;
+var exampleCache = new Map();
 var splitInstance = Split(['#centerpanel', '#rightpanel'], {
     sizes: [66, 33],
     gutterSize: 1,
@@ -155,11 +162,11 @@ function fetchExample(dataset, split, example_idx) {
     if (!window.location.href.includes(newUrl)) {
         history.pushState(null, '', newUrl);
     }
-    $.get(`${url_prefix}/example`, {
-        "dataset": dataset,
-        "example_idx": example_idx,
-        "split": split,
-    }, function (data) {
+    requestExample(dataset, split, example_idx, SERVER_PREFETCH_COUNT).done(function (data) {
+        if (example_idx != current_example_idx) {
+            // the user has already moved to another example
+            return;
+        }
         if (data.error !== undefined) {
             console.log(data.error);
             alert(data.error);
@@ -195,12 +202,59 @@ function fetchExample(dataset, split, example_idx) {
         updateDisplayedAnnotations();
 
         window.highlight_setup_id = null;
+
+        prefetchExamples(dataset, split, parseInt(example_idx));
     }).fail(function (response) {
         console.log(response);
         alert("Failed to fetch example.");
     });
 }
 
+// `prefetch`: the number of the following examples the server renders ahead (only for the displayed example)
+function requestExample(dataset, split, example_idx, prefetch = 0) {
+    const key = `${dataset}/${split}/${example_idx}`;
+    const cached = exampleCache.get(key);
+
+    if (cached !== undefined && Date.now() - cached.time < EXAMPLE_CACHE_TTL) {
+        return cached.request;
+    }
+    const request = $.get(`${url_prefix}/example`, {
+        "dataset": dataset,
+        "example_idx": example_idx,
+        "split": split,
+        "prefetch": prefetch,
+    });
+    const entry = { request: request, time: Date.now() };
+    exampleCache.set(key, entry);
+
+    // errors are not cached
+    request.then(function (data) {
+        if (data.error !== undefined && exampleCache.get(key) === entry) {
+            exampleCache.delete(key);
+        }
+    }, function () {
+        if (exampleCache.get(key) === entry) {
+            exampleCache.delete(key);
+        }
+    });
+    return request;
+}
+
+function prefetchExamples(dataset, split, example_idx) {
+    const example_count = datasets[dataset].example_count[split];
+
+    for (let idx = example_idx + 1; idx <= Math.min(example_idx + PREFETCH_COUNT, example_count - 1); idx++) {
+        requestExample(dataset, split, idx);
+    }
+    // the map keeps the insertion order, the oldest entries are dropped first
+    for (const [key, entry] of exampleCache) {
+        if (exampleCache.size <= EXAMPLE_CACHE_SIZE && Date.now() - entry.time < EXAMPLE_CACHE_TTL) {
+            break;
+        }
+        exampleCache.delete(key);
+    }
+}
+
 function getAnnotatedOutput(output, annId, annotations) {
     const setup_id = output.setup_id;
 
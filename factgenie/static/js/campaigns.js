@@ -414,6 +414,19 @@ function setExampleStatus(status, button) {
 }
 
 
+function showCallStats(stats, campaignId) {
+    const cost = stats.cost !== null && stats.cost !== undefined ? `, $${stats.cost}` : "";
+    $(`#metadata-usage-${campaignId}`).html(
+        `${stats.prompt_tokens || 0} prompt / ${stats.completion_tokens || 0} completion tokens${cost}`
+    );
+
+    if (stats.latency_p50 !== null && stats.latency_p50 !== undefined) {
+        $(`#metadata-throughput-${campaignId}`).html(
+            `latency p50 ${stats.latency_p50} s / p95 ${stats.latency_p95} s, ${stats.tokens_per_s || 0} tokens/s, ${stats.examples_per_min || 0} examples/min`
+        );
+    }
+}
+
 function showResult(payload, campaignId) {
     const finished_examples = payload.stats.finished;
     const total_examples = payload.stats.total;
@@ -421,6 +434,8 @@ function showResult(payload, campaignId) {
     $(`#llm-progress-bar-${campaignId}`).css("width", `${progress}%`);
     $(`#llm-progress-bar-${campaignId}`).attr("aria-valuenow", progress);
     $(`#metadata-example-cnt-${campaignId}`).html(`${finished_examples} / ${total_examples}`);
+    $(`#metadata-cache-${campaignId}`).html(`${payload.stats.cache_hits} hits / ${payload.stats.cache_misses} misses`);
+    showCallStats(payload.stats, campaignId);
     console.log(`Progress: ${progress}%`);
 
 
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
+import ast
 import queue
 import os
 import urllib
 import logging
 import yaml
 import json
+import time
+import zipfile
 from slugify import slugify
 from tqdm import tqdm
 from pathlib import Path
-from flask import jsonify, render_template_string
+from flask import Response, jsonify, render_template_string
 from factgenie.campaign import CampaignMode
 from factgenie import (
     RESOURCES_CONFIG_PATH,
@@ -55,6 +58,83 @@ def format_sse(data: str, event=None) -> str:
     return msg
 
 
+# size of the pieces in which the files are read into the exported zip archives
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class ZipStream:
+    """Write-only file object collecting what `zipfile.ZipFile` writes until it is sent to the client."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.pos = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def iter_zip(entries):
+    """
+    Generate the zip archive with the entries piece by piece.
+
+    Args:
+        entries: iterable of (name in the archive, source), where the source is a path of a file or an iterable of
+            bytes (e.g. a generator of JSONL lines)
+    """
+    stream = ZipStream()
+
+    with zipfile.ZipFile(stream, "w") as zip_file:
+        for arcname, source in entries:
+            if isinstance(source, (str, Path)):
+                zinfo = zipfile.ZipInfo.from_file(source, arcname)
+                source = iter_file(source)
+            else:
+                zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+
+            # the size is not known in advance
+            with zip_file.open(zinfo, "w", force_zip64=True) as f:
+                for data in source:
+                    f.write(data)
+
+                    if stream.size >= ZIP_CHUNK_SIZE:
+                        yield stream.pop()
+
+            yield stream.pop()
+
+    yield stream.pop()
+
+
+def iter_file(path):
+    with open(path, "rb") as f:
+        while data := f.read(ZIP_CHUNK_SIZE):
+            yield data
+
+
+def zip_response(entries, filename):
+    """Stream the zip archive with the entries (see `iter_zip()`) as a download."""
+    return Response(
+        iter_zip(entries),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
 def success(message=None):
     resp = jsonify(success=True, message=message)
     return resp
@@ -74,6 +154,23 @@ def get_mode_from_path(path):
         return CampaignMode.LLM_GEN
 
 
+def get_run_option(config, key, default=None):
+    """
+    Read an execution option (e.g. `max_concurrency`) from the `extra_args` of the campaign config.
+
+    The values coming from the web interface are strings, so we try to parse them as Python literals.
+    """
+    value = (config.get("extra_args") or {}).get(key, default)
+
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+
+    return value
+
+
 def load_resources_config():
     with open(RESOURCES_CONFIG_PATH) as f:
         config = yaml.safe_load(f)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# Filesystem watcher invalidating the in-memory indexes (campaign index, annotation index, output index).
+#
+# Instead of scanning CAMPAIGN_DIR and OUTPUT_DIR on every refresh, the indexes ask the watcher which paths changed
+# since their last refresh and reload only those:
+#   - output_index: changed JSONL and Parquet files in OUTPUT_DIR
+#   - annotation_index, campaign_index: directories of the campaigns with any changed file
+# `None` instead of a set of paths means that the index has to be rebuilt from a full scan (e.g. on the first refresh).
+#
+# The watcher uses inotify (or the native API of the platform) through `watchdog` and falls back to polling the
+# directories in a background thread if the native API is not available (e.g. on network filesystems). Set with
+# `index_watcher: native | polling | off` in the main config.
+import logging
+import threading
+from pathlib import Path
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from factgenie import CAMPAIGN_DIR, OUTPUT_DIR
+from factgenie.campaign_stats import STATS_FILE
+from factgenie.output_store import OUTPUT_FORMATS
+
+logger = logging.getLogger("factgenie")
+
+POLL_INTERVAL = 1
+
+INDEXES = ("campaign_index", "annotation_index", "output_index")
+
+# the running watchers of this process, notified directly about the files written by the app itself
+running_watchers = set()
+running_watchers_lock = threading.Lock()
+
+
+def notify_change(path, is_directory=False):
+    """
+    Report a path written by this process to its running watchers.
+
+    The filesystem events come with a delay (about a second), so an index refreshed right after the write (e.g. loading
+    a campaign which has just been created) would not see the path yet.
+    """
+    with running_watchers_lock:
+        watchers = list(running_watchers)
+
+    for watcher in watchers:
+        watcher.on_change(Path(path), is_directory)
+
+
+class IndexEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+
+        # changes of the directory listing are handled with the events of the files themselves
+        if event.is_directory and event.event_type == "modified":
+            return
+
+        for path in [event.src_path, getattr(event, "dest_path", "")]:
+            if path:
+                self.watcher.on_change(Path(path), event.is_directory)
+
+
+class IndexWatcher:
+    def __init__(self, campaign_dir=CAMPAIGN_DIR, output_dir=OUTPUT_DIR):
+        self.campaign_dir = Path(campaign_dir)
+        self.output_dir = Path(output_dir)
+        self.lock = threading.Lock()
+        self.observer = None
+        # a full scan is needed before the first changes are known
+        self.changes = {index: None for index in INDEXES}
+
+    def start(self, mode="native"):
+        observer_classes = {"native": [Observer, PollingObserver], "polling": [PollingObserver]}[mode]
+
+        for observer_cls in observer_classes:
+            try:
+                observer = observer_cls(timeout=POLL_INTERVAL)
+
+                for directory in [self.campaign_dir, self.output_dir]:
+                    observer.schedule(IndexEventHandler(self), str(directory), recursive=True)
+
+                observer.start()
+            except OSError as e:
+                logger.warning(f"Cannot start {observer_cls.__name__} for the indexes: {e}")
+                continue
+
+            self.observer = observer
+
+            with running_watchers_lock:
+                running_watchers.add(self)
+
+            logger.debug(f"Watching the campaign and output files with {observer_cls.__name__}")
+            return True
+
+        return False
+
+    def stop(self):
+        with running_watchers_lock:
+            running_watchers.discard(self)
+
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def is_running(self):
+        return self.observer is not None and self.observer.is_alive()
+
+    def add_changes(self, index, paths):
+        with self.lock:
+            if self.changes[index] is not None:
+                self.changes[index].update(paths)
+
+    def mark_rescan(self, index):
+        with self.lock:
+            self.changes[index] = None
+
+    def pop_changes(self, index):
+        """Return the paths changed since the last call (or None if a full scan is needed) and reset them."""
+        if not self.is_running():
+            # no events are coming, every refresh needs a full scan
+            return None
+
+        with self.lock:
+            changes = self.changes[index]
+            self.changes[index] = set()
+
+        return changes
+
+    def on_change(self, path, is_directory):
+        if path.is_relative_to(self.output_dir):
+            if is_directory:
+                # moved or deleted directories do not produce events for the files inside
+                self.mark_rescan("output_index")
+            elif path.suffix in OUTPUT_FORMATS.values():
+                self.add_changes("output_index", [path])
+
+        elif path.is_relative_to(self.campaign_dir):
+            parts = path.relative_to(self.campaign_dir).parts
+
+            if not parts:
+                self.mark_rescan("campaign_index")
+                self.mark_rescan("annotation_index")
+                return
+
+            # the campaign statistics (`campaign_stats.py`) are written by the app itself
+            if len(parts) == 2 and (parts[1] == STATS_FILE or parts[1].startswith(f".{STATS_FILE}.")):
+                return
+
+            campaign_dir = self.campaign_dir / parts[0]
+            self.add_changes("campaign_index", [campaign_dir])
+
+            # the annotation files (`<campaign_id>/files/*.jsonl`) are indexed according to the campaign mode
+            if (
+                len(parts) == 1
+                or parts[1] == "metadata.json"
+                or (len(parts) == 2 and is_directory)
+                or (len(parts) == 3 and path.suffix == ".jsonl")
+            ):
+                self.add_changes("annotation_index", [campaign_dir])
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import re
 import datetime
 import json
 import time
@@ -12,15 +13,21 @@ import shutil
 import importlib
 import zipfile
 import traceback
-import tempfile
+import threading
+import fnmatch
+import multiprocessing
+import factgenie.jobs as jobs
+import factgenie.output_store as output_store
+import factgenie.render_cache as render_cache
 import factgenie.utils as utils
 
 from io import BytesIO
 from slugify import slugify
-from flask import make_response
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 from factgenie.campaign import (
+    Campaign,
     HumanCampaign,
     LLMCampaignEval,
     ExternalCampaign,
@@ -38,14 +45,58 @@ from factgenie import (
     LLM_GEN_CONFIG_DIR,
     CROWDSOURCING_CONFIG_DIR,
 )
+from factgenie.indexes import AnnotationIndex, IndexSnapshot, OutputIndex, get_file_state, refresh_index
 
 logger = logging.getLogger("factgenie")
 
+# guards moving the datasets loaded in the worker processes to `app.db["datasets_obj"]`
+datasets_loading_lock = threading.Lock()
+
+# renders the examples ahead of the user browsing the dataset
+MAX_PREFETCH = 20
+prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+# the examples submitted to `prefetch_executor` and not rendered yet, new ones are dropped once there are too many
+MAX_PREFETCH_PENDING = 2 * MAX_PREFETCH
+prefetch_pending = set()
+prefetch_lock = threading.Lock()
+
+# the state of the campaign runs and the cached statistics, which are not exported with the campaign
+# (the db is exported as a whole in `db.csv`)
+CAMPAIGN_EXPORT_EXCLUDE = [
+    "db.csv",
+    "db.csv.bak",
+    "db_journal*.jsonl",
+    "db.sqlite*",
+    "batch_input.jsonl",
+    "progress.jsonl",
+    "pause",
+    "stats.json",
+    "*.tmp",
+]
+
+
+def get_dataset(app, dataset_id, wait_loading=False):
+    future = app.db["datasets_loading"].get(dataset_id)
+
+    if future is not None and wait_loading:
+        wait([future])
+        collect_loaded_dataset(app, dataset_id, future)
 
-def get_dataset(app, dataset_id):
     return app.db["datasets_obj"].get(dataset_id)
 
 
+def get_datasets(app):
+    """Wait until all the datasets are loaded and return them."""
+    for dataset_id in list(app.db["datasets_loading"].keys()):
+        get_dataset(app, dataset_id, wait_loading=True)
+
+    return app.db["datasets_obj"]
+
+
+def is_dataset_loading(app, dataset_id):
+    return dataset_id in app.db["datasets_loading"]
+
+
 def load_configs(mode):
     """
     Goes through all the files in the LLM_CONFIG_DIR
@@ -78,21 +129,73 @@ def load_configs(mode):
     return configs
 
 
+def render_example(app, dataset, split, example_idx, example, prefetch=False):
+    host_prefix = app.config["host_prefix"]
+
+    def render():
+        html = dataset.render(example=example)
+
+        if html is not None:
+            # temporary solution for external files
+            # prefix all the "/files" calls with "app.config["host_prefix"]"
+            html = html.replace('src="/files', f'src="{host_prefix}/files')
+
+        return html
+
+    cache = render_cache.get_cache()
+
+    if cache is None:
+        return render()
+
+    # the cached HTML already contains the host prefix
+    version = f"{getattr(dataset, 'version', None)}:{host_prefix}"
+
+    return cache.get_or_render((dataset.id, split, example_idx, version), render, prefetch=prefetch)
+
+
+def prefetch_examples(app, dataset_id, split, example_idx, count):
+    """Render the `count` examples following `example_idx` into the render cache in the background."""
+    dataset = get_dataset(app, dataset_id)
+
+    if dataset is None or render_cache.get_cache() is None:
+        return
+
+    end = min(example_idx + 1 + min(count, MAX_PREFETCH), dataset.get_example_count(split))
+
+    def prefetch_example(idx):
+        try:
+            example = dataset.get_example(split=split, example_idx=idx)
+            render_example(app, dataset, split, idx, example, prefetch=True)
+        except Exception as e:
+            logger.debug(f"Cannot prefetch example {dataset_id}/{split}/{idx}: {e.__class__.__name__}: {e}")
+        finally:
+            with prefetch_lock:
+                prefetch_pending.discard((dataset_id, split, idx))
+
+    for idx in range(example_idx + 1, end):
+        with prefetch_lock:
+            # already waiting to be rendered, or the renderers cannot keep up with the browsing
+            if (dataset_id, split, idx) in prefetch_pending or len(prefetch_pending) >= MAX_PREFETCH_PENDING:
+                continue
+
+            prefetch_pending.add((dataset_id, split, idx))
+
+        prefetch_executor.submit(prefetch_example, idx)
+
+
 def get_example_data(app, dataset_id, split, example_idx, setup_id=None):
     dataset = get_dataset(app=app, dataset_id=dataset_id)
 
+    if dataset is None and is_dataset_loading(app, dataset_id):
+        raise ValueError(f"Dataset {dataset_id} is still loading")
+
     try:
         example = dataset.get_example(split=split, example_idx=example_idx)
     except:
         raise ValueError("Example cannot be retrieved from the dataset")
 
     try:
-        html = dataset.render(example=example)
-
-        if html is not None:
-            # temporary solution for external files
-            # prefix all the "/files" calls with "app.config["host_prefix"]"
-            html = html.replace('src="/files', f'src="{app.config["host_prefix"]}/files')
+        html = render_example(app, dataset, split, example_idx, example)
     except:
         raise ValueError("Example cannot be rendered")
 
@@ -146,16 +249,39 @@ def load_campaign(app, campaign_id):
     return campaign
 
 
+def get_index_changes(app, index):
+    """Paths changed since the last refresh of the index according to the watcher, None if a full scan is needed."""
+    watcher = app.db.get("index_watcher")
+
+    return watcher.pop_changes(index) if watcher is not None else None
+
+
+def mark_changed(path, is_directory=False):
+    """Report a file or directory written by the app to the index watcher, so that the next refresh of the indexes sees it."""
+    # imported here: the watcher depends on the campaign statistics, which depend on this module
+    from factgenie.watcher import notify_change
+
+    notify_change(path, is_directory=is_directory)
+
+
 def generate_campaign_index(app, force_reload=True):
     if "campaign_index" in app.db:
         campaign_index = app.db["campaign_index"]
     else:
         campaign_index = defaultdict(dict)
 
+    changes = get_index_changes(app, "campaign_index")
+
+    if changes is None:
+        campaign_dirs = [campaign_dir for campaign_dir in Path(CAMPAIGN_DIR).iterdir() if campaign_dir.is_dir()]
+    else:
+        # only the campaigns with changed files, the rest of the index is up to date
+        campaign_dirs = [campaign_dir for campaign_dir in changes if campaign_dir.is_dir()]
+
     existing_campaign_ids = set()
-    for campaign_dir in Path(CAMPAIGN_DIR).iterdir():
-        if not campaign_dir.is_dir():
-            continue
+    skipped_campaign_dirs = []
+
+    for campaign_dir in campaign_dirs:
         try:
             metadata = json.load(open(campaign_dir / "metadata.json"))
             mode = metadata["mode"]
@@ -163,6 +289,7 @@ def generate_campaign_index(app, force_reload=True):
             existing_campaign_ids.add(campaign_id)
 
             if campaign_id in campaign_index and not force_reload:
+                skipped_campaign_dirs.append(campaign_dir)
                 continue
 
             campaign = instantiate_campaign(app=app, campaign_id=campaign_id, mode=mode)
@@ -171,6 +298,7 @@ def generate_campaign_index(app, force_reload=True):
                 (mode == CampaignMode.LLM_EVAL or mode == CampaignMode.LLM_GEN)
                 and campaign.metadata["status"] == CampaignStatus.RUNNING
                 and campaign_id not in app.db["running_campaigns"]
+                and not jobs.is_campaign_active(campaign_id)
             ):
                 campaign.metadata["status"] = CampaignStatus.IDLE
                 campaign.update_metadata()
@@ -182,20 +310,36 @@ def generate_campaign_index(app, force_reload=True):
             logger.error(f"Error while loading campaign {campaign_dir}")
 
     # remove campaigns that are no longer in the directory
-    campaign_index = {k: v for k, v in campaign_index.items() if k in existing_campaign_ids}
+    if changes is None:
+        campaign_index = {k: v for k, v in campaign_index.items() if k in existing_campaign_ids}
+    else:
+        campaign_index = {
+            k: v for k, v in campaign_index.items() if k in existing_campaign_ids or Path(v.dir) not in changes
+        }
+
+    # the changes of the campaigns which were not reloaded are kept for the next forced reload
+    if app.db.get("index_watcher") is not None and skipped_campaign_dirs:
+        if changes is None:
+            app.db["index_watcher"].mark_rescan("campaign_index")
+        else:
+            app.db["index_watcher"].add_changes("campaign_index", skipped_campaign_dirs)
 
     app.db["campaign_index"] = campaign_index
 
     return app.db["campaign_index"]
 
 
-def load_annotations_from_file(file_path):
+def load_annotations_from_lines(file_path, lines, first_line_num=0):
     annotations_campaign = []
 
-    with open(file_path) as f:
-        for line in f:
+    for line_num, line in enumerate(lines, start=first_line_num):
+        try:
             annotation_records = load_annotations_from_record(line, jsonl_file=file_path)
             annotations_campaign.append(annotation_records[0])
+        except Exception as e:
+            logger.error(
+                f"Error parsing annotation file {file_path} at line {line_num + 1}:\n\t{e.__class__.__name__}: {e}"
+            )
 
     return annotations_campaign
 
@@ -219,6 +363,25 @@ def create_annotation_example_record(j, jsonl_file):
     }
 
 
+ANNOTATION_INDEX_COLS = [
+    "annotation_span_categories",
+    "annotator_id",
+    "annotator_group",
+    "annotation_granularity",
+    "annotation_overlap_allowed",
+    "campaign_id",
+    "dataset",
+    "example_idx",
+    "setup_id",
+    "split",
+    "flags",
+    "options",
+    "text_fields",
+    "jsonl_file",
+    "annotations",
+]
+
+
 def load_annotations_from_record(line, jsonl_file, split_spans=False):
     j = json.loads(line)
     annotation_records = []
@@ -239,12 +402,14 @@ def load_annotations_from_record(line, jsonl_file, split_spans=False):
     return annotation_records
 
 
-def get_annotation_files():
-    """Get dictionary of annotation JSONL files and their modification times"""
+def get_annotation_files(campaign_dirs=None):
+    """Get dictionary of annotation JSONL files and their states (modification time, size, inode)"""
     files_dict = {}
-    for jsonl_file in Path(CAMPAIGN_DIR).rglob("*.jsonl"):
-        campaign_dir = jsonl_file.parent.parent
 
+    if campaign_dirs is None:
+        campaign_dirs = [campaign_dir for campaign_dir in Path(CAMPAIGN_DIR).iterdir() if campaign_dir.is_dir()]
+
+    for campaign_dir in campaign_dirs:
         # find metadata for the campaign
         metadata_path = campaign_dir / "metadata.json"
         if not metadata_path.exists():
@@ -256,109 +421,123 @@ def get_annotation_files():
         if metadata["mode"] == CampaignMode.HIDDEN or metadata["mode"] == CampaignMode.LLM_GEN:
             continue
 
-        files_dict[str(jsonl_file)] = jsonl_file.stat().st_mtime
+        for jsonl_file in campaign_dir.glob("*/*.jsonl"):
+            files_dict[str(jsonl_file)] = get_file_state(jsonl_file)
 
     return files_dict
 
 
-def remove_annotations(app, file_path):
-    """Remove annotations from the annotation index for a specific file"""
-    if app.db["annotation_index"] is not None:
-        # Filter out annotations from the specified file
-        app.db["annotation_index"] = app.db["annotation_index"][app.db["annotation_index"]["jsonl_file"] != file_path]
+def get_annotation_index(app, force_reload=True):
+    return get_keyed_annotation_index(app, force_reload=force_reload).to_frame()
 
 
-def get_annotation_index(app, force_reload=True):
+def get_campaign_annotation_index(app, campaign_id, force_reload=True):
+    return get_keyed_annotation_index(app, force_reload=force_reload).get_campaign_frame(campaign_id)
+
+
+def get_keyed_annotation_index(app, force_reload=True):
     if app and app.db["annotation_index"] is not None and not force_reload:
         return app.db["annotation_index"]
 
     logger.debug("Reloading annotation index")
 
-    # Get current files and their modification times
-    current_files = get_annotation_files()
-    cached_files = app.db.get("annotation_index_cache", {})
-    new_annotations = []
-
-    # Handle modified files
-    for file_path, mod_time in current_files.items():
-        if file_path not in cached_files or cached_files[file_path] < mod_time:
-            remove_annotations(app, file_path)
-            new_annotations.extend(load_annotations_from_file(file_path))
-
-    # Handle deleted files
-    for file_path in set(cached_files.keys()) - set(current_files.keys()):
-        remove_annotations(app, file_path)
+    if app.db["annotation_index"] is None:
+        app.db["annotation_index"] = AnnotationIndex(ANNOTATION_INDEX_COLS)
+        app.db["annotation_index_snapshot"] = IndexSnapshot("annotation_index")
+        app.db["annotation_index_cache"] = app.db["annotation_index_snapshot"].load(app.db["annotation_index"])
 
-    # Update the cache
-    app.db["annotation_index_cache"] = current_files
+    changes = get_index_changes(app, "annotation_index")
+    cached_files = app.db.get("annotation_index_cache", {})
 
-    if app.db["annotation_index"] is None:
-        app.db["annotation_index"] = pd.DataFrame.from_records(new_annotations)
+    if changes is None:
+        current_files = get_annotation_files()
     else:
-        app.db["annotation_index"] = pd.concat([app.db["annotation_index"], pd.DataFrame.from_records(new_annotations)])
+        # only the files of the campaigns with changes need to be checked
+        current_files = {
+            file_path: state
+            for file_path, state in cached_files.items()
+            if Path(file_path).parent.parent not in changes
+        }
+        current_files.update(get_annotation_files(changes))
+
+    # parse the new and modified files, only the appended lines if possible
+    app.db["annotation_index_cache"] = refresh_index(
+        app.db["annotation_index"],
+        current_files=current_files,
+        cached_files=cached_files,
+        parse_lines=load_annotations_from_lines,
+    )
+    app.db["annotation_index_snapshot"].save(app.db["annotation_index"], app.db["annotation_index_cache"])
 
     return app.db["annotation_index"]
 
 
 def get_annotations(app, dataset_id, split, example_idx, setup_id):
-    annotation_index = get_annotation_index(app, force_reload=False)
+    annotation_index = get_keyed_annotation_index(app, force_reload=False)
 
-    if annotation_index.empty:
-        return []
+    return annotation_index.get(dataset_id, split, example_idx, setup_id)
 
-    annotations = annotation_index[
-        (annotation_index["dataset"] == dataset_id)
-        & (annotation_index["split"] == split)
-        & (annotation_index["example_idx"] == example_idx)
-        & (annotation_index["setup_id"] == setup_id)
-    ]
 
-    if annotations.empty:
-        return []
-
-    return annotations.to_dict(orient="records")
+def get_output_files(paths=None):
+    """Get dictionary of output JSONL and Parquet files (all or only the existing ones from `paths`) and their states"""
+    files_dict = {}
 
+    if paths is None:
+        paths = [
+            path for suffix in output_store.OUTPUT_FORMATS.values() for path in Path(OUTPUT_DIR).rglob(f"*{suffix}")
+        ]
 
-def get_output_files():
-    """Get dictionary of annotation JSONL files and their modification times"""
-    files_dict = {}
-    for jsonl_file in Path(OUTPUT_DIR).rglob("*.jsonl"):
-        files_dict[str(jsonl_file)] = jsonl_file.stat().st_mtime
+    for output_file in paths:
+        if output_file.is_file():
+            files_dict[str(output_file)] = get_file_state(output_file)
 
     return files_dict
 
 
-def load_outputs_from_file(file_path, cols):
+def load_outputs_from_lines(file_path, lines, cols, first_line_num=0):
     outputs = []
 
-    with open(file_path) as f:
-        for line_num, line in enumerate(f):
-            try:
-                j = json.loads(line)
+    for line_num, line in enumerate(lines, start=first_line_num):
+        try:
+            j = json.loads(line)
 
-                for key in ["dataset", "split", "setup_id"]:
-                    j[key] = slugify(j[key])
+            for key in ["dataset", "split", "setup_id"]:
+                j[key] = slugify(j[key])
 
-                # drop any keys that are not in the key set
-                j = {k: v for k, v in j.items() if k in cols}
-                j["jsonl_file"] = file_path
-                outputs.append(j)
-            except Exception as e:
-                logger.error(
-                    f"Error parsing output file {file_path} at line {line_num + 1}:\n\t{e.__class__.__name__}: {e}"
-                )
+            # drop any keys that are not in the key set
+            j = {k: v for k, v in j.items() if k in cols}
+            j["jsonl_file"] = file_path
+            outputs.append(j)
+        except Exception as e:
+            logger.error(
+                f"Error parsing output file {file_path} at line {line_num + 1}:\n\t{e.__class__.__name__}: {e}"
+            )
 
     return outputs
 
 
-def remove_outputs(app, file_path):
-    """Remove outputs from the output index for a specific file"""
-    if app.db["output_index"] is not None:
-        # Filter out outputs from the specified file
-        app.db["output_index"] = app.db["output_index"][app.db["output_index"]["jsonl_file"] != file_path]
+def load_outputs_from_parquet(file_path, cols):
+    try:
+        # only the columns needed for the index are read
+        outputs = output_store.read_parquet(file_path, columns=cols)
+    except Exception as e:
+        logger.error(f"Error reading output file {file_path}:\n\t{e.__class__.__name__}: {e}")
+        return []
+
+    for j in outputs:
+        for key in ["dataset", "split", "setup_id"]:
+            j[key] = slugify(j[key])
+
+        j["jsonl_file"] = file_path
+
+    return outputs
 
 
 def get_output_index(app, force_reload=True):
+    return get_keyed_output_index(app, force_reload=force_reload).to_frame()
+
+
+def get_keyed_output_index(app, force_reload=True):
     if hasattr(app, "db") and app.db["output_index"] is not None and not force_reload:
         return app.db["output_index"]
 
@@ -366,58 +545,64 @@ def get_output_index(app, force_reload=True):
 
     cols = ["dataset", "split", "setup_id", "example_idx", "output"]
 
-    current_outs = get_output_files()
-    cached_outs = app.db.get("output_index_cache", {})
-    new_outputs = []
-
-    # Handle modified files
-    for file_path, mod_time in current_outs.items():
-        if file_path not in cached_outs or cached_outs[file_path] < mod_time:
-            remove_outputs(app, file_path)
-            new_outputs.extend(load_outputs_from_file(file_path, cols))
-
-    # Handle deleted files
-    for file_path in set(cached_outs.keys()) - set(current_outs.keys()):
-        # Remove outputs for deleted files from the index
-        if app.db["output_index"] is not None:
-            remove_outputs(app, file_path)
-
-    # Update the cache
-    app.db["output_index_cache"] = current_outs
-
-    if new_outputs:
-        app.db["output_index"] = pd.concat([app.db["output_index"], pd.DataFrame.from_records(new_outputs)])
-    elif app.db["output_index"] is None:
-        app.db["output_index"] = pd.DataFrame(columns=cols)
-
-    # Hotfix to prevent duplicate outputs after some updates
-    # Probably a caching issue, should be fixed more properly
-    app.db["output_index"] = (
-        app.db["output_index"]
-        .drop_duplicates(subset=["dataset", "split", "setup_id", "example_idx"], keep="last")
-        .reset_index(drop=True)
+    if app.db["output_index"] is None:
+        app.db["output_index"] = OutputIndex(cols)
+        app.db["output_index_snapshot"] = IndexSnapshot("output_index")
+        app.db["output_index_cache"] = app.db["output_index_snapshot"].load(app.db["output_index"])
+
+    changes = get_index_changes(app, "output_index")
+    cached_files = app.db.get("output_index_cache", {})
+
+    if changes is None:
+        current_files = get_output_files()
+    else:
+        current_files = {
+            file_path: state for file_path, state in cached_files.items() if Path(file_path) not in changes
+        }
+        current_files.update(get_output_files(changes))
+
+    # parse the new and modified files, only the appended lines if possible
+    app.db["output_index_cache"] = refresh_index(
+        app.db["output_index"],
+        current_files=current_files,
+        cached_files=cached_files,
+        parse_lines=lambda file_path, lines, first_line_num: load_outputs_from_lines(
+            file_path, lines, cols, first_line_num
+        ),
+        load_file=lambda file_path: load_outputs_from_parquet(file_path, cols),
     )
+    app.db["output_index_snapshot"].save(app.db["output_index"], app.db["output_index_cache"])
 
     return app.db["output_index"]
 
 
-def export_campaign_outputs(campaign_id):
-    zip_buffer = BytesIO()
+def iter_dir_files(dir_path, exclude=()):
+    """Files in the directory (recursively) with their paths relative to the directory, except the excluded file names."""
+    for root, _dirs, files in os.walk(dir_path):
+        for file in files:
+            if any(fnmatch.fnmatch(file, pattern) for pattern in exclude):
+                continue
+
+            yield os.path.relpath(os.path.join(root, file), dir_path), os.path.join(root, file)
+
+
+def iter_campaign_export(campaign_id):
+    """Entries of the campaign archive (see `utils.iter_zip()`)."""
+    campaign_dir = os.path.join(CAMPAIGN_DIR, campaign_id)
 
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-        for root, _dirs, files in os.walk(os.path.join(CAMPAIGN_DIR, campaign_id)):
-            for file in files:
-                zip_file.write(
-                    os.path.join(root, file),
-                    os.path.relpath(os.path.join(root, file), os.path.join(CAMPAIGN_DIR, campaign_id)),
-                )
+    yield from iter_dir_files(campaign_dir, exclude=CAMPAIGN_EXPORT_EXCLUDE)
 
-    # Set response headers for download
+    # the db with the journals replayed (or read from SQLite), a copy of the db files could miss the latest changes
+    campaign = Campaign(campaign_id)
+
+    if not campaign.db.empty:
+        yield "db.csv", [campaign.db.to_csv(index=False).encode()]
+
+
+def export_campaign_outputs(campaign_id):
     timestamp = int(time.time())
-    response = make_response(zip_buffer.getvalue())
-    response.headers["Content-Type"] = "application/zip"
-    response.headers["Content-Disposition"] = f"attachment; filename={campaign_id}_{timestamp}.zip"
-    return response
+
+    return utils.zip_response(iter_campaign_export(campaign_id), filename=f"{campaign_id}_{timestamp}.zip")
 
 
 def get_local_dataset_overview(app):
@@ -432,7 +617,11 @@ def get_local_dataset_overview(app):
         description = dataset_config.get("description", "")
         splits = dataset_config.get("splits", [])
 
-        if is_enabled:
+        is_loading = is_enabled and is_dataset_loading(app, dataset_id)
+
+        if is_loading:
+            example_count = {}
+        elif is_enabled:
             dataset = app.db["datasets_obj"].get(dataset_id)
 
             if dataset is None:
@@ -453,6 +642,7 @@ def get_local_dataset_overview(app):
             "class": class_name,
             "params": params,
             "enabled": is_enabled,
+            "loading": is_loading,
             "splits": splits,
             "name": name,
             "description": description,
@@ -533,27 +723,17 @@ def delete_dataset(app, dataset_id):
 
     delete_model_outputs(dataset_id, None, None)
 
+    app.db["datasets_loading"].pop(dataset_id, None)
     app.db["datasets_obj"].pop(dataset_id, None)
 
+    cache = render_cache.get_cache()
 
-def export_dataset(app, dataset_id):
-    zip_buffer = BytesIO()
-    data_path = INPUT_DIR / dataset_id
-
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-        for root, dirs, files in os.walk(data_path):
-            for file in files:
-                zip_file.write(
-                    os.path.join(root, file),
-                    os.path.relpath(os.path.join(root, file), data_path),
-                )
+    if cache is not None:
+        cache.invalidate(dataset_id)
 
-    # Set response headers for download
-    response = make_response(zip_buffer.getvalue())
-    response.headers["Content-Type"] = "application/zip"
-    response.headers["Content-Disposition"] = f"attachment; filename={dataset_id}.zip"
 
-    return response
+def export_dataset(app, dataset_id):
+    return utils.zip_response(iter_dir_files(INPUT_DIR / dataset_id), filename=f"{dataset_id}.zip")
 
 
 def instantiate_dataset(dataset_id, dataset_config):
@@ -583,14 +763,90 @@ def instantiate_datasets():
     return datasets
 
 
+def load_datasets(app, workers=None):
+    """
+    Start loading the enabled datasets in a pool of worker processes.
+
+    Each dataset is moved to `app.db["datasets_obj"]` as soon as it is loaded. Until then, it is kept in
+    `app.db["datasets_loading"]` and served as loading, so that the app does not wait for the slowest dataset.
+    With `workers=0`, the datasets are loaded sequentially in this process.
+    """
+    config = utils.load_dataset_config()
+    enabled = {dataset_id: c for dataset_id, c in config.items() if c.get("enabled", True)}
+
+    if workers == 0 or len(enabled) <= 1:
+        app.db["datasets_obj"].update(instantiate_datasets())
+        return
+
+    # spawned: forking a process which already runs threads (logging, the event loop of the async requests, the render
+    # cache) can leave their locks held in the child
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers or os.cpu_count(), len(enabled)), mp_context=multiprocessing.get_context("spawn")
+    )
+
+    for dataset_id, dataset_config in enabled.items():
+        future = executor.submit(instantiate_dataset_in_worker, dataset_id, dataset_config)
+        app.db["datasets_loading"][dataset_id] = future
+        future.add_done_callback(lambda future, dataset_id=dataset_id: collect_loaded_dataset(app, dataset_id, future))
+
+    # the submitted datasets still get loaded, the worker processes exit afterwards
+    executor.shutdown(wait=False)
+
+
+def instantiate_dataset_in_worker(dataset_id, dataset_config):
+    # the errors of the dataset are returned as text, the exceptions from the future are the errors of the transfer
+    try:
+        return instantiate_dataset(dataset_id, dataset_config), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def collect_loaded_dataset(app, dataset_id, future):
+    # already collected, or disabled or deleted in the meantime
+    if app.db["datasets_loading"].get(dataset_id) is not future:
+        return
+
+    try:
+        dataset, error = future.result()
+
+        if error is not None:
+            logger.error(f"Error while loading dataset {dataset_id}\n{error}")
+    except Exception as e:
+        # e.g. a dataset which cannot be pickled or a crashed worker process
+        logger.warning(
+            f"Cannot load dataset {dataset_id} in a worker process ({e.__class__.__name__}: {e}), loading it here"
+        )
+        # outside of the lock, the other datasets are collected in the meantime
+        try:
+            dataset = instantiate_dataset(dataset_id, utils.load_dataset_config()[dataset_id])
+        except Exception as e:
+            logger.error(f"Error while loading dataset {dataset_id}")
+            traceback.print_exc()
+            dataset = None
+
+    with datasets_loading_lock:
+        if app.db["datasets_loading"].get(dataset_id) is not future:
+            return
+
+        if dataset is not None:
+            app.db["datasets_obj"][dataset_id] = dataset
+
+        app.db["datasets_loading"].pop(dataset_id, None)
+
+    if dataset is not None:
+        logger.info(f"Dataset {dataset_id} loaded")
+
+
 def set_dataset_enabled(app, dataset_id, enabled):
     config = utils.load_dataset_config()
     config[dataset_id]["enabled"] = enabled
 
     if enabled:
+        app.db["datasets_loading"].pop(dataset_id, None)
         dataset = instantiate_dataset(dataset_id, config[dataset_id])
         app.db["datasets_obj"][dataset_id] = dataset
     else:
+        app.db["datasets_loading"].pop(dataset_id, None)
         app.db["datasets_obj"].pop(dataset_id, None)
 
     utils.save_dataset_config(config)
@@ -660,6 +916,14 @@ def upload_dataset(app, dataset_id, dataset_name, dataset_description, dataset_f
 def delete_model_outputs(dataset, split=None, setup_id=None):
     path = Path(OUTPUT_DIR)
 
+    def is_deleted(j):
+        # None means all
+        return (
+            (j["dataset"] == dataset)
+            and (split is None or j["split"] == split)
+            and (setup_id is None or j["setup_id"] == setup_id)
+        )
+
     # look through all JSON files in the output directory
     for file in path.rglob("*.jsonl"):
         new_lines = []
@@ -668,12 +932,7 @@ def delete_model_outputs(dataset, split=None, setup_id=None):
             for line in f:
                 j = json.loads(line)
 
-                # None means all
-                if (
-                    (j["dataset"] == dataset)
-                    and (split is None or j["split"] == split)
-                    and (setup_id is None or j["setup_id"] == setup_id)
-                ):
+                if is_deleted(j):
                     # delete the line
                     continue
 
@@ -685,6 +944,19 @@ def delete_model_outputs(dataset, split=None, setup_id=None):
             with open(file, "w") as f:
                 f.writelines(new_lines)
 
+        mark_changed(file)
+
+    for file in path.rglob("*.parquet"):
+        records = output_store.read_parquet(file)
+        new_records = [j for j in records if not is_deleted(j)]
+
+        if len(new_records) == 0:
+            os.remove(file)
+        elif len(new_records) < len(records):
+            output_store.write_parquet(file, new_records)
+
+        mark_changed(file)
+
     # remove any empty directories in the output directory
     for directory in path.rglob("*"):
         if directory.is_dir() and not any(directory.iterdir()):
@@ -692,45 +964,33 @@ def delete_model_outputs(dataset, split=None, setup_id=None):
 
 
 def export_outputs(app, dataset_id, split, setup_id):
-    zip_buffer = BytesIO()
-
     # assemble relevant outputs
-    output_index = get_output_index(app)
+    output_index = get_keyed_output_index(app)
+    example_ids = output_index.get_example_ids(dataset_id, split, setup_id)
 
-    if output_index.empty:
+    if not example_ids:
         raise ValueError("No outputs found")
 
-    outputs = output_index[
-        (output_index["dataset"] == dataset_id)
-        & (output_index["split"] == split)
-        & (output_index["setup_id"] == setup_id)
-    ]
-    # write the outputs to a temporary JSONL file
-    tmp_file_path = tempfile.mktemp()
-
-    with open(tmp_file_path, "w") as f:
-        for _, row in outputs.iterrows():
-            j = row.to_dict()
-            f.write(json.dumps(j) + "\n")
-
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-        zip_file.write(
-            tmp_file_path,
-            f"{dataset_id}-{split}-{setup_id}.jsonl",
-        )
+    def iter_lines():
+        for example_idx in example_ids:
+            j = output_index.get(dataset_id, split, setup_id, example_idx)
 
-    # Set response headers for download
-    response = make_response(zip_buffer.getvalue())
-    response.headers["Content-Type"] = "application/zip"
-    response.headers["Content-Disposition"] = f"attachment; filename={dataset_id}_{split}_{setup_id}.zip"
+            if j is not None:
+                yield (json.dumps(j) + "\n").encode()
 
-    return response
+    return utils.zip_response(
+        [(f"{dataset_id}-{split}-{setup_id}.jsonl", iter_lines())],
+        filename=f"{dataset_id}_{split}_{setup_id}.zip",
+    )
 
 
 def get_available_data(app, datasets):
     data = []
 
     for dataset_id in datasets:
+        if datasets[dataset_id].get("loading"):
+            continue
+
         splits = datasets[dataset_id]["splits"]
 
         for split in splits:
@@ -771,53 +1031,24 @@ def get_model_outputs_overview(app, datasets):
 
 
 def get_output_for_setup(dataset, split, example_idx, setup_id, app=None, force_reload=True):
-    output_index = get_output_index(app=app, force_reload=force_reload)
-
-    if output_index.empty:
-        return None
+    output_index = get_keyed_output_index(app=app, force_reload=force_reload)
 
-    output = output_index[
-        (output_index["dataset"] == dataset)
-        & (output_index["split"] == split)
-        & (output_index["setup_id"] == setup_id)
-        & (output_index["example_idx"] == example_idx)
-    ]
-
-    if output.empty:
-        return None
-
-    return output.to_dict(orient="records")[0]
+    return output_index.get(dataset, split, setup_id, example_idx)
 
 
 def get_outputs(dataset_id, split, example_idx, app=None, force_reload=True):
-    outputs = get_output_index(app, force_reload=force_reload)
+    output_index = get_keyed_output_index(app, force_reload=force_reload)
 
-    if outputs.empty:
-        return []
-
-    outputs = outputs[
-        (outputs["dataset"] == dataset_id) & (outputs["split"] == split) & (outputs["example_idx"] == example_idx)
-    ]
-
-    outputs = outputs.to_dict(orient="records")
-
-    return outputs
+    return output_index.get_for_example(dataset_id, split, example_idx)
 
 
 def get_output_ids(app, dataset, split, setup_id):
-    output_index = get_output_index(app)
+    output_index = get_keyed_output_index(app)
 
-    if output_index.empty:
-        return []
-
-    output_ids = output_index[
-        (output_index["dataset"] == dataset) & (output_index["split"] == split) & (output_index["setup_id"] == setup_id)
-    ]["example_idx"].tolist()
-
-    return output_ids
+    return output_index.get_example_ids(dataset, split, setup_id)
 
 
-def upload_model_outputs(dataset, split, setup_id, model_outputs):
+def upload_model_outputs(dataset, split, setup_id, model_outputs, output_format="jsonl"):
     path = Path(OUTPUT_DIR) / dataset.id
     path.mkdir(parents=True, exist_ok=True)
 
@@ -829,16 +1060,21 @@ def upload_model_outputs(dataset, split, setup_id, model_outputs):
             f"Output count mismatch for {setup_id} in {split}: {len(generated)} vs {len(dataset.examples[split])}"
         )
 
-    with open(f"{path}/{split}-{setup_id}.jsonl", "w") as f:
-        for i, out in enumerate(generated):
-            j = {
-                "dataset": dataset.id,
-                "split": split,
-                "setup_id": setup_id,
-                "example_idx": i,
-                "output": out,
-            }
-            f.write(json.dumps(j) + "\n")
+    records = [
+        {
+            "dataset": dataset.id,
+            "split": split,
+            "setup_id": setup_id,
+            "example_idx": i,
+            "output": out,
+        }
+        for i, out in enumerate(generated)
+    ]
+    output_store.save_outputs(path / f"{split}-{setup_id}", records, output_format=output_format)
+
+    # the file in the other format may have been removed
+    for suffix in output_store.OUTPUT_FORMATS.values():
+        mark_changed(path / f"{split}-{setup_id}{suffix}")
 
     with open(f"{path.parent}/metadata.json", "w") as f:
         json.dump(
@@ -903,11 +1139,11 @@ def generate_default_id(app, mode, prefix):
 
 def refresh_indexes(app):
     # force reload the annotation and output index
-    get_annotation_index(app, force_reload=True)
-    get_output_index(app=app, force_reload=True)
+    get_keyed_annotation_index(app, force_reload=True)
+    get_keyed_output_index(app=app, force_reload=True)
 
 
-def save_record(mode, campaign, row, result):
+def save_record(mode, campaign, row, result, app=None):
     campaign_id = campaign.metadata["id"]
 
     save_dir = os.path.join(CAMPAIGN_DIR, campaign_id, "files")
@@ -961,8 +1197,40 @@ def save_record(mode, campaign, row, result):
     record["metadata"]["start_timestamp"] = row.get("start", int(time.time()))
     record["metadata"]["end_timestamp"] = row.get("end", int(time.time()))
 
+    # token usage and timing of the LLM call
+    if result.get("metrics"):
+        record["metadata"]["metrics"] = result["metrics"]
+
+    # each shard of a sharded run has its own file, the files are merged at the end of the run
+    if getattr(campaign, "shard", None) is not None:
+        filename = filename.removesuffix(".jsonl") + f"-shard{campaign.shard}.jsonl"
+
     # append the record to the file from the current run
     with open(os.path.join(save_dir, filename), "a") as f:
         f.write(json.dumps(record, allow_nan=True) + "\n")
 
+    mark_changed(os.path.join(save_dir, filename))
+
+    # the statistics of the annotation campaigns (`campaign_stats.py`) are kept up to date with the saved records
+    if app is not None and mode in [CampaignMode.LLM_EVAL, CampaignMode.CROWDSOURCING]:
+        # imported here: the campaign statistics depend on this module
+        import factgenie.campaign_stats as campaign_stats
+
+        campaign_stats.update_campaign_stats(app, campaign)
+
     return record
+
+
+def merge_shard_records(campaign):
+    """Append the records from the files of the individual shards to the files of the run."""
+    save_dir = os.path.join(CAMPAIGN_DIR, campaign.metadata["id"], "files")
+
+    for shard_path in sorted(Path(save_dir).glob("*-shard*.jsonl")):
+        target_path = shard_path.with_name(re.sub(r"-shard\d+\.jsonl$", ".jsonl", shard_path.name))
+
+        with open(shard_path) as f_in, open(target_path, "a") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+        os.remove(shard_path)
+        mark_changed(target_path)
+        mark_changed(shard_path)
@@ -17,8 +17,10 @@ install_requires = [
     "python-slugify>=8.0.4",
     "PyYAML>=6.0.2",
     "requests>=2.32.3",
+    "pyarrow>=14.0.0",
     "scipy>=1.14.1",
     "tinyhtml>=1.2.0",
+    "watchdog>=4.0.0",
     "litellm>=1.59.8",
     "pydantic>=2.10.6",
     "google-api-python-client>=2.16.0",
@@ -58,6 +60,9 @@ setup(
         "flask.commands": [
             "create_llm_campaign=factgenie.bin.run:create_llm_campaign",
             "run_llm_campaign=factgenie.bin.run:run_llm_campaign",
+            "migrate_campaign_db=factgenie.bin.run:migrate_campaign_db",
+            "convert_outputs=factgenie.bin.run:convert_outputs",
+            "worker=factgenie.bin.run:worker",
             "list=factgenie.bin.run:list_data",
             "info=factgenie.bin.run:info",
         ],
@@ -0,0 +1,323 @@
+"""
+Span and example statistics of the annotation campaigns.
+"""
+
+import json
+import threading
+import zipfile
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import factgenie.analysis as analysis
+import factgenie.campaign_stats as campaign_stats
+import factgenie.workflows as workflows
+from factgenie.indexes import AnnotationIndex
+
+ANNOTATIONS = [
+    [
+        {"type": 0, "start": 0, "text": "foo"},
+        {"type": 1, "start": 4, "text": "bar"},
+        {"type": 1, "start": 8, "text": ""},
+    ],
+    [],
+    [{"type": 5, "start": 0, "text": "out of range"}, {"type": None, "start": 1, "text": "x"}],
+    [{"type": 1, "start": 2, "text": "baz"}],
+]
+
+
+def test_example_and_span_index(monkeypatch):
+    index = AnnotationIndex(workflows.ANNOTATION_INDEX_COLS)
+
+    for example_idx, annotations in enumerate(ANNOTATIONS):
+        record = {col: "x" for col in workflows.ANNOTATION_INDEX_COLS}
+        record.update(
+            campaign_id="campaign",
+            dataset="dataset",
+            split="dev",
+            setup_id="setup",
+            example_idx=example_idx,
+            annotations=annotations,
+            flags=[{"label": "flag", "value": example_idx % 2 == 0}],
+            options=[],
+            text_fields=[],
+        )
+        index.add(record)
+
+    monkeypatch.setattr(workflows, "get_keyed_annotation_index", lambda app, force_reload=True: index)
+    app = SimpleNamespace(db={"span_tables": {}})
+    campaign = SimpleNamespace(campaign_id="campaign", metadata={"config": {"annotation_span_categories": [0, 1]}})
+
+    example_index = analysis.generate_example_index(app, campaign)
+    assert example_index["cat_0"].tolist() == [1, 0, 0, 0]
+    assert example_index["cat_1"].tolist() == [2, 0, 0, 1]
+
+    span_index = analysis.generate_span_index(app, campaign)
+    assert span_index["annotation_text"].tolist() == ["foo", "bar", "out of range", "baz"]
+    assert span_index["example_idx"].tolist() == [0, 0, 2, 3]
+
+
+def write_records(path, annotations, first_example_idx=0):
+    with open(path, "a") as f:
+        for example_idx, example_annotations in enumerate(annotations, start=first_example_idx):
+            record = {
+                "metadata": {"annotation_span_categories": [], "annotator_id": "a", "campaign_id": "campaign"},
+                "dataset": "dataset",
+                "split": "dev",
+                "setup_id": "setup",
+                "example_idx": example_idx,
+                "annotations": example_annotations,
+                "flags": [{"label": "flag", "value": example_idx % 2 == 0}],
+            }
+            f.write(json.dumps(record) + "\n")
+
+
+def test_campaign_statistics(tmp_path):
+    (tmp_path / "files").mkdir()
+    (tmp_path / "metadata.json").write_text(json.dumps({"mode": "crowdsourcing"}))
+    write_records(tmp_path / "files" / "annotations.jsonl", ANNOTATIONS[:2])
+
+    app = SimpleNamespace(db={"campaign_stats": {}, "lock": threading.Lock()})
+    campaign = SimpleNamespace(
+        campaign_id="campaign", dir=str(tmp_path), metadata={"config": {"annotation_span_categories": [0, 1]}}
+    )
+
+    statistics = analysis.compute_statistics(app, campaign)
+    assert [c["ann_count"] for c in statistics["ann_counts"]["full"]] == [1, 1]
+
+    # the records appended later are added to the saved counts
+    write_records(tmp_path / "files" / "annotations.jsonl", ANNOTATIONS[2:], first_example_idx=2)
+    app.db["campaign_stats"] = {}
+
+    statistics = analysis.compute_statistics(app, campaign)
+    assert statistics["ann_counts"]["full"] == [
+        {
+            "dataset": "dataset",
+            "split": "dev",
+            "setup_id": "setup",
+            "annotation_type": 0,
+            "ann_count": 1,
+            "example_count": 4,
+            "avg_count": 0.25,
+            "prevalence": 0.25,
+        },
+        {
+            "dataset": "dataset",
+            "split": "dev",
+            "setup_id": "setup",
+            "annotation_type": 1,
+            "ann_count": 2,
+            "example_count": 4,
+            "avg_count": 0.5,
+            "prevalence": 0.5,
+        },
+    ]
+    assert statistics["extra_fields"] == {"flag": {True: 2, False: 2}}
+
+    stats = json.loads((tmp_path / campaign_stats.STATS_FILE).read_text())
+    assert list(stats["file_cache"].values())[0]["line_num"] == 4
+
+
+def test_campaign_statistics_updated_on_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(workflows, "CAMPAIGN_DIR", tmp_path)
+    (tmp_path / "campaign").mkdir()
+    (tmp_path / "campaign" / "metadata.json").write_text(json.dumps({"mode": "llm_eval"}))
+
+    app = SimpleNamespace(db={"campaign_stats": {}, "lock": threading.Lock()})
+    campaign = SimpleNamespace(
+        campaign_id="campaign",
+        dir=str(tmp_path / "campaign"),
+        metadata={"id": "campaign", "last_run": 1, "config": {"annotation_span_categories": [0, 1]}},
+    )
+    row = {"dataset": "dataset", "split": "dev", "setup_id": "setup", "annotator_id": "model", "annotator_group": 0}
+
+    def line_num():
+        stats = json.loads((tmp_path / "campaign" / campaign_stats.STATS_FILE).read_text())
+        return list(stats["file_cache"].values())[0]["line_num"]
+
+    for example_idx, annotations in enumerate(ANNOTATIONS):
+        workflows.save_record(
+            mode=workflows.CampaignMode.LLM_EVAL,
+            campaign=campaign,
+            row={**row, "example_idx": example_idx},
+            result={"output": "output", "annotations": annotations, "prompt": "prompt"},
+            app=app,
+        )
+
+    # the counts are updated with every record, the file is written once per STATS_SAVE_INTERVAL
+    totals = app.db["campaign_stats"]["campaign"].get_totals()
+    assert totals.ann_counts == {("dataset", "dev", "setup", 0): 1, ("dataset", "dev", "setup", 1): 2}
+    assert line_num() == 1
+
+    campaign_stats.get_campaign_stats(app, campaign)
+    assert line_num() == 4
+
+
+def test_agreement_counts_and_correlations(monkeypatch):
+    rows = []
+
+    for group, offset in enumerate([0, 0, 1]):
+        for example_idx in range(4):
+            # the third group does not annotate the last example
+            if group == 2 and example_idx == 3:
+                continue
+
+            rows.append(
+                {
+                    "campaign_id": "campaign",
+                    "annotator_group": group,
+                    "dataset": "dataset",
+                    "split": "dev",
+                    "setup_id": "setup",
+                    "example_idx": example_idx,
+                    "cat_0": example_idx + offset,
+                    "cat_1": example_idx % 2,
+                }
+            )
+
+    monkeypatch.setattr(analysis, "generate_example_index", lambda app, campaign: pd.DataFrame(rows))
+    keys, counts, annotator_group_ids = analysis.prepare_example_index(
+        None, [("dataset", "dev", "setup")], ["campaign"], {"campaign": None}
+    )
+
+    assert keys["example_idx"].tolist() == [0, 1, 2]
+    assert annotator_group_ids == [f"campaign-anngroup-{group}" for group in range(3)]
+    assert counts[:, 2, 0].tolist() == [1, 2, 3]
+
+    dataset_level_counts, example_level_counts = analysis.compute_span_counts(keys, counts, annotator_group_ids)
+    assert len(example_level_counts) == 3 * 3 * 2
+    assert dataset_level_counts["count"].tolist() == [1.0, 1.0, 2.0, 1 / 3, 1 / 3, 1 / 3]
+
+    correlations = analysis.compute_correlations(counts, annotator_group_ids, level="example")
+    first_pair = correlations.iloc[:4].set_index("annotation_type")
+    assert first_pair.loc["0", ["pearson", "spearman", "kendall"]].tolist() == [1.0, 1.0, 1.0]
+    assert first_pair.loc["macro", "pearson"] == 1.0
+
+
+def test_agreement_counts_with_different_categories(monkeypatch):
+    example_indexes = {
+        campaign_id: pd.DataFrame(
+            {
+                "campaign_id": campaign_id,
+                "annotator_group": 0,
+                "dataset": "dataset",
+                "split": "dev",
+                "setup_id": "setup",
+                "example_idx": range(3),
+                **{f"cat_{i}": 1 for i in range(category_cnt)},
+            }
+        )
+        for campaign_id, category_cnt in [("campaign-1", 2), ("campaign-2", 3)]
+    }
+
+    monkeypatch.setattr(analysis, "generate_example_index", lambda app, campaign_id: example_indexes[campaign_id])
+    keys, counts, annotator_group_ids = analysis.prepare_example_index(
+        None,
+        [("dataset", "dev", "setup")],
+        list(example_indexes),
+        {campaign_id: campaign_id for campaign_id in example_indexes},
+    )
+
+    assert counts.shape == (3, 2, 3)
+    assert counts[:, 0, 2].tolist() == [0, 0, 0]
+
+    _, example_level_counts = analysis.compute_span_counts(keys, counts, annotator_group_ids)
+    assert example_level_counts["annotation_type"].tolist()[:3] == ["0", "1", "2"]
+
+
+def test_kendall_tau():
+    rng = np.random.default_rng(0)
+    x, y = rng.integers(0, 4, 200), rng.integers(0, 3, 200)
+    table = pd.crosstab(x, y).to_numpy().astype(float)
+
+    assert np.isclose(analysis.kendall_tau(table), stats.kendalltau(x, y).statistic)
+
+
+# spans far from the start of the text must not overflow the encoding of the spans
+@pytest.mark.parametrize("workers, offset", [(0, 0), (2, 0), (0, 4_000_000_000)])
+def test_span_agreement(workers, offset):
+    spans = [("g0", 0, 0, 5), ("g0", 0, 10, 15), ("g0", 1, 20, 22), ("g1", 0, 0, 5), ("g1", 0, 12, 18)]
+    span_index = pd.DataFrame(
+        [
+            {
+                "dataset": dataset,
+                "split": "dev",
+                "setup_id": "setup",
+                "example_idx": 0,
+                "annotator_group_id": group,
+                "annotation_type": annotation_type,
+                "annotation_start": offset + start,
+                "annotation_end": offset + end,
+            }
+            for dataset in ["dataset-1", "dataset-2"]
+            for group, annotation_type, start, end in spans
+        ]
+    )
+    keys = span_index[["dataset", "split", "setup_id", "example_idx"]].drop_duplicates()
+
+    agreement = analysis.compute_span_agreement(span_index, keys, ["g0", "g1"], category_cnt=2, workers=workers)
+    agreement = agreement.set_index(["dataset", "annotation_type"])
+
+    assert agreement.loc[
+        ("dataset-1", "0"), ["hard_matches", "soft_matches_1", "soft_matches_2", "chars_both"]
+    ].tolist() == [1, 2, 2, 8]
+    assert agreement.loc[("dataset-1", "0"), ["hard_f1", "soft_f1", "char_overlap"]].tolist() == [0.5, 1.0, 0.762]
+    assert agreement.loc[("dataset-1", "1"), "char_overlap"] == 0.0
+    assert agreement.loc[("all", "all"), "spans_1"] == 6
+
+
+def test_iaa_files_use_worker_pool(tmp_path, monkeypatch):
+    example_index = pd.DataFrame(
+        {
+            "campaign_id": "campaign",
+            "annotator_group": [0, 1] * 2,
+            "dataset": ["dataset-1"] * 2 + ["dataset-2"] * 2,
+            "split": "dev",
+            "setup_id": "setup",
+            "example_idx": 0,
+            "cat_0": 1,
+        }
+    )
+    span_index = example_index.drop(columns="cat_0").assign(
+        annotation_type=0,
+        annotation_start=0,
+        annotation_text="span",
+        **{
+            column: None
+            for column in [
+                "annotation_span_categories",
+                "annotator_id",
+                "annotation_granularity",
+                "annotation_overlap_allowed",
+                "flags",
+                "options",
+                "text_fields",
+                "jsonl_file",
+            ]
+        },
+    )
+    monkeypatch.setattr(analysis, "generate_example_index", lambda app, campaign: example_index)
+    monkeypatch.setattr(analysis, "generate_span_index", lambda app, campaign: span_index.copy())
+
+    pools = []
+
+    class ProcessPoolExecutor(analysis.ProcessPoolExecutor):
+        def __init__(self, max_workers, **kwargs):
+            pools.append(max_workers)
+            super().__init__(max_workers, **kwargs)
+
+    monkeypatch.setattr(analysis, "ProcessPoolExecutor", ProcessPoolExecutor)
+
+    app = SimpleNamespace(config={"agreement_workers": 2})
+    combinations = [{"dataset": dataset, "split": "dev", "setup_id": "setup"} for dataset in ["dataset-1", "dataset-2"]]
+    zip_path = analysis.generate_iaa_files(app, ["campaign"], combinations, {"campaign": None}, tmp_path)
+
+    assert pools == [2]
+
+    with zipfile.ZipFile(zip_path) as zip_file:
+        agreement = pd.read_csv(zip_file.open("span_agreement.csv"))
+
+    assert agreement[agreement["annotation_type"] == "all"]["hard_f1"].tolist() == [1.0, 1.0, 1.0]
@@ -0,0 +1,44 @@
+"""
+Asynchronous model calls (`async_requests`) driven from the campaign runner.
+"""
+
+import litellm
+
+import factgenie.llm_campaign as llm_campaign
+from factgenie.campaign import CampaignMode
+from factgenie.models import ModelFactory
+
+
+def test_async_requests_use_acompletion(monkeypatch):
+    calls = []
+
+    async def acompletion(**kwargs):
+        calls.append(kwargs)
+        return litellm.ModelResponse(
+            model="model", choices=[{"message": {"role": "assistant", "content": f"output {len(calls)}"}}]
+        )
+
+    def completion(**kwargs):
+        raise AssertionError("the blocking completion must not be called")
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    monkeypatch.setattr(litellm, "completion", completion)
+
+    config = {
+        "type": "openai",
+        "model": "model",
+        "prompt_template": "Describe {data}",
+        "system_msg": "",
+        "extra_args": {"use_cache": False, "async_requests": "True"},
+    }
+    model = ModelFactory.from_config(config, mode=CampaignMode.LLM_GEN)
+    assert llm_campaign.get_run_options(config)["async_requests"]
+
+    executor = llm_campaign.AsyncExecutor()
+    futures = [
+        executor.submit(llm_campaign.agenerate_result, CampaignMode.LLM_GEN, model, {"example": i}, None)
+        for i in range(3)
+    ]
+
+    assert sorted(future.result(timeout=10)["output"] for future in futures) == ["output 1", "output 2", "output 3"]
+    assert calls[0]["messages"][1]["content"].startswith("Describe {")
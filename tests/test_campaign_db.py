@@ -0,0 +1,236 @@
+"""
+Persistence of the campaign db: status changes are journaled and replayed after the process is killed.
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+import factgenie.campaign as campaign_module
+import factgenie.llm_campaign as llm_campaign
+import factgenie.workflows as workflows
+from factgenie.campaign import (
+    CallStats,
+    CampaignDBBackend,
+    CampaignMode,
+    CampaignStatus,
+    ExampleStatus,
+    LLMCampaignGen,
+)
+
+
+@pytest.fixture
+def campaign(tmp_path, monkeypatch):
+    monkeypatch.setattr(campaign_module, "CAMPAIGN_DIR", tmp_path)
+
+    campaign_dir = tmp_path / "test-campaign"
+    (campaign_dir / "files").mkdir(parents=True)
+
+    db = pd.DataFrame(
+        {
+            "dataset": "dataset",
+            "split": "dev",
+            "example_idx": range(10),
+            "setup_id": "test-campaign",
+            "annotator_id": "",
+            "annotator_group": 0,
+            "status": ExampleStatus.FREE,
+            "start": None,
+            "end": None,
+        }
+    )
+    db.to_csv(campaign_dir / "db.csv", index=False)
+
+    with open(campaign_dir / "metadata.json", "w") as f:
+        json.dump({"id": "test-campaign", "mode": CampaignMode.LLM_GEN, "status": CampaignStatus.IDLE, "config": {}}, f)
+
+    return LLMCampaignGen("test-campaign")
+
+
+def finish_row(campaign, db_idx):
+    campaign.db.loc[db_idx, "status"] = ExampleStatus.FINISHED
+    campaign.db.loc[db_idx, "annotator_id"] = "model"
+    campaign.db.loc[db_idx, "start"] = 1.0
+    campaign.db.loc[db_idx, "end"] = 2.0
+    campaign.update_db_rows([db_idx])
+
+
+def test_journal_is_replayed(campaign):
+    for i in range(3):
+        finish_row(campaign, i)
+
+    # db.csv was not rewritten yet, the changes are in the journal
+    assert (pd.read_csv(campaign.db_path)["status"] == ExampleStatus.FREE).all()
+
+    reloaded = LLMCampaignGen("test-campaign")
+    assert reloaded.get_stats()["finished"] == 3
+    assert reloaded.get_stats()["free"] == 7
+    assert reloaded.db.loc[0, "end"] == 2.0
+
+
+def test_incomplete_journal_line_is_skipped(campaign):
+    finish_row(campaign, 0)
+
+    # simulate a process killed while writing
+    with open(campaign.db_journal_path, "a") as f:
+        f.write('{"idx": 5, "sta')
+
+    reloaded = LLMCampaignGen("test-campaign")
+    assert reloaded.get_stats()["finished"] == 1
+
+    finish_row(reloaded, 6)
+    assert LLMCampaignGen("test-campaign").get_stats()["finished"] == 2
+
+
+def test_flush_compacts_journal(campaign):
+    for i in range(4):
+        finish_row(campaign, i)
+
+    campaign.flush_db()
+
+    assert not (campaign_module.CAMPAIGN_DIR / "test-campaign" / "db_journal.jsonl").exists()
+    assert (pd.read_csv(campaign.db_path)["status"] == ExampleStatus.FINISHED).sum() == 4
+
+
+def test_shard_journals(campaign):
+    shards = [LLMCampaignGen("test-campaign") for _ in range(2)]
+
+    for shard, shard_campaign in enumerate(shards):
+        shard_campaign.set_shard(shard)
+        finish_row(shard_campaign, shard)
+        # only the main process compacts the journals
+        shard_campaign.flush_db()
+
+    assert (pd.read_csv(campaign.db_path)["status"] == ExampleStatus.FREE).all()
+
+    campaign.load_db()
+    assert campaign.get_stats()["finished"] == 2
+
+    campaign.flush_db()
+    assert campaign.get_db_journal_paths() == []
+    assert (pd.read_csv(campaign.db_path)["status"] == ExampleStatus.FINISHED).sum() == 2
+
+
+def test_call_stats(campaign):
+    campaign.metadata["last_run"] = 100
+    campaign.call_stats = CallStats()
+
+    for i, latency in enumerate([1.0, 2.0, 3.0]):
+        metrics = {"prompt_tokens": 10, "completion_tokens": 5, "latency": latency, "cost": 0.5, "retries": i}
+        campaign.add_call_metrics({"metadata": {"metrics": metrics, "end_timestamp": 110 + i}})
+
+    # cached responses do not count towards the latency
+    metrics = {"prompt_tokens": 10, "completion_tokens": 5, "latency": 0.0, "cost": 0, "cached": True}
+    campaign.add_call_metrics({"metadata": {"metrics": metrics, "end_timestamp": 120}})
+
+    stats = campaign.get_stats()
+    assert stats["prompt_tokens"] == 40
+    assert stats["completion_tokens"] == 20
+    assert stats["cost"] == 1.5
+    assert stats["retries"] == 3
+    assert stats["latency_p50"] == 2.0
+    assert stats["tokens_per_s"] == 1.0
+    assert stats["examples_per_min"] == 12.0
+
+
+def test_call_stats_latency_sample(monkeypatch):
+    monkeypatch.setattr(CallStats, "LATENCY_SAMPLE_SIZE", 10)
+    call_stats = CallStats()
+
+    for i in range(1000):
+        call_stats.add({"latency": float(i % 100), "completion_tokens": 1}, end=i)
+
+    assert len(call_stats.latencies) == 10
+    assert 0.0 <= call_stats.get_latency_quantile(0.5) <= 99.0
+
+    # the throughput of a new run counts only its calls
+    call_stats.set_run_start(900)
+    assert call_stats.run == {"cnt": 100, "end": 999, "completion_tokens": 100}
+
+
+def test_migrate_to_sqlite(campaign):
+    finish_row(campaign, 0)
+
+    assert campaign.migrate_db_to_sqlite()
+    assert campaign.get_db_backend() == CampaignDBBackend.SQLITE
+
+    finish_row(campaign, 1)
+
+    reloaded = LLMCampaignGen("test-campaign")
+    assert reloaded.get_db_backend() == CampaignDBBackend.SQLITE
+    assert reloaded.get_stats()["finished"] == 2
+    assert reloaded.get_stats()["free"] == 8
+    assert reloaded.db.loc[1, "annotator_id"] == "model"
+
+
+def test_sqlite_db_updated_in_place(campaign):
+    campaign.migrate_db_to_sqlite()
+    assert not (campaign_module.CAMPAIGN_DIR / "test-campaign" / "db.csv").exists()
+
+    conn = campaign.sqlite_db.connect()
+    try:
+        finish_row(campaign, 0)
+        campaign.clear_all_outputs()
+
+        # the connection opened before the rewrite sees the new contents
+        statuses = [row[0] for row in conn.execute("SELECT status FROM db")]
+        assert statuses == [ExampleStatus.FREE] * 10
+    finally:
+        conn.close()
+
+    campaign.db.loc[[1, 2], "status"] = ExampleStatus.ASSIGNED
+    campaign.db.loc[[1, 2], "start"] = [100.0, 200.0]
+    campaign.update_db_rows([1, 2])
+
+    assert campaign.sqlite_db.free_idle_rows(assigned_before=150.0) == [1]
+    assert LLMCampaignGen("test-campaign").db["status"].tolist()[:3] == [
+        ExampleStatus.FREE,
+        ExampleStatus.FREE,
+        ExampleStatus.ASSIGNED,
+    ]
+
+
+def test_cleared_outputs_reported_to_watcher(campaign, monkeypatch):
+    changed = []
+    monkeypatch.setattr(workflows, "mark_changed", lambda path, is_directory=False: changed.append(str(path)))
+
+    jsonl_file = campaign_module.CAMPAIGN_DIR / "test-campaign" / "files" / "run.jsonl"
+    records = [
+        {"dataset": "dataset", "split": "dev", "setup_id": "test-campaign", "example_idx": i, "metadata": {}}
+        for i in range(2)
+    ]
+    jsonl_file.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+    finish_row(campaign, 0)
+    campaign.clear_output_by_idx(0)
+    assert changed == [str(jsonl_file)]
+    assert [json.loads(line)["example_idx"] for line in jsonl_file.read_text().splitlines()] == [1]
+
+    campaign.clear_all_outputs()
+    assert changed == [str(jsonl_file)] * 2
+    assert not jsonl_file.exists()
+
+
+def test_overview_during_run(campaign, monkeypatch):
+    monkeypatch.setattr(workflows, "CAMPAIGN_DIR", campaign_module.CAMPAIGN_DIR)
+    monkeypatch.setattr(LLMCampaignGen, "DB_FLUSH_EVERY", 3)
+    campaign.metadata["config"]["model"] = "model"
+    campaign.call_stats = CallStats()
+
+    def generate_result(mode, model, example, generated_output, submitted=None):
+        # the campaign detail page reloads the db while the campaign is running
+        campaign.get_overview()
+        return {"output": "output", "prompt": "prompt", "metrics": {}}
+
+    monkeypatch.setattr(llm_campaign, "get_example_inputs", lambda app, mode, datasets, row: ({}, None))
+    monkeypatch.setattr(llm_campaign, "generate_result", generate_result)
+
+    error = llm_campaign.process_examples(
+        None, CampaignMode.LLM_GEN, "test-campaign", None, campaign, {}, None, {"test-campaign"}, list(range(10))
+    )
+    assert error is None
+
+    campaign.flush_db()
+    assert (pd.read_csv(campaign.db_path)["status"] == ExampleStatus.FINISHED).all()
+    assert LLMCampaignGen("test-campaign").get_stats()["finished"] == 10
@@ -0,0 +1,66 @@
+"""
+Loading the datasets in worker processes at startup.
+"""
+
+import json
+import shutil
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import factgenie.utils as utils
+import factgenie.workflows as workflows
+from factgenie import INPUT_DIR
+
+
+@pytest.fixture
+def dataset_config(monkeypatch):
+    config = {}
+
+    for i in range(3):
+        dataset_id = f"test-loading-{uuid.uuid4().hex[:8]}"
+        (INPUT_DIR / dataset_id).mkdir(parents=True)
+        (INPUT_DIR / dataset_id / "dev.jsonl").write_text("".join(json.dumps({"i": j}) + "\n" for j in range(i + 1)))
+        config[dataset_id] = {"class": "basic.JSONLDataset", "splits": ["dev"], "enabled": True}
+
+    # enabled, but with no data
+    config[f"test-loading-{uuid.uuid4().hex[:8]}"] = {"class": "basic.JSONLDataset", "splits": ["dev"]}
+    monkeypatch.setattr(utils, "load_dataset_config", lambda: config)
+
+    yield config
+
+    for dataset_id in config:
+        shutil.rmtree(INPUT_DIR / dataset_id, ignore_errors=True)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_load_datasets(dataset_config, workers):
+    app = SimpleNamespace(db={"datasets_obj": {}, "datasets_loading": {}})
+
+    workflows.load_datasets(app, workers=workers)
+    datasets = workflows.get_datasets(app)
+
+    assert not app.db["datasets_loading"]
+    # the dataset without data is left out
+    assert set(datasets.keys()) == set(list(dataset_config.keys())[:3])
+
+    for i, dataset_id in enumerate(dataset_config.keys()):
+        if dataset_id in datasets:
+            assert datasets[dataset_id].get_example_count("dev") == i + 1
+
+
+def test_loading_dataset_overview(dataset_config):
+    app = SimpleNamespace(db={"datasets_obj": {}, "datasets_loading": {}})
+    dataset_id = next(iter(dataset_config))
+
+    # a dataset still being loaded is not loaded again by the overview
+    app.db["datasets_loading"] = {dataset_id: SimpleNamespace()}
+    overview = workflows.get_local_dataset_overview(app)
+
+    assert overview[dataset_id]["loading"]
+    assert overview[dataset_id]["example_count"] == {}
+    assert dataset_id not in app.db["datasets_obj"]
+
+    with pytest.raises(ValueError, match="still loading"):
+        workflows.get_example_data(app, dataset_id, "dev", 0)
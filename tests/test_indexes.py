@@ -0,0 +1,281 @@
+"""
+Keyed indexes of model outputs and annotations.
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from factgenie.indexes import (
+    AnnotationIndex,
+    IndexSnapshot,
+    OutputIndex,
+    get_file_state,
+    refresh_index,
+)
+from factgenie.watcher import IndexWatcher, notify_change
+from factgenie.workflows import ANNOTATION_INDEX_COLS
+
+COLS = ["dataset", "split", "setup_id", "example_idx", "output"]
+
+
+def output(setup_id, example_idx, text, jsonl_file="a.jsonl"):
+    return {
+        "dataset": "dataset",
+        "split": "dev",
+        "setup_id": setup_id,
+        "example_idx": example_idx,
+        "output": text,
+        "jsonl_file": jsonl_file,
+    }
+
+
+def test_output_index_lookup():
+    index = OutputIndex(COLS)
+
+    for example_idx in range(3):
+        index.add(output("setup-a", example_idx, f"a{example_idx}"))
+        index.add(output("setup-b", example_idx, f"b{example_idx}", jsonl_file="b.jsonl"))
+
+    assert index.get("dataset", "dev", "setup-a", 1)["output"] == "a1"
+    assert index.get("dataset", "dev", "setup-c", 1) is None
+    assert [o["setup_id"] for o in index.get_for_example("dataset", "dev", 2)] == ["setup-a", "setup-b"]
+    assert index.get_example_ids("dataset", "dev", "setup-b") == [0, 1, 2]
+
+    # the returned records can be modified without changing the index
+    index.get("dataset", "dev", "setup-a", 1)["annotations"] = []
+    assert "annotations" not in index.get("dataset", "dev", "setup-a", 1)
+
+    # a duplicate record replaces the previous one
+    index.add(output("setup-a", 1, "a1-new"))
+    assert index.get("dataset", "dev", "setup-a", 1)["output"] == "a1-new"
+    assert len(index) == 6
+
+    index.remove_file("b.jsonl")
+    assert index.get_example_ids("dataset", "dev", "setup-b") == []
+    assert len(index.get_for_example("dataset", "dev", 0)) == 1
+    assert sorted(index.to_frame()["output"]) == ["a0", "a1-new", "a2"]
+
+
+def test_output_index_falls_back_to_other_files(tmp_path):
+    index = OutputIndex(COLS)
+    index.add(output("setup-a", 0, "a0"))
+    index.add(output("setup-a", 1, "a1"))
+    index.add(output("setup-a", 0, "a0-new", jsonl_file="b.jsonl"))
+    index.add(output("setup-a", 1, "a1-c", jsonl_file="c.jsonl"))
+
+    # removing a file with a replaced record keeps the record from the later file
+    index.remove_file("a.jsonl")
+    assert index.get("dataset", "dev", "setup-a", 0)["output"] == "a0-new"
+
+    index.add(output("setup-a", 0, "a0"))
+    assert index.get("dataset", "dev", "setup-a", 0)["output"] == "a0"
+
+    # the records replaced by another file are kept in the snapshot
+    snapshot = IndexSnapshot("output_index", snapshot_dir=tmp_path)
+    snapshot.save(index, {})
+    index = OutputIndex(COLS)
+    snapshot.load(index)
+
+    # the record from the previous file is used again after the file with the later record is removed
+    index.remove_file("a.jsonl")
+    index.remove_file("c.jsonl")
+    assert index.get("dataset", "dev", "setup-a", 0)["output"] == "a0-new"
+    assert index.get("dataset", "dev", "setup-a", 1) is None
+    assert index.get_for_example("dataset", "dev", 0)[0]["jsonl_file"] == "b.jsonl"
+    assert index.to_frame()["output"].tolist() == ["a0-new"]
+    assert len(index) == 1
+
+
+def annotation(campaign_id, example_idx, jsonl_file):
+    record = {col: None for col in ANNOTATION_INDEX_COLS}
+    record.update(
+        {
+            "campaign_id": campaign_id,
+            "dataset": "dataset",
+            "split": "dev",
+            "setup_id": "setup-a",
+            "example_idx": example_idx,
+            "annotations": [{"type": 0, "start": 0, "text": "x"}],
+            "jsonl_file": jsonl_file,
+        }
+    )
+    return record
+
+
+def test_annotation_index_lookup():
+    index = AnnotationIndex(ANNOTATION_INDEX_COLS)
+
+    for example_idx in range(3):
+        index.add(annotation("campaign-1", example_idx, "c1.jsonl"))
+        index.add(annotation("campaign-2", example_idx, "c2.jsonl"))
+
+    assert len(index.get("dataset", "dev", 1, "setup-a")) == 2
+    assert index.get("dataset", "dev", 1, "setup-b") == []
+    assert len(index.get_campaign_frame("campaign-1")) == 3
+    assert list(index.get_campaign_frame("campaign-3").columns) == ANNOTATION_INDEX_COLS
+
+    index.remove_file("c1.jsonl")
+    assert [a["campaign_id"] for a in index.get("dataset", "dev", 1, "setup-a")] == ["campaign-2"]
+    assert index.get_campaign_frame("campaign-1").empty
+    assert len(index.to_frame()) == 3
+
+
+def test_refresh_index_parses_appended_lines(tmp_path):
+    path = tmp_path / "outputs.jsonl"
+    file_path = str(path)
+    index = OutputIndex(COLS)
+    parsed = []
+
+    def parse_lines(file_path, lines, first_line_num):
+        parsed.extend(lines)
+        return [{**json.loads(line), "jsonl_file": file_path} for line in lines]
+
+    def write(mode, outputs):
+        with open(path, mode) as f:
+            f.write("".join(json.dumps(o) + "\n" for o in outputs))
+
+    def refresh(cache):
+        parsed.clear()
+        return refresh_index(index, {file_path: get_file_state(file_path)}, cache, parse_lines)
+
+    write("w", [output("setup-a", i, f"a{i}") for i in range(3)])
+    cache = refresh({})
+    assert len(parsed) == 3
+
+    # an incomplete line is left for the next refresh
+    line = json.dumps(output("setup-a", 3, "a3")) + "\n"
+    with open(path, "a") as f:
+        f.write(line[:10])
+    cache = refresh(cache)
+    assert parsed == []
+
+    with open(path, "a") as f:
+        f.write(line[10:])
+    write("a", [output("setup-a", 4, "a4")])
+    cache = refresh(cache)
+    assert len(parsed) == 2
+    assert index.get_example_ids("dataset", "dev", "setup-a") == [0, 1, 2, 3, 4]
+
+    # a rewritten file is parsed again from the start
+    write("w", [output("setup-b", i, f"b{i}") for i in range(2)])
+    cache = refresh(cache)
+    assert len(parsed) == 2
+    assert index.get_example_ids("dataset", "dev", "setup-a") == []
+    assert index.get_example_ids("dataset", "dev", "setup-b") == [0, 1]
+
+    cache = refresh_index(index, {}, cache, parse_lines)
+    assert len(index) == 0
+
+
+def wait_for_changes(watcher, index, timeout=5):
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        if watcher.changes[index]:
+            return watcher.pop_changes(index)
+        time.sleep(0.1)
+
+    return watcher.pop_changes(index)
+
+
+@pytest.mark.parametrize("mode", ["native", "polling"])
+def test_watcher_reports_changed_files(tmp_path, mode):
+    campaign_dir, output_dir = tmp_path / "campaigns", tmp_path / "outputs"
+    (campaign_dir / "campaign-1" / "files").mkdir(parents=True)
+    output_dir.mkdir()
+
+    watcher = IndexWatcher(campaign_dir=campaign_dir, output_dir=output_dir)
+    assert watcher.start(mode=mode)
+
+    try:
+        # the first refresh of each index is a full scan
+        assert watcher.pop_changes("output_index") is None
+        assert watcher.pop_changes("annotation_index") is None
+        assert watcher.pop_changes("campaign_index") is None
+
+        (output_dir / "setup.jsonl").write_text("{}\n")
+        (campaign_dir / "campaign-1" / "files" / "annotations.jsonl").write_text("{}\n")
+
+        assert wait_for_changes(watcher, "output_index") == {output_dir / "setup.jsonl"}
+        assert wait_for_changes(watcher, "annotation_index") == {campaign_dir / "campaign-1"}
+        assert wait_for_changes(watcher, "campaign_index") == {campaign_dir / "campaign-1"}
+
+        # the db of the campaign is not a part of the annotation index
+        (campaign_dir / "campaign-1" / "db.csv").write_text("")
+        assert wait_for_changes(watcher, "campaign_index") == {campaign_dir / "campaign-1"}
+        assert watcher.pop_changes("annotation_index") == set()
+    finally:
+        watcher.stop()
+
+    assert watcher.pop_changes("output_index") is None
+
+
+def test_watcher_notified_by_the_app(tmp_path):
+    campaign_dir, output_dir = tmp_path / "campaigns", tmp_path / "outputs"
+    campaign_dir.mkdir()
+    output_dir.mkdir()
+
+    watcher = IndexWatcher(campaign_dir=campaign_dir, output_dir=output_dir)
+    assert watcher.start(mode="polling")
+
+    try:
+        watcher.pop_changes("campaign_index")
+        (campaign_dir / "campaign-1").mkdir()
+
+        # a path written by the app is seen right away, without waiting for the event
+        notify_change(campaign_dir / "campaign-1", is_directory=True)
+        assert watcher.pop_changes("campaign_index") == {campaign_dir / "campaign-1"}
+    finally:
+        watcher.stop()
+
+
+def test_index_snapshot(tmp_path):
+    path = tmp_path / "annotations.jsonl"
+    path.write_text("{}\n" * 3)
+    file_path = str(path)
+
+    def parse_lines(file_path, lines, first_line_num):
+        return [annotation("campaign-1", first_line_num + i, file_path) for i in range(len(lines))]
+
+    index = AnnotationIndex(ANNOTATION_INDEX_COLS)
+    cache = refresh_index(index, {file_path: get_file_state(file_path)}, {}, parse_lines)
+    IndexSnapshot("annotation_index", snapshot_dir=tmp_path / "snapshot").save(index, cache)
+
+    loaded_index = AnnotationIndex(ANNOTATION_INDEX_COLS)
+    loaded_cache = IndexSnapshot("annotation_index", snapshot_dir=tmp_path / "snapshot").load(loaded_index)
+
+    assert loaded_cache == cache
+    assert loaded_index.get("dataset", "dev", 2, "setup-a") == index.get("dataset", "dev", 2, "setup-a")
+    assert loaded_index.get("dataset", "dev", 2, "setup-a")[0]["annotations"][0]["text"] == "x"
+
+    # only the appended line is parsed after the load
+    with open(path, "a") as f:
+        f.write("{}\n")
+
+    refresh_index(loaded_index, {file_path: get_file_state(file_path)}, loaded_cache, parse_lines)
+    assert len(loaded_index) == 4
+    assert len(loaded_index.get("dataset", "dev", 3, "setup-a")) == 1
+
+
+def test_index_snapshot_keeps_newer_records(tmp_path):
+    snapshot_dir = tmp_path / "snapshot"
+    index = AnnotationIndex(ANNOTATION_INDEX_COLS)
+    index.add(annotation("campaign-1", 0, "annotations.jsonl"))
+
+    IndexSnapshot("annotation_index", snapshot_dir=snapshot_dir).save(index, {})
+    (first_records,) = snapshot_dir.glob("annotation_index-*.parquet")
+
+    # records of a snapshot which another process is saving at the same time
+    newer_records = snapshot_dir / "annotation_index-newer.parquet"
+    newer_records.write_bytes(first_records.read_bytes())
+    os.utime(newer_records, (time.time() + 60, time.time() + 60))
+    os.utime(first_records, (time.time() - 60, time.time() - 60))
+
+    IndexSnapshot("annotation_index", snapshot_dir=snapshot_dir).save(index, {})
+
+    assert not first_records.exists()
+    assert newer_records.exists()
+    assert len(list(snapshot_dir.glob("annotation_index-*.parquet"))) == 2
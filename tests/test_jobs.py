@@ -0,0 +1,77 @@
+"""
+File-based job queue for running LLM campaigns in worker processes.
+"""
+
+import os
+import time
+
+import pytest
+
+import factgenie.jobs as jobs
+
+
+@pytest.fixture(autouse=True)
+def job_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "CAMPAIGN_DIR", tmp_path / "campaigns")
+    monkeypatch.setattr(jobs, "QUEUED_DIR", tmp_path / "jobs" / "queued")
+    monkeypatch.setattr(jobs, "RUNNING_DIR", tmp_path / "jobs" / "running")
+
+    for campaign_id in ["c1", "c2"]:
+        (tmp_path / "campaigns" / campaign_id).mkdir(parents=True)
+
+
+def test_jobs_are_claimed_once_in_order():
+    first = jobs.enqueue_campaign("c1", "llm_gen")
+    jobs.enqueue_campaign("c2", "llm_eval")
+
+    # enqueuing a campaign twice returns the existing job
+    assert jobs.enqueue_campaign("c1", "llm_gen")["id"] == first["id"]
+
+    assert jobs.claim_job("w1")["campaign_id"] == "c1"
+    assert jobs.claim_job("w2")["campaign_id"] == "c2"
+    assert jobs.claim_job("w3") is None
+
+    assert jobs.is_campaign_active("c1")
+    jobs.finish_job(first)
+    assert not jobs.is_campaign_active("c1")
+
+
+def test_pause_and_stale_jobs():
+    job = jobs.enqueue_campaign("c1", "llm_gen")
+    jobs.claim_job("w1")
+
+    running_campaigns = jobs.RunningCampaigns()
+    running_campaigns.add("c1")
+    assert "c1" in running_campaigns
+
+    jobs.pause_campaign("c1")
+    assert "c1" not in running_campaigns
+
+    # running the campaign again before the worker stopped resumes the job
+    assert jobs.enqueue_campaign("c1", "llm_gen")["id"] == job["id"]
+    assert "c1" in running_campaigns
+
+    # a worker which stopped sending heartbeats loses the job
+    path = jobs.RUNNING_DIR / f"{job['id']}.json"
+    os.utime(path, (time.time() - 1000, time.time() - 1000))
+    jobs.requeue_stale_jobs(timeout=60)
+
+    assert jobs.claim_job("w2")["id"] == job["id"]
+
+
+def test_progress_relay():
+    class Announcer:
+        messages = []
+
+        def announce(self, msg):
+            self.messages.append(msg)
+
+    job = jobs.enqueue_campaign("c1", "llm_gen")
+    worker_announcer = jobs.FileAnnouncer("c1")
+    worker_announcer.announce("data: 1\n\n")
+    worker_announcer.announce("data: 2\n\n")
+    jobs.finish_job(jobs.claim_job("w1"))
+
+    jobs.relay_progress("c1", Announcer(), poll_interval=0)
+
+    assert Announcer.messages == ["data: 1\n\n", "data: 2\n\n"]
@@ -0,0 +1,107 @@
+"""
+Lazy loading of the basic dataset formats: the examples read on demand are the same as the eagerly loaded ones.
+"""
+
+import json
+import pickle
+
+import pandas as pd
+import pytest
+
+import factgenie.datasets.basic as basic
+import factgenie.datasets.dataset as dataset_module
+
+EXAMPLES = [{"idx": i, "text": 'brackets [%d] { and "quotes" \\' % i, "list": [1, {"x": "]"}]} for i in range(20)]
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_module, "INPUT_DIR", tmp_path)
+    # small chunks to test the examples crossing the chunk boundaries
+    monkeypatch.setattr(dataset_module, "INDEX_CHUNK_SIZE", 16)
+    monkeypatch.setattr(basic, "INDEX_CHUNK_SIZE", 16)
+    monkeypatch.setattr(basic, "CSV_DTYPE_CHUNK_ROWS", 2)
+
+    data_dir = tmp_path / "dataset"
+    data_dir.mkdir()
+
+    (data_dir / "dev.jsonl").write_text("".join(json.dumps(e) + "\n" for e in EXAMPLES))
+    (data_dir / "dev.json").write_text(json.dumps(EXAMPLES, indent=2))
+    (data_dir / "dev.txt").write_text("".join(f"line {i}\n" for i in range(20)) + "last line without a newline")
+    pd.DataFrame({"idx": range(4), "text": ["plain", "multi\nline", 'comma, quote"', None]}).to_csv(
+        data_dir / "dev.csv", index=False
+    )
+
+    return data_dir
+
+
+@pytest.mark.parametrize(
+    "dataset_class", [basic.JSONLDataset, basic.JSONDataset, basic.PlainTextDataset, basic.CSVDataset]
+)
+def test_lazy_examples_match_eager(data_dir, dataset_class):
+    eager = dataset_class("dataset", splits=["dev"])
+    lazy = dataset_class("dataset", splits=["dev"], lazy=True)
+
+    assert lazy.lazy
+    assert isinstance(lazy.examples["dev"], dataset_module.LazyExamples)
+    assert lazy.get_example_count("dev") == eager.get_example_count("dev")
+
+    for i in range(eager.get_example_count("dev")):
+        assert str(lazy.get_example("dev", i)) == str(eager.get_example("dev", i))
+
+    # the lazy examples can be sent to other processes
+    unpickled = pickle.loads(pickle.dumps(lazy))
+    assert str(unpickled.get_example("dev", -1)) == str(eager.get_example("dev", -1))
+
+
+def test_lazy_loading_falls_back_to_eager(data_dir):
+    class PostprocessedDataset(basic.JSONLDataset):
+        def postprocess_data(self, examples):
+            return [e["text"] for e in examples]
+
+    dataset = PostprocessedDataset("dataset", splits=["dev"], lazy=True)
+
+    assert not dataset.lazy
+    assert dataset.get_example("dev", 0) == EXAMPLES[0]["text"]
+
+
+@pytest.mark.parametrize("examples", [["a", "b"], ["a"], [1, {"x": 2}], {"x": [{"a": 1}, {"b": 2}]}, []])
+def test_lazy_json_without_elements_to_index(data_dir, examples):
+    (data_dir / "dev.json").write_text(json.dumps(examples))
+
+    dataset = basic.JSONDataset("dataset", splits=["dev"], lazy=True)
+
+    assert list(dataset.examples["dev"]) == list(examples)
+
+
+def test_lazy_csv_column_types(data_dir):
+    # the types differ between the rows: integers with a missing value, integers with a float, numbers with strings
+    pd.DataFrame(
+        {
+            "missing": [1, 2, 3, None, 5],
+            "float": ["1", "2", "3", "4", "5.5"],
+            "mixed": ["1", "2", "x", "4", "5"],
+            "bool": [True, None, False, True, True],
+        }
+    ).to_csv(data_dir / "dev.csv", index=False)
+
+    eager = basic.CSVDataset("dataset", splits=["dev"])
+    lazy = basic.CSVDataset("dataset", splits=["dev"], lazy=True)
+
+    for i in range(5):
+        assert str(lazy.get_example("dev", i)) == str(eager.get_example("dev", i))
+
+    assert lazy.get_example("dev", 0)["float"] == 1.0
+    assert lazy.get_example("dev", 0)["mixed"] == "1"
+
+
+def test_dataset_without_lazy_loading(data_dir):
+    class CustomDataset(dataset_module.Dataset):
+        def load_examples(self, split, data_path):
+            return ["example"]
+
+        def render(self, example):
+            return example
+
+    assert not CustomDataset("dataset", splits=["dev"], lazy=True).lazy
+    assert CustomDataset.load_lazy_examples(None, "dev", data_dir) is None
@@ -0,0 +1,303 @@
+"""
+Batch mode of LLM campaigns, tested against a local server mimicking the OpenAI file and batch endpoints.
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from flask import Flask
+
+import factgenie.campaign as campaign_module
+import factgenie.llm_campaign as llm_campaign
+import factgenie.workflows as workflows
+from factgenie.campaign import (
+    CampaignMode,
+    CampaignStatus,
+    ExampleStatus,
+    LLMCampaignGen,
+)
+from factgenie.llm_batch import run_llm_batch_campaign
+from factgenie.models import ModelFactory
+
+
+class BatchAPIHandler(BaseHTTPRequestHandler):
+    files = {}
+    batches = {}
+    # custom ids of the requests which end in the error file
+    failing = set()
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def batch_object(self, batch_id):
+        batch = self.batches[batch_id]
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file_id": batch["input_file_id"],
+            "output_file_id": batch["output_file_id"],
+            "error_file_id": batch["error_file_id"],
+            "completion_window": "24h",
+            "status": "completed",
+            "created_at": 0,
+            "request_counts": {"total": batch["requests"], "completed": batch["requests"], "failed": 0},
+        }
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+
+        if self.path.endswith("/files"):
+            # the uploaded file is the last part of the multipart body with the JSONL content
+            content = body.split(b"\r\n\r\n", 2)[-1].rsplit(b"\r\n--", 1)[0]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = content.decode()
+            self.send_json(
+                {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(content),
+                    "created_at": 0,
+                    "filename": "batch.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        elif self.path.endswith("/batches"):
+            input_file_id = json.loads(body)["input_file_id"]
+            requests = [json.loads(line) for line in self.files[input_file_id].splitlines() if line.strip()]
+            output = [
+                {
+                    "id": f"resp-{r['custom_id']}",
+                    "custom_id": r["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "id": "chatcmpl",
+                            "object": "chat.completion",
+                            "created": 0,
+                            "model": r["body"]["model"],
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "finish_reason": "stop",
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": "out: " + r["body"]["messages"][1]["content"],
+                                    },
+                                }
+                            ],
+                            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                        },
+                    },
+                    "error": None,
+                }
+                for r in requests
+                if r["custom_id"] not in self.failing
+            ]
+            errors = [
+                {
+                    "id": f"resp-{r['custom_id']}",
+                    "custom_id": r["custom_id"],
+                    "response": {"status_code": 400, "body": {"error": {"message": "Invalid request."}}},
+                    "error": None,
+                }
+                for r in requests
+                if r["custom_id"] in self.failing
+            ]
+            file_ids = {}
+
+            for key, lines in [("output_file_id", output), ("error_file_id", errors)]:
+                file_ids[key] = f"file-{len(self.files)}" if lines else None
+
+                if lines:
+                    self.files[file_ids[key]] = "\n".join(json.dumps(line) for line in lines)
+
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {"input_file_id": input_file_id, "requests": len(requests), **file_ids}
+            self.send_json(self.batch_object(batch_id))
+
+    def do_GET(self):
+        if match := re.search(r"/files/([^/]+)/content$", self.path):
+            content = self.files[match.group(1)].encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif match := re.search(r"/batches/([^/]+)$", self.path):
+            self.send_json(self.batch_object(match.group(1)))
+
+
+@pytest.fixture
+def batch_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BatchAPIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    server.shutdown()
+
+
+class Dataset:
+    def get_example(self, split, example_idx):
+        return {"idx": int(example_idx)}
+
+
+@pytest.fixture
+def batch_campaign(tmp_path, monkeypatch, batch_server):
+    monkeypatch.setattr(campaign_module, "CAMPAIGN_DIR", tmp_path)
+    monkeypatch.setattr(workflows, "CAMPAIGN_DIR", tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+    config = {
+        "type": "openai",
+        "model": "gpt-4o-mini",
+        "system_msg": "Generate.",
+        "prompt_template": "Example {data}",
+        "extra_args": {"batch_mode": True, "batch_api_url": batch_server, "batch_poll_interval": 0},
+    }
+
+    campaign_dir = tmp_path / "batch-campaign"
+    (campaign_dir / "files").mkdir(parents=True)
+    pd.DataFrame(
+        {
+            "dataset": "dataset",
+            "split": "dev",
+            "example_idx": range(5),
+            "annotator_id": "",
+            "annotator_group": 0,
+            "status": ExampleStatus.FREE,
+            "start": None,
+            "end": None,
+        }
+    ).to_csv(campaign_dir / "db.csv", index=False)
+
+    with open(campaign_dir / "metadata.json", "w") as f:
+        json.dump(
+            {"id": "batch-campaign", "mode": CampaignMode.LLM_GEN, "status": CampaignStatus.IDLE, "config": config}, f
+        )
+
+    return LLMCampaignGen("batch-campaign"), ModelFactory.from_config(config, mode=CampaignMode.LLM_GEN)
+
+
+def run_batch(campaign, model):
+    with Flask(__name__).app_context():
+        return run_llm_batch_campaign(
+            None,
+            CampaignMode.LLM_GEN,
+            "batch-campaign",
+            None,
+            campaign,
+            {"dataset": Dataset()},
+            model,
+            {"batch-campaign"},
+        )
+
+
+def load_records(campaign):
+    return [json.loads(line) for path in (Path(campaign.dir) / "files").iterdir() for line in open(path)]
+
+
+# the failed requests are only in the error file of the batch, without any output file if all of them fail
+@pytest.mark.parametrize("failing", [set(), {"1", "3"}, {str(i) for i in range(5)}])
+def test_batch_campaign(monkeypatch, batch_campaign, failing):
+    monkeypatch.setattr(BatchAPIHandler, "failing", failing)
+    campaign, model = batch_campaign
+
+    run_batch(campaign, model)
+
+    finished = [i for i in range(5) if str(i) not in failing]
+
+    assert campaign.metadata["status"] == (CampaignStatus.IDLE if failing else CampaignStatus.FINISHED)
+    assert "batch" not in campaign.metadata
+    assert campaign.get_stats()["finished"] == len(finished)
+    assert campaign.get_stats()["free"] == len(failing)
+
+    records = load_records(campaign)
+    assert sorted(r["output"] for r in records) == [f"out: Example {{'idx': {i}}}" for i in finished]
+
+
+def test_batch_ingest_resumed_after_error(monkeypatch, batch_campaign):
+    campaign, model = batch_campaign
+    save_record = workflows.save_record
+    calls = []
+
+    def failing_save_record(**kwargs):
+        calls.append(kwargs)
+
+        if len(calls) == 3:
+            raise OSError("disk full")
+
+        return save_record(**kwargs)
+
+    monkeypatch.setattr(workflows, "save_record", failing_save_record)
+
+    # the batch is kept and ingested again by the next run
+    assert not run_batch(campaign, model).json["success"]
+    assert "batch" in campaign.metadata
+    assert len(load_records(campaign)) == 2
+
+    run_batch(campaign, model)
+
+    assert campaign.metadata["status"] == CampaignStatus.FINISHED
+    assert sorted(r["example_idx"] for r in load_records(campaign)) == list(range(5))
+
+
+def test_duplicate_campaign_drops_batch(tmp_path, monkeypatch):
+    for module in [campaign_module, workflows, llm_campaign]:
+        monkeypatch.setattr(module, "CAMPAIGN_DIR", tmp_path)
+
+    campaign_dir = tmp_path / "batch-campaign"
+    (campaign_dir / "files").mkdir(parents=True)
+    (campaign_dir / "batch_input.jsonl").write_text("{}\n")
+    pd.DataFrame(
+        {
+            "dataset": "dataset",
+            "split": "dev",
+            "example_idx": range(2),
+            "annotator_id": "",
+            "annotator_group": 0,
+            "status": ExampleStatus.FINISHED,
+            "start": None,
+            "end": None,
+        }
+    ).to_csv(campaign_dir / "db.csv", index=False)
+
+    with open(campaign_dir / "metadata.json", "w") as f:
+        json.dump(
+            {
+                "id": "batch-campaign",
+                "mode": CampaignMode.LLM_GEN,
+                "status": CampaignStatus.FINISHED,
+                "config": {},
+                "batch": {"id": "batch-0", "input_file_id": "file-0"},
+                "last_run": 1,
+            },
+            f,
+        )
+
+    app = SimpleNamespace(db={"running_campaigns": set()})
+
+    with Flask(__name__).app_context():
+        llm_campaign.duplicate_llm_campaign(app, CampaignMode.LLM_GEN, "batch-campaign", "batch-campaign-copy")
+
+    with open(tmp_path / "batch-campaign-copy" / "metadata.json") as f:
+        metadata = json.load(f)
+
+    assert "batch" not in metadata and "last_run" not in metadata
+    assert not (tmp_path / "batch-campaign-copy" / "batch_input.jsonl").exists()
@@ -0,0 +1,99 @@
+import litellm
+import pytest
+
+from factgenie.campaign import CampaignMode
+from factgenie.llm_cache import LLMResponseCache
+from factgenie.models import ModelFactory
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = LLMResponseCache(tmp_path / "cache.sqlite")
+    key = cache.make_key({"model": "m", "messages": [{"role": "user", "content": "hi"}], "api_key": "secret"})
+
+    assert cache.get(key) is None
+    cache.put(key, {"choices": [{"message": {"content": "hello"}}]})
+    assert cache.get(key) == {"choices": [{"message": {"content": "hello"}}]}
+
+    # the API key does not influence the response
+    assert key == cache.make_key({"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+    assert key != cache.make_key({"model": "m", "messages": [{"role": "user", "content": "hello"}]})
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(tmp_path / "cache.sqlite", max_entries=2)
+
+    cache.put("a", {"x": 1})
+    cache.put("b", {"x": 2})
+    cache.get("a")
+    cache.put("c", {"x": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"x": 1}
+    assert cache.get("c") == {"x": 3}
+
+
+def test_cache_counts_only_new_entries(tmp_path):
+    cache = LLMResponseCache(tmp_path / "cache.sqlite", max_entries=3)
+
+    for _ in range(3):
+        cache.put("a", {"x": 1})
+
+    assert cache.entry_count == 1
+
+    # another process sharing the cache
+    other = LLMResponseCache(tmp_path / "cache.sqlite", max_entries=3)
+    other.put("b", {"x": 2})
+    other.put("c", {"x": 3})
+
+    cache.put("d", {"x": 4})
+    cache.put("e", {"x": 5})
+
+    assert cache.entry_count == 3
+    assert [cache.get(key) is not None for key in "abcde"] == [False, False, True, True, True]
+
+
+@pytest.mark.parametrize(
+    "model_args, extra_args, cached",
+    [
+        ({"temperature": 0}, {}, True),
+        ({"temperature": "1.0"}, {}, False),
+        ({}, {}, False),
+        ({}, {"use_cache": True}, True),
+    ],
+)
+def test_cache_used_for_deterministic_requests(model_args, extra_args, cached):
+    config = {
+        "type": "openai",
+        "model": "model",
+        "prompt_template": "{data}",
+        "system_msg": "",
+        "model_args": model_args,
+        "extra_args": extra_args,
+    }
+    model = ModelFactory.from_config(config, mode=CampaignMode.LLM_GEN)
+
+    assert (model.get_response_cache() is not None) == cached
+
+
+def test_response_cached_after_parsing(tmp_path, monkeypatch):
+    cache = LLMResponseCache(tmp_path / "cache.sqlite")
+    contents = [None, "hello"]
+
+    def completion(**kwargs):
+        return litellm.ModelResponse(
+            model="model", choices=[{"message": {"role": "assistant", "content": contents.pop(0)}}]
+        )
+
+    monkeypatch.setattr(litellm, "completion", completion)
+
+    config = {"type": "openai", "model": "model", "prompt_template": "{data}", "system_msg": ""}
+    model = ModelFactory.from_config(config, mode=CampaignMode.LLM_GEN)
+    monkeypatch.setattr(model, "get_response_cache", lambda: cache)
+
+    # a response which cannot be processed is not cached, the next call gets a new one
+    with pytest.raises(AttributeError):
+        model.generate_output({"a": 1})
+
+    assert model.generate_output({"a": 1})["output"] == "hello"
+    assert model.generate_output({"a": 1})["metrics"]["cached"]
+    assert model.cache_stats == {"hits": 1, "misses": 2}
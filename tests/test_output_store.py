@@ -0,0 +1,81 @@
+"""
+Parquet storage of the model outputs: round trip, conversion to and from JSONL and indexing.
+"""
+
+import json
+
+import pyarrow.parquet as pq
+
+from factgenie import output_store
+from factgenie.indexes import OutputIndex, get_file_state, refresh_index
+from factgenie.workflows import load_outputs_from_lines, load_outputs_from_parquet
+
+COLS = ["dataset", "split", "setup_id", "example_idx", "output"]
+
+RECORDS = [
+    {
+        "dataset": "dataset",
+        "split": "dev",
+        "setup_id": "setup",
+        "example_idx": i,
+        "output": f"output {i}",
+        "metadata": {"prompt": f"prompt {i}", "model": "m"},
+    }
+    for i in range(5)
+] + [
+    # non-string output and an extra field
+    {"dataset": "dataset", "split": "dev", "setup_id": "setup", "example_idx": 5, "output": {"a": 1}, "score": 0.5}
+]
+
+
+def test_round_trip(tmp_path):
+    path = output_store.save_outputs(tmp_path / "dev-setup", RECORDS, output_format="parquet")
+
+    assert path.suffix == ".parquet"
+    assert output_store.read_parquet(path) == RECORDS
+    assert pq.read_schema(path).field("setup_id").type.value_type == "string"
+
+    # the index columns only
+    assert output_store.read_parquet(path, columns=COLS) == [{k: r[k] for k in COLS} for r in RECORDS]
+
+
+def test_convert(tmp_path):
+    jsonl_path = tmp_path / "dev-setup.jsonl"
+    jsonl_path.write_text("".join(json.dumps(r) + "\n" for r in RECORDS))
+
+    parquet_path = output_store.convert_outputs(jsonl_path, "parquet")
+    assert not jsonl_path.exists()
+    assert output_store.convert_outputs(parquet_path, "parquet") is None
+
+    jsonl_path = output_store.convert_outputs(parquet_path, "jsonl")
+    assert not parquet_path.exists()
+    assert output_store.read_jsonl(jsonl_path) == RECORDS
+
+
+def test_index_parquet(tmp_path):
+    jsonl_path = tmp_path / "a.jsonl"
+    jsonl_path.write_text("".join(json.dumps(r) + "\n" for r in RECORDS[:2]))
+    parquet_path = output_store.save_outputs(tmp_path / "b", RECORDS[2:], output_format="parquet")
+
+    index = OutputIndex(COLS)
+
+    def refresh(cache):
+        files = {str(path): get_file_state(path) for path in [jsonl_path, parquet_path]}
+        return refresh_index(
+            index,
+            files,
+            cache,
+            parse_lines=lambda file_path, lines, first_line_num: load_outputs_from_lines(
+                file_path, lines, COLS, first_line_num
+            ),
+            load_file=lambda file_path: load_outputs_from_parquet(file_path, COLS),
+        )
+
+    cache = refresh({})
+    assert len(index) == 6
+    assert index.get("dataset", "dev", "setup", 5)["output"] == {"a": 1}
+
+    # the Parquet file is loaded again as a whole
+    output_store.write_parquet(parquet_path, RECORDS[2:4])
+    refresh(cache)
+    assert len(index) == 4
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import litellm
+import pytest
+
+from factgenie.rate_limit import (
+    RateLimiter,
+    TokenBucket,
+    get_retry_delay,
+    is_transient_error,
+)
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+
+    # refilled at one token per second
+    assert bucket.wait_time(2) == 2.0
+    # requests larger than the bucket wait only for a full bucket
+    assert bucket.wait_time(120) == 60.0
+
+
+def test_rate_limit_lowers_request_rate():
+    limiter = RateLimiter(rpm=600)
+    limiter.on_rate_limit()
+    limiter.on_rate_limit()
+
+    assert limiter.rate_fraction == pytest.approx(0.25, abs=0.01)
+
+
+def test_retry_delay_and_transient_errors():
+    assert all(0 <= get_retry_delay(attempt, base_delay=1.0, max_delay=8.0) <= 8.0 for attempt in range(10))
+
+    assert is_transient_error(litellm.RateLimitError("429", llm_provider="openai", model="m"))
+    assert not is_transient_error(ValueError("invalid output"))
+
+
+def test_async_acquire_waits_on_the_event_loop():
+    limiter = RateLimiter(rpm=600)
+    limiter.requests.consume(600)
+
+    async def acquire_all():
+        # refilled at 10 requests per second, the waiting coroutines do not occupy any threads
+        threads = threading.active_count()
+        waiting = [asyncio.create_task(limiter.aacquire()) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        assert not any(task.done() for task in waiting)
+        assert threading.active_count() == threads
+
+        await asyncio.wait_for(asyncio.gather(*waiting), timeout=5)
+
+    asyncio.run(acquire_all())
+    assert limiter.requests.tokens < 1
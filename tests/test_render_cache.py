@@ -0,0 +1,121 @@
+"""
+Cache of the rendered examples: LRU eviction, the disk level and the hit counters.
+"""
+
+import factgenie.render_cache as render_cache
+import factgenie.workflows as workflows
+from factgenie.render_cache import RenderCache
+
+
+def make_renderer(calls):
+    def render(key):
+        def _render():
+            calls.append(key)
+            return f"<p>{key[2]}</p>"
+
+        return _render
+
+    return render
+
+
+def test_lru_eviction():
+    calls = []
+    render = make_renderer(calls)
+    cache = RenderCache(max_entries=2)
+
+    keys = [("dataset", "dev", i, "v1") for i in range(3)]
+
+    assert cache.get_or_render(keys[0], render(keys[0])) == "<p>0</p>"
+    cache.get_or_render(keys[1], render(keys[1]))
+    # the first key is used again, the second one gets evicted
+    cache.get_or_render(keys[0], render(keys[0]))
+    cache.get_or_render(keys[2], render(keys[2]))
+    cache.get_or_render(keys[1], render(keys[1]))
+
+    assert calls == [keys[0], keys[1], keys[2], keys[1]]
+    assert cache.get_stats() == {"entries": 2, "hits": 1, "disk_hits": 0, "misses": 4, "prefetched": 0, "hit_rate": 0.2}
+
+    # a new dataset version is rendered again
+    cache.get_or_render(("dataset", "dev", 1, "v2"), render(("dataset", "dev", 1, "v2")))
+    assert len(calls) == 5
+
+
+def test_disk_cache(tmp_path):
+    calls = []
+    render = make_renderer(calls)
+    path = tmp_path / "rendered.sqlite"
+    key = ("dataset", "dev", 0, "v1")
+
+    RenderCache(max_entries=1, path=path).get_or_render(key, render(key))
+
+    # a new process reads the example from the disk
+    cache = RenderCache(max_entries=1, path=path)
+    assert cache.get_or_render(key, render(key)) == "<p>0</p>"
+    assert calls == [key]
+    assert cache.get_stats()["disk_hits"] == 1
+
+    cache.invalidate("dataset")
+    cache.get_or_render(key, render(key))
+    assert calls == [key, key]
+
+
+def test_disk_cache_bounded(tmp_path):
+    calls = []
+    render = make_renderer(calls)
+    path = tmp_path / "rendered.sqlite"
+    keys = [("dataset", "dev", i, "v1") for i in range(3)]
+
+    cache = RenderCache(max_entries=1, path=path, max_disk_entries=2)
+
+    for key in keys[:2]:
+        cache.get_or_render(key, render(key))
+
+    # replacing an example does not count as a new entry
+    cache.put_to_disk(keys[0], "<p>new</p>")
+    assert cache.disk.entry_count == 2
+    assert cache.get_from_disk(keys[1]) == (True, "<p>1</p>")
+
+    # the least recently used example is evicted, also for the caches of the other processes
+    RenderCache(max_entries=1, path=path, max_disk_entries=2).get_or_render(keys[2], render(keys[2]))
+    assert cache.disk.entry_count == 2
+    assert cache.get_from_disk(keys[0]) == (False, None)
+
+
+def test_prefetch_not_counted():
+    calls = []
+    render = make_renderer(calls)
+    cache = RenderCache()
+    key = ("dataset", "dev", 0, "v1")
+
+    cache.get_or_render(key, render(key), prefetch=True)
+    cache.get_or_render(key, render(key))
+
+    assert calls == [key]
+    assert cache.get_stats()["prefetched"] == 1
+    assert cache.get_stats()["hit_rate"] == 1.0
+
+
+def test_prefetch_submissions_are_bounded(monkeypatch):
+    submitted = []
+
+    class Executor:
+        # the submitted examples are never rendered, as if the renderers could not keep up
+        def submit(self, fn, idx):
+            submitted.append(idx)
+
+    class Dataset:
+        def get_example_count(self, split):
+            return 1000
+
+    monkeypatch.setattr(workflows, "prefetch_executor", Executor())
+    monkeypatch.setattr(workflows, "prefetch_pending", set())
+    monkeypatch.setattr(workflows, "get_dataset", lambda app, dataset_id: Dataset())
+    monkeypatch.setattr(render_cache, "get_cache", lambda: RenderCache())
+
+    workflows.prefetch_examples(None, "dataset", "dev", 0, 20)
+    # the examples which are already queued are not submitted again
+    workflows.prefetch_examples(None, "dataset", "dev", 10, 20)
+    assert submitted == list(range(1, 31))
+
+    workflows.prefetch_examples(None, "dataset", "dev", 100, 20)
+    assert len(submitted) == workflows.MAX_PREFETCH_PENDING
@@ -0,0 +1,75 @@
+"""
+Streaming zip exports.
+"""
+
+import io
+import json
+import os
+import zipfile
+
+import pandas as pd
+
+import factgenie.campaign as campaign_module
+import factgenie.workflows as workflows
+from factgenie import utils
+from factgenie.campaign import CampaignMode, ExampleStatus
+
+
+def test_iter_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "ZIP_CHUNK_SIZE", 1024)
+
+    data = os.urandom(10 * 1024)
+    (tmp_path / "data.bin").write_bytes(data)
+    lines = [f'{{"example_idx": {i}}}\n'.encode() for i in range(100)]
+
+    chunks = list(utils.iter_zip([("files/data.bin", tmp_path / "data.bin"), ("outputs.jsonl", iter(lines))]))
+
+    # the archive is produced piece by piece
+    assert len(chunks) > 10
+    assert max(len(chunk) for chunk in chunks) < 2 * 1024
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.read("files/data.bin") == data
+        assert zip_file.read("outputs.jsonl") == b"".join(lines)
+
+
+def test_campaign_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(campaign_module, "CAMPAIGN_DIR", tmp_path)
+    monkeypatch.setattr(workflows, "CAMPAIGN_DIR", tmp_path)
+
+    campaign_dir = tmp_path / "test-campaign"
+    (campaign_dir / "files").mkdir(parents=True)
+
+    with open(campaign_dir / "metadata.json", "w") as f:
+        json.dump({"id": "test-campaign", "mode": CampaignMode.LLM_GEN, "config": {}}, f)
+
+    db = pd.DataFrame(
+        {"example_idx": range(3), "annotator_id": "", "status": ExampleStatus.FREE, "start": None, "end": None}
+    )
+    db.to_csv(campaign_dir / "db.csv", index=False)
+    (campaign_dir / "db_journal.jsonl").write_text(
+        json.dumps({"idx": 1, "status": ExampleStatus.FINISHED, "annotator_id": "model", "start": 1.0, "end": 2.0})
+        + "\n"
+    )
+    (campaign_dir / "files" / "outputs.jsonl").write_text("{}\n")
+
+    # the state of the runs and the materialized statistics
+    for name in [
+        "progress.jsonl",
+        "pause",
+        "batch_input.jsonl",
+        "db.csv.bak",
+        "db.sqlite-wal",
+        ".db.csv.tmp",
+        "stats.json",
+        ".stats.json.tmp",
+    ]:
+        (campaign_dir / name).write_text("")
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(utils.iter_zip(workflows.iter_campaign_export("test-campaign"))))) as f:
+        assert sorted(f.namelist()) == ["db.csv", "files/outputs.jsonl", "metadata.json"]
+
+        # the journaled changes are included
+        exported_db = pd.read_csv(f.open("db.csv"))
+        assert exported_db["status"].tolist() == [ExampleStatus.FREE, ExampleStatus.FINISHED, ExampleStatus.FREE]